@@ -4,8 +4,18 @@ Agent assistance module with optimized structure
 from typing import List, Dict, Optional
 from bson import ObjectId
 from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne, ASCENDING, TEXT
+from pymongo.errors import BulkWriteError, OperationFailure
+import asyncio
+import base64
+import json
+import time
 
-from ai_utils import get_context_from_kb, generate_llm_response, get_query_embedding
+from ai_utils import get_context_from_kb, aget_scored_context_from_kb, generate_llm_response, get_query_embedding, estimate_tokens
+from config import AI_CONFIG
+from conversation_compaction import build_compacted_context, summarize_turns, schedule_compaction
+from agent_context_cache import AgentContext, agent_context_cache
+from metrics import timed, stage
 
                     
 database = None
@@ -20,109 +30,170 @@ def initialize_agent_assist(db):
                                  
                         
                                  
-async def get_or_create_agent_chat(agent_id: str) -> str:
-    """Get existing A_Chat or create new one for agent"""
+@timed("open_agent_chat")
+async def open_agent_chat(agent_id: str, limit: Optional[int] = None) -> Optional[Dict]:
+    """Get or create the agent's A_Chat in one round trip, returning its recent history and summary"""
+    limit = limit or AI_CONFIG["CHAT"]["RECENT_HISTORY"]
     try:
-                                                  
-        existing_chat = await database.a_chats.find_one({"agentId": ObjectId(agent_id)})
-        
-        if existing_chat:
-            return str(existing_chat["_id"])
-        
-                                 
-        new_chat = {
-            "agentId": ObjectId(agent_id),
-            "contents": [],
-            "createdAt": datetime.utcnow(),
-            "updatedAt": datetime.utcnow()
-        }
-        
-        result = await database.a_chats.insert_one(new_chat)
-        return str(result.inserted_id)
-        
+        now = datetime.utcnow()
+        return await database.a_chats.find_one_and_update(
+            {"agentId": ObjectId(agent_id)},
+            {"$setOnInsert": {"contents": [], "createdAt": now, "updatedAt": now}},
+            projection={"contents": {"$slice": -limit}, "summary": 1, "summaryRawTokens": 1, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
     except Exception as e:
         print(f"Error getting/creating agent chat: {e}")
         return None
 
+@timed("get_agent_context")
+async def get_agent_context(agent_id: str) -> Optional[AgentContext]:
+    """Get the agent's company id and recent conversation, from the in-process cache when hot"""
+    context = agent_context_cache.get(agent_id)
+    if context is not None:
+        return context
+
+    agent_data, chat = await asyncio.gather(
+        database.agents.find_one({"_id": ObjectId(agent_id)}, {"companyId": 1}),
+        open_agent_chat(agent_id)
+    )
+    if not chat:
+        return None
+    company_id = str(agent_data.get("companyId")) if agent_data and agent_data.get("companyId") else None
+    return agent_context_cache.put(AgentContext(agent_id, company_id, chat))
+
+async def get_or_create_agent_chat(agent_id: str) -> str:
+    """Get existing A_Chat or create new one for agent"""
+    chat = await open_agent_chat(agent_id)
+    return str(chat["_id"]) if chat else None
+
+@timed("get_agent_chat_history")
 async def get_agent_chat_history(agent_id: str, limit: int = 10) -> List[Dict]:
     """Get recent chat history for an agent"""
     try:
-        chat = await database.a_chats.find_one({"agentId": ObjectId(agent_id)})
+        chat = await database.a_chats.find_one({"agentId": ObjectId(agent_id)}, {"contents": {"$slice": -limit}})
         
         if not chat or not chat.get("contents"):
             return []
         
-                                                      
-        recent_contents = chat["contents"][-limit:]
-        return recent_contents
+        return chat["contents"]
         
     except Exception as e:
         print(f"Error fetching agent chat history: {e}")
         return []
 
-async def store_agent_conversation(agent_id: str, query: str, response: str):
+def build_exchange_messages(query: str, response: str) -> List[Dict]:
+    """Build the agent and bot messages for one exchange"""
+                     
+    agent_message = {
+        "_id": ObjectId(),
+        "role": "agent",
+        "content": query,
+        "attachment": None,
+        "createdAt": datetime.utcnow()
+    }
+    
+                      
+    bot_message = {
+        "_id": ObjectId(),
+        "role": "bot", 
+        "content": response,
+        "attachment": None,
+        "createdAt": datetime.utcnow()
+    }
+    return [agent_message, bot_message]
+
+@timed("store_agent_conversation")
+async def store_agent_conversation(agent_id: str, query: str, response: str, messages: Optional[List[Dict]] = None):
     """Store conversation exchange in MongoDB"""
     try:
-                         
-        agent_message = {
-            "role": "agent",
-            "content": query,
-            "attachment": None,
-            "createdAt": datetime.utcnow()
-        }
-        
-                          
-        bot_message = {
-            "role": "bot", 
-            "content": response,
-            "attachment": None,
-            "createdAt": datetime.utcnow()
-        }
+        messages = messages or build_exchange_messages(query, response)
                                              
-        await database.a_chats.update_one(
+        chat = await database.a_chats.find_one_and_update(
             {"agentId": ObjectId(agent_id)},
             {
                 "$push": {
                     "contents": {
-                        "$each": [agent_message, bot_message]
+                        "$each": messages,
+                        "$slice": -20
                     }
                 },
-                "$set": {"updatedAt": datetime.utcnow()}
+                "$set": {"updatedAt": datetime.utcnow()},
+                "$inc": {"version": 1}
             },
-            upsert=True
-        )
-        
-                                                     
-        await database.a_chats.update_one(
-            {"agentId": ObjectId(agent_id)},
-            {
-                "$push": {
-                    "contents": {
-                        "$each": [],
-                        "$slice": -20                              
-                    }
-                }
-            }
+            projection={"contents": {"$slice": -AI_CONFIG["CHAT"]["RECENT_HISTORY"]}, "summary": 1, "summaryRawTokens": 1, "version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        agent_context_cache.refresh_from_chat(agent_id, chat)
+        await index_agent_messages(agent_id, chat["_id"], messages)
         
+        schedule_compaction(f"agent:{agent_id}", lambda: compact_agent_conversation(agent_id))
         return True
         
     except Exception as e:
         print(f"Error storing agent conversation: {e}")
         return False
 
+def _unsummarized_messages(chat: Dict) -> List[Dict]:
+    """Messages after the chat's summary checkpoint: a message _id, or a timestamp for checkpoints written before ids"""
+    contents = chat.get("contents", [])
+    through_id = chat.get("summarizedThroughId")
+    if through_id:
+        ids = [message.get("_id") for message in contents]
+        return contents[ids.index(through_id) + 1:] if through_id in ids else contents
+    summarized_through = chat.get("summarizedThrough")
+    return [message for message in contents if not summarized_through or message["createdAt"] > summarized_through]
+
+async def compact_agent_conversation(agent_id: str) -> bool:
+    """Fold messages older than the recent window into the chat's running summary"""
+    chat = await database.a_chats.find_one(
+        {"agentId": ObjectId(agent_id)},
+        {"contents": 1, "summary": 1, "summarizedThrough": 1, "summarizedThroughId": 1, "summaryVersion": 1}
+    )
+    if not chat:
+        return False
+
+    older = _unsummarized_messages(chat)[:-AI_CONFIG["CHAT"]["RECENT_HISTORY"]]
+    if len(older) < AI_CONFIG["CHAT"]["COMPACTION_BATCH"] * 2:
+        return False
+
+    turns = [("Agent Question" if message["role"] == "agent" else "AI Response", message["content"]) for message in older]
+    summary = await summarize_turns(chat.get("summary", ""), turns)
+    if summary is None:
+        return False
+
+    checkpoint = {"summarizedThroughId": older[-1]["_id"]} if older[-1].get("_id") else {"summarizedThrough": older[-1]["createdAt"]}
+    # summaryVersion only moves on compaction and clear, so new exchanges stored meanwhile do not void this summary
+    updated_chat = await database.a_chats.find_one_and_update(
+        {"_id": chat["_id"], "summaryVersion": chat.get("summaryVersion")},
+        {
+            "$set": {"summary": summary, **checkpoint},
+            "$inc": {"summaryRawTokens": sum(estimate_tokens(text) for _, text in turns), "summaryVersion": 1, "version": 1}
+        },
+        projection={"contents": {"$slice": -AI_CONFIG["CHAT"]["RECENT_HISTORY"]}, "summary": 1, "summaryRawTokens": 1, "version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    agent_context_cache.refresh_from_chat(agent_id, updated_chat)
+    return updated_chat is not None
+
 async def clear_agent_conversation_memory(agent_id: str) -> bool:
     """Clear conversation memory for an agent"""
     try:
+        agent_context_cache.invalidate(agent_id)
         result = await database.a_chats.update_one(
             {"agentId": ObjectId(agent_id)},
             {
                 "$set": {
                     "contents": [],
                     "updatedAt": datetime.utcnow()
-                }
+                },
+                "$unset": {"summary": "", "summarizedThrough": "", "summarizedThroughId": "", "summaryRawTokens": ""},
+                "$inc": {"summaryVersion": 1, "version": 1}
             }
         )
+        await database.a_chat_messages.delete_many({"agentId": ObjectId(agent_id)})
         return result.modified_count > 0
         
     except Exception as e:
@@ -150,7 +221,8 @@ async def get_agent_conversation_summary(agent_id: str) -> dict:
             "agent_queries": len(agent_queries),
             "bot_responses": len(bot_responses),
             "last_activity": chat.get("updatedAt"),
-            "conversation": contents[-10:] if contents else []                    
+            "summary": chat.get("summary"),
+            "conversation": [{**message, "_id": str(message["_id"])} if "_id" in message else message for message in contents[-10:]]                    
         }
         
     except Exception as e:
@@ -160,11 +232,13 @@ async def get_agent_conversation_summary(agent_id: str) -> dict:
                                  
                                      
                                  
+@timed("get_query_embedding")
 def get_query_embedding(query_text, model):
     if not query_text:
         return None
     return model.encode(f"query: {query_text}").tolist()
 
+@timed("search_pinecone")
 def search_pinecone(index, query_embedding, query, top_k=10):
     if query_embedding is None:
         print("Query embedding is None.")
@@ -203,26 +277,40 @@ def search_pinecone(index, query_embedding, query, top_k=10):
 
                                                       
 
+@timed("get_conversation_context")
 async def get_conversation_context(agent_id: str) -> str:
-    """Get conversation history for context from MongoDB"""
-    history = await get_agent_chat_history(agent_id, limit=5)
-    
-    if not history:
+    """Get the running summary plus recent conversation history for context from MongoDB"""
+    try:
+        chat = await database.a_chats.find_one(
+            {"agentId": ObjectId(agent_id)},
+            {"contents": {"$slice": -AI_CONFIG["CHAT"]["RECENT_HISTORY"]}, "summary": 1, "summaryRawTokens": 1}
+        )
+    except Exception as e:
+        print(f"Error fetching agent conversation context: {e}")
+        return ""
+    return build_agent_conversation_context(chat)
+
+def build_agent_conversation_context(chat: Optional[Dict]) -> str:
+    """Build prompt context from an A_Chat document's summary and recent contents"""
+    if not chat or (not chat.get("contents") and not chat.get("summary")):
         return ""
     
-                                                               
-    context_parts = []
-    
-    for message in history:
+    turns = []
+    for message in chat.get("contents", []):
         if message["role"] == "agent":
-            context_parts.append(f"Agent Question: {message['content']}")
+            turns.append(("Agent Question", message['content']))
         else:       
-            context_parts.append(f"AI Response: {message['content']}")
+            turns.append(("AI Response", message['content']))
     
-    return "\n".join(context_parts)
+    return build_compacted_context(chat.get("summary", ""), turns, chat.get("summaryRawTokens", 0))
 
 def generate_agent_assistance(context_chunks: List[str], question: str, conversation_context: str = "") -> str:
     """Generate response specifically for assisting human agents"""
+    with stage("build_prompt"):
+        prompt, system_prompt = _agent_assistance_prompt(context_chunks, question, conversation_context)
+    return generate_llm_response(prompt, system_prompt)
+
+def _agent_assistance_prompt(context_chunks: List[str], question: str, conversation_context: str = "") -> tuple:
     context = "\n\n".join(context_chunks) if context_chunks else "No specific knowledge base information found."
     
                                         
@@ -257,47 +345,55 @@ Agent's Question: {question}
 Provide a helpful response to assist the human agent. Be concise and actionable. If suggesting customer responses, clearly indicate "You can tell the customer:" or "Suggested response to customer:"
 """
 
-    return generate_llm_response(prompt, system_prompt)
+    return prompt, system_prompt
 
                                  
                                       
                                  
-async def answer_agent_query(query: str, agent_id: str) -> dict:
-    """Main function to answer agent queries with MongoDB conversation memory"""
+async def answer_agent_query(query: str, agent_id: str, background_tasks=None) -> dict:
+    """Main function to answer agent queries with MongoDB conversation memory
+
+    When FastAPI `background_tasks` are passed, the exchange is persisted after
+    the response has been sent instead of before it.
+    """
     
     try:
-                                                             
-        agent_data = await database.agents.find_one({"_id": ObjectId(agent_id)})
-        company_id = str(agent_data.get("companyId")) if agent_data and agent_data.get("companyId") else None
-        
-                                  
-        chat_id = await get_or_create_agent_chat(agent_id)
-        if not chat_id:
+        context = await get_agent_context(agent_id)
+        if not context:
             return {
                 "error": "Failed to create/access agent chat session",
                 "agent_id": agent_id
             }
+        company_id = context.company_id
+        chat_id = context.chat_id
         
-                                               
-        conversation_context = await get_conversation_context(agent_id)
+        conversation_context = build_agent_conversation_context(context.as_chat())
         
                                                                                  
-        context_chunks = get_context_from_kb(query, company_id=company_id)
+        scored_chunks = await aget_scored_context_from_kb(query, company_id=company_id, endpoint="agent")
+        context_chunks = [chunk["text"] for chunk in scored_chunks]
         
         if not context_chunks:
             response = "I couldn't find specific information in the knowledge base for this query. However, I can help you with general guidance. What specific aspect of this issue would you like assistance with?"
         else:
             response = generate_agent_assistance(context_chunks, query, conversation_context)
         
-                                        
-        stored = await store_agent_conversation(agent_id, query, response)
+        messages = build_exchange_messages(query, response)
+        context.record_messages(messages)
+        if background_tasks is not None:
+            background_tasks.add_task(store_agent_conversation, agent_id, query, response, messages)
+            stored, storage = False, "deferred"
+        else:
+            stored, storage = await store_agent_conversation(agent_id, query, response, messages), "immediate"
         
         return {
             "answer": response,
-            "sources": context_chunks[:3],                                      
+            "sources": context_chunks[:3],
+            "source_scores": [chunk["score"] for chunk in scored_chunks[:3]],                                      
             "agent_id": agent_id,
             "chat_id": chat_id,
-            "stored": stored
+            "stored": stored,
+            "storage": storage
         }
     except Exception as e:
         print(f"Error in answer_agent_query: {e}")
@@ -358,40 +454,159 @@ async def get_agent_chat_analytics(agent_id: str) -> dict:
         print(f"Error getting agent chat analytics: {e}")
         return {"error": str(e), "agent_id": agent_id}
 
-async def search_agent_conversations(agent_id: str, search_query: str, limit: int = 10) -> dict:
-    """Search through agent's conversation history"""
+                                 
+                                    
+                                 
+SEARCH_BACKFILL_VERSION = 2
+
+async def ensure_agent_search_indexes():
+    """Create the text and uniqueness indexes behind agent conversation search"""
+    await database.a_chat_messages.create_index(
+        [("agentId", ASCENDING), ("content", TEXT)],
+        name="agent_message_text"
+    )
+    try:
+        # The old (agentId, createdAt, role) key rejected two messages stored in the same millisecond
+        await database.a_chat_messages.drop_index("agent_message_unique")
+    except OperationFailure:
+        pass
+    await database.a_chat_messages.create_index(
+        [("messageId", ASCENDING)],
+        name="agent_message_id",
+        unique=True,
+        partialFilterExpression={"messageId": {"$exists": True}}
+    )
+
+def _searchable_message(agent_id: ObjectId, chat_id, message: Dict) -> Dict:
+    row = {
+        "agentId": agent_id,
+        "chatId": chat_id,
+        "role": message["role"],
+        "content": message.get("content", ""),
+        "createdAt": message["createdAt"]
+    }
+    if message.get("_id"):
+        row["messageId"] = message["_id"]
+    return row
+
+def _backfill_operations(chat: Dict) -> List[UpdateOne]:
+    """Upserts indexing one chat's messages, tagging rows indexed before they carried a messageId"""
+    operations = []
+    for message in chat.get("contents", []):
+        if not message.get("createdAt"):
+            continue
+        row = _searchable_message(chat["agentId"], chat["_id"], message)
+        legacy_key = {"agentId": chat["agentId"], "createdAt": message["createdAt"], "role": message["role"], "messageId": {"$exists": False}}
+        if "messageId" not in row:
+            operations.append(UpdateOne(legacy_key, {"$setOnInsert": row}, upsert=True))
+            continue
+        operations.append(UpdateOne(legacy_key, {"$set": {"messageId": row["messageId"], "content": row["content"]}}))
+        operations.append(UpdateOne({"messageId": row["messageId"]}, {"$setOnInsert": row}, upsert=True))
+    return operations
+
+@timed("index_agent_messages")
+async def index_agent_messages(agent_id: str, chat_id, messages: List[Dict]) -> int:
+    """Copy chat messages into the searchable a_chat_messages collection"""
+    agent_oid = ObjectId(agent_id)
+    try:
+        result = await database.a_chat_messages.insert_many(
+            [_searchable_message(agent_oid, chat_id, message) for message in messages],
+            ordered=False
+        )
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        return e.details.get("nInserted", 0)
+    except Exception as e:
+        print(f"Error indexing agent messages: {e}")
+        return 0
+
+async def backfill_agent_search_index() -> int:
+    """Index messages already stored in a_chats, skipping ones that are indexed
+
+    Runs once per SEARCH_BACKFILL_VERSION: completion is recorded in
+    a_chat_search_state, and later messages are indexed as they are stored.
+    Rows indexed before they carried a messageId are tagged in place, so
+    messages already gone from the chat window stay searchable.
+    """
+    indexed = 0
+    try:
+        state = await database.a_chat_search_state.find_one({"_id": "backfill"})
+        if state and state.get("status") == "complete" and state.get("version") == SEARCH_BACKFILL_VERSION:
+            return 0
+        async for chat in database.a_chats.find({}, {"agentId": 1, "contents": 1}):
+            operations = _backfill_operations(chat)
+            if operations:
+                # Ordered so a legacy row is tagged before its message's upsert runs
+                result = await database.a_chat_messages.bulk_write(operations, ordered=True)
+                indexed += result.upserted_count
+        await database.a_chat_search_state.update_one(
+            {"_id": "backfill"},
+            {"$set": {"status": "complete", "version": SEARCH_BACKFILL_VERSION, "completedAt": datetime.utcnow(), "indexed": indexed}},
+            upsert=True
+        )
+    except Exception as e:
+        print(f"Error backfilling agent search index: {e}")
+    return indexed
+
+def _encode_search_cursor(score: float, message_id: ObjectId) -> str:
+    payload = json.dumps({"s": score, "i": str(message_id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def _decode_search_cursor(cursor: str) -> Dict:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return {"score": float(payload["s"]), "message_id": ObjectId(payload["i"])}
+    except Exception:
+        raise ValueError("Invalid search cursor")
+
+@timed("search_agent_conversations")
+async def search_agent_conversations(agent_id: str, search_query: str, limit: int = 10, cursor: Optional[str] = None) -> dict:
+    """Search through agent's conversation history, ranked by text relevance
+
+    Results are ordered by text score then recency. Pass the returned
+    `next_cursor` back as `cursor` to fetch the next page.
+    """
+    started = time.perf_counter()
+    after = _decode_search_cursor(cursor) if cursor else None
     try:
-                                                 
         pipeline = [
-            {"$match": {"agentId": ObjectId(agent_id)}},
-            {"$unwind": "$contents"},
-            {
+            {"$match": {"agentId": ObjectId(agent_id), "$text": {"$search": search_query}}},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ]
+        if after:
+            pipeline.append({
                 "$match": {
-                    "contents.content": {
-                        "$regex": search_query,
-                        "$options": "i"                    
-                    }
+                    "$or": [
+                        {"score": {"$lt": after["score"]}},
+                        {"score": after["score"], "_id": {"$lt": after["message_id"]}}
+                    ]
                 }
-            },
-            {"$limit": limit},
-            {"$sort": {"contents.createdAt": -1}}
+            })
+        pipeline += [
+            {"$sort": {"score": -1, "_id": -1}},
+            {"$limit": limit + 1}
         ]
-        results = await database.a_chats.aggregate(pipeline).to_list(length=limit)
+        results = await database.a_chat_messages.aggregate(pipeline).to_list(length=limit + 1)
         
+        page = results[:limit]
         matched_messages = []
-        for result in results:
+        for result in page:
             matched_messages.append({
-                "content": result["contents"]["content"],
-                "role": result["contents"]["role"],
-                "created_at": result["contents"]["createdAt"],
-                "chat_id": str(result["_id"])
+                "message_id": str(result.get("messageId") or result["_id"]),
+                "content": result["content"],
+                "role": result["role"],
+                "created_at": result["createdAt"],
+                "chat_id": str(result["chatId"]),
+                "score": result["score"]
             })
         
         return {
             "agent_id": agent_id,
             "search_query": search_query,
             "matches_found": len(matched_messages),
-            "results": matched_messages
+            "results": matched_messages,
+            "next_cursor": _encode_search_cursor(page[-1]["score"], page[-1]["_id"]) if len(results) > limit else None,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
         }
         
     except Exception as e:
@@ -448,7 +663,8 @@ async def get_ticket_ai_response(query: str, ticket_id: str, agent_id: str, tick
         company_id = str(ticket_data.get("companyId")['_id']) if ticket_data.get("companyId") else None
         
                                                                              
-        kb_context = get_context_from_kb(f"{query}", company_id=company_id)
+        kb_context = get_context_from_kb(f"{query}", company_id=company_id, endpoint="ticket")
+        kb_text = "\n\n".join(kb_context)
         
                                                  
         prompt = f"""
@@ -458,7 +674,7 @@ async def get_ticket_ai_response(query: str, ticket_id: str, agent_id: str, tick
         {ticket_context}
         
         Additional knowledge base information:
-        {kb_context}
+        {kb_text}
         
         The agent's question about this ticket is: {query}
         
@@ -484,6 +700,7 @@ async def get_ticket_ai_response(query: str, ticket_id: str, agent_id: str, tick
             "error": str(e)
         }
 
+@timed("get_customer_ticket_history")
 async def get_customer_ticket_history(customer_id: str, limit: int = 5) -> list:
     """Get customer's ticket history"""
     try:
@@ -517,6 +734,7 @@ async def get_customer_ticket_history(customer_id: str, limit: int = 5) -> list:
         print(f"Error getting customer ticket history: {e}")
         return []
 
+@timed("get_similar_tickets")
 async def get_similar_tickets(ticket_id: str, limit: int = 3) -> list:
     """Get tickets similar to the current one"""
     try:
@@ -0,0 +1,136 @@
+"""
+In-process per-agent context cache for agent assist
+
+Coherence rules for multi-worker deployments:
+- MongoDB stays the source of truth. Every write to an agent's A_Chat goes to
+  MongoDB and increments the document's `version`.
+- A worker refreshes its entry from the document returned by its own write
+  (find_one_and_update with the post-write projection), but only when that
+  document's version is newer than the cached one. Writes made by other
+  workers in between are picked up in that same round trip. Messages recorded
+  ahead of a deferred write are kept until a refresh shows them written.
+- Writes this worker never sees (another worker answering the same agent, or
+  the Node server editing the agent) are bounded by MAX_AGE_SECONDS: an older
+  entry is treated as a miss and reloaded, even if it is in constant use.
+- Clearing a session invalidates the local entry. Idle entries are evicted
+  after IDLE_TTL_SECONDS and the cache holds at most MAX_AGENTS entries (LRU).
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import AI_CONFIG
+
+class AgentContext:
+    """Company id, running summary and recent conversation window for one agent"""
+
+    def __init__(self, agent_id: str, company_id: Optional[str], chat: Dict):
+        self.agent_id = agent_id
+        self.company_id = company_id
+        self.chat_id = str(chat["_id"])
+        self.loaded_at = time.monotonic()
+        self.last_access = self.loaded_at
+        self.pending: List[Dict] = []
+        self.apply_chat(chat)
+
+    def apply_chat(self, chat: Dict) -> None:
+        """Take the window and summary from an authoritative A_Chat document, keeping messages not yet written"""
+        contents = list(chat.get("contents", []))
+        written = {message["_id"] for message in contents if "_id" in message}
+        self.pending = [message for message in self.pending if message["_id"] not in written]
+        self.messages = (contents + self.pending)[-AI_CONFIG["CHAT"]["RECENT_HISTORY"]:]
+        self.summary = chat.get("summary", "")
+        self.summary_raw_tokens = chat.get("summaryRawTokens", 0)
+        self.version = chat.get("version", 0)
+
+    def record_messages(self, messages: List[Dict]) -> None:
+        """Optimistically append messages ahead of the (possibly deferred) write"""
+        self.pending.extend(message for message in messages if "_id" in message)
+        self.messages = (self.messages + messages)[-AI_CONFIG["CHAT"]["RECENT_HISTORY"]:]
+
+    def as_chat(self) -> Dict:
+        """Shape the cached context like the A_Chat projection the prompt builders expect"""
+        return {
+            "_id": self.chat_id,
+            "contents": self.messages,
+            "summary": self.summary,
+            "summaryRawTokens": self.summary_raw_tokens,
+        }
+
+class AgentContextCache:
+    """LRU cache of AgentContext entries with idle and max-age expiry"""
+
+    def __init__(self, idle_ttl: float, max_age: float, max_agents: int):
+        self.idle_ttl = idle_ttl
+        self.max_age = max_age
+        self.max_agents = max_agents
+        self._entries: "OrderedDict[str, AgentContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0, "refreshed": 0}
+
+    def _is_fresh(self, context: AgentContext, now: float) -> bool:
+        return now - context.last_access < self.idle_ttl and now - context.loaded_at < self.max_age
+
+    def get(self, agent_id: str) -> Optional[AgentContext]:
+        """Get a fresh context for the agent, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            context = self._entries.get(agent_id)
+            if context is None:
+                self.stats["misses"] += 1
+                return None
+            if not self._is_fresh(context, now):
+                del self._entries[agent_id]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            context.last_access = now
+            self._entries.move_to_end(agent_id)
+            self.stats["hits"] += 1
+            return context
+
+    def put(self, context: AgentContext) -> AgentContext:
+        """Insert a freshly loaded context, evicting idle and least recently used entries"""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[context.agent_id] = context
+            self._entries.move_to_end(context.agent_id)
+            for agent_id in [agent_id for agent_id, entry in self._entries.items() if not self._is_fresh(entry, now)]:
+                del self._entries[agent_id]
+                self.stats["evicted"] += 1
+            while len(self._entries) > self.max_agents:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+        return context
+
+    def refresh_from_chat(self, agent_id: str, chat: Optional[Dict]) -> None:
+        """Merge a post-write A_Chat document into the agent's entry, if cached and newer"""
+        with self._lock:
+            context = self._entries.get(agent_id)
+            if context is None or not chat:
+                return
+            if chat.get("version", 0) > context.version:
+                context.apply_chat(chat)
+                self.stats["refreshed"] += 1
+
+    def invalidate(self, agent_id: str) -> None:
+        """Drop the agent's entry so the next query reloads it from MongoDB"""
+        with self._lock:
+            if self._entries.pop(agent_id, None) is not None:
+                self.stats["invalidated"] += 1
+
+    def get_stats(self) -> Dict:
+        """Get cache size and hit/miss counters"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+        }
+
+agent_context_cache = AgentContextCache(
+    idle_ttl=AI_CONFIG["AGENT_CONTEXT_CACHE"]["IDLE_TTL_SECONDS"],
+    max_age=AI_CONFIG["AGENT_CONTEXT_CACHE"]["MAX_AGE_SECONDS"],
+    max_agents=AI_CONFIG["AGENT_CONTEXT_CACHE"]["MAX_AGENTS"],
+)
@@ -6,8 +6,10 @@ from langchain_core.messages import HumanMessage
 from pinecone import Pinecone
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict, Optional
+import asyncio
 
 from config import AI_CONFIG, EMBED_MODEL_NAME
+from metrics import timed, stage
 
                           
 model_st = SentenceTransformer(EMBED_MODEL_NAME)
@@ -22,10 +24,16 @@ llm = ChatGoogleGenerativeAI(
     google_api_key=AI_CONFIG["GOOGLE"]["API_KEY"]
 )
 
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the number of LLM tokens in a text (about 4 characters per token)"""
+    return (len(text) + 3) // 4 if text else 0
+
+@timed("get_query_embedding")
 def get_query_embedding(query_text: str) -> List[float]:
     """Get embedding for a query text"""
     return model_st.encode(query_text).tolist()
 
+@timed("search_pinecone")
 def search_pinecone(query_embedding: List[float], query: str, top_k: int = 10, company_id: Optional[str] = None) -> List[Dict]:
     """Search Pinecone for similar documents"""
     namespace = AI_CONFIG["PINECONE"]["NAMESPACE"]
@@ -50,20 +58,87 @@ def search_pinecone(query_embedding: List[float], query: str, top_k: int = 10, c
     
     return results.matches if results else []
 
-def get_context_from_kb(query: str, company_id: Optional[str] = None) -> List[str]:
-    """Get relevant context from knowledge base"""
-    embedding = get_query_embedding(query)
+def _shingles(text: str, size: int = 3) -> set:
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def pack_context(chunks: List[Dict], token_budget: int, max_chunks: Optional[int] = None) -> List[Dict]:
+    """Deduplicate near-identical chunks and fill a token budget in score order
+
+    Each chunk is a dict with "text" and "score". Chunks that do not fit the
+    remaining budget are skipped so smaller, lower-scored chunks can still fill it.
+    """
+    max_chunks = max_chunks or AI_CONFIG["CHAT"]["MAX_CONTEXT_CHUNKS"]
+    similarity = AI_CONFIG["CHAT"]["DEDUP_SIMILARITY"]
+
+    packed = []
+    kept_shingles = []
+    used_tokens = 0
+    for chunk in sorted(chunks, key=lambda item: item.get("score") or 0.0, reverse=True):
+        text = (chunk.get("text") or "").strip()
+        if not text:
+            continue
+
+        shingles = _shingles(text)
+        if any(len(shingles & kept) / len(shingles | kept) >= similarity for kept in kept_shingles):
+            continue
+
+        tokens = estimate_tokens(text)
+        if used_tokens + tokens > token_budget:
+            if packed:
+                continue
+            text = text[:token_budget * 4]
+            tokens = estimate_tokens(text)
+
+        packed.append({"text": text, "score": chunk.get("score"), "tokens": tokens})
+        kept_shingles.append(shingles)
+        used_tokens += tokens
+        if len(packed) >= max_chunks or used_tokens >= token_budget:
+            break
+    return packed
+
+def get_scored_context_from_kb(query: str, company_id: Optional[str] = None, embedding: Optional[List[float]] = None, endpoint: str = "default") -> List[Dict]:
+    """Get deduplicated, score-ordered knowledge base chunks that fit the endpoint's token budget"""
+    if embedding is None:
+        embedding = get_query_embedding(query)
     results = search_pinecone(embedding, query, top_k=AI_CONFIG["CHAT"]["TOP_K_RESULTS"], company_id=company_id)
     if not results:
         return []
-    return [item.metadata.get("text", "") for item in results]
 
-def generate_llm_response(prompt: str, system_prompt: Optional[str] = None) -> str:
-    """Generate response from LLM"""
+    budgets = AI_CONFIG["CHAT"]["CONTEXT_TOKEN_BUDGETS"]
+    chunks = [{"text": item.metadata.get("text", ""), "score": getattr(item, "score", None)} for item in results]
+    with stage("pack_context"):
+        return pack_context(chunks, budgets.get(endpoint, budgets["default"]))
+
+def get_context_from_kb(query: str, company_id: Optional[str] = None, embedding: Optional[List[float]] = None, endpoint: str = "default") -> List[str]:
+    """Get relevant context from knowledge base"""
+    return [chunk["text"] for chunk in get_scored_context_from_kb(query, company_id, embedding, endpoint)]
+
+async def aget_query_embedding(query_text: str) -> List[float]:
+    """Get embedding for a query text without blocking the event loop"""
+    return await asyncio.to_thread(get_query_embedding, query_text)
+
+async def aget_scored_context_from_kb(query: str, company_id: Optional[str] = None, embedding: Optional[List[float]] = None, endpoint: str = "default") -> List[Dict]:
+    """Get budgeted knowledge base chunks with scores without blocking the event loop"""
+    return await asyncio.to_thread(get_scored_context_from_kb, query, company_id, embedding, endpoint)
+
+async def aget_context_from_kb(query: str, company_id: Optional[str] = None, embedding: Optional[List[float]] = None, endpoint: str = "default") -> List[str]:
+    """Get relevant context from knowledge base without blocking the event loop"""
+    return await asyncio.to_thread(get_context_from_kb, query, company_id, embedding, endpoint)
+
+def _build_llm_messages(prompt: str, system_prompt: Optional[str] = None) -> List[HumanMessage]:
     messages = []
     if system_prompt:
         messages.append(HumanMessage(content=f"You are acting as an AI assistant. {system_prompt}"))
     messages.append(HumanMessage(content=prompt))
+    return messages
+
+@timed("generate_llm_response")
+def generate_llm_response(prompt: str, system_prompt: Optional[str] = None) -> str:
+    """Generate response from LLM"""
+    messages = _build_llm_messages(prompt, system_prompt)
     
     try:
         response = llm.invoke(messages)
@@ -71,3 +146,17 @@ def generate_llm_response(prompt: str, system_prompt: Optional[str] = None) -> s
     except Exception as e:
         print(f"Error generating LLM response: {e}")
         return "I apologize, but I'm having trouble processing your request at the moment."
+
+@timed("ainvoke_llm")
+async def ainvoke_llm(prompt: str, system_prompt: Optional[str] = None) -> str:
+    """Generate response from LLM without blocking the event loop, raising on errors"""
+    response = await llm.ainvoke(_build_llm_messages(prompt, system_prompt))
+    return response.content
+
+async def agenerate_llm_response(prompt: str, system_prompt: Optional[str] = None) -> str:
+    """Generate response from LLM without blocking the event loop"""
+    try:
+        return await ainvoke_llm(prompt, system_prompt)
+    except Exception as e:
+        print(f"Error generating LLM response: {e}")
+        return "I apologize, but I'm having trouble processing your request at the moment."
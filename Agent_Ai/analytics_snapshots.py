@@ -0,0 +1,422 @@
+"""
+Columnar analytics snapshots
+
+A periodic job exports one row per ticket (agent, status, creation time,
+handling time, CSAT, AI category and priority, solution scores) to Parquet
+files partitioned by company and month:
+
+    {DIRECTORY}/{company_id}/{YYYY-MM}.parquet
+    {DIRECTORY}/{company_id}/manifest.json
+
+The first export of a company covers its whole history; later runs rewrite
+only the last REFRESH_MONTHS months, since older tickets rarely change, and
+drop partitions for months in that window that no longer have tickets. Files
+are written to a unique temporary name and renamed into place, so readers
+never see a partial partition.
+
+Each company's export holds a lease document in `snapshotexportleases`, so
+only one worker or process exports a company at a time. The lease expires
+after LEASE_SECONDS, is renewed after every partition, and an export that
+finds its lease taken over stops before writing its manifest.
+
+Historical analytics read the partitions a date range covers with memory
+mapping and aggregate them with pandas, without touching MongoDB. Snapshot
+results are as fresh as the last export (see the manifest).
+"""
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, BackgroundTasks
+from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+from config import AI_CONFIG
+from performance_rollups import SOLUTION_SCORE_KEYS, calculate_handling_time
+from ticket_analytics import field_key, TREND_GRANULARITIES
+from error_handler import validate_object_id
+from quantile_sketch import DEFAULT_QUANTILES
+
+snapshot_router = APIRouter(prefix="/snapshots", tags=["Analytics Snapshots"])
+
+database = None
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ("ticket_id", pa.string()),
+        ("agent_id", pa.string()),
+        ("status", pa.string()),
+        ("created_at", pa.timestamp("ms")),
+        ("handling_minutes", pa.float64()),
+        ("csat", pa.float64()),
+        ("category", pa.string()),
+        ("priority", pa.float64()),
+    ]
+    + [(key, pa.float64()) for key in SOLUTION_SCORE_KEYS]
+)
+
+def initialize_analytics_snapshots(db):
+    """Initialize MongoDB connection for snapshot exports"""
+    global database
+    database = db
+
+class SnapshotExportRequest(BaseModel):
+    company_id: Optional[str] = None
+    full: bool = False
+
+def _company_dir(company_id: str) -> str:
+    """A company's snapshot directory, rejecting ids that are not ObjectIds or escape DIRECTORY"""
+    root = os.path.realpath(AI_CONFIG["SNAPSHOTS"]["DIRECTORY"])
+    path = os.path.realpath(os.path.join(root, str(validate_object_id(company_id, "company"))))
+    if os.path.dirname(path) != root:
+        raise HTTPException(status_code=400, detail="Invalid company ID format")
+    return path
+
+def _month_key(value: datetime) -> str:
+    return value.strftime("%Y-%m")
+
+def _refresh_start(now: datetime) -> datetime:
+    months_back = AI_CONFIG["SNAPSHOTS"]["REFRESH_MONTHS"] - 1
+    year, month = divmod(now.year * 12 + now.month - 1 - months_back, 12)
+    return datetime(year, month + 1, 1)
+
+def read_manifest(company_id: str) -> Optional[Dict]:
+    """Read a company's snapshot manifest, or None if it was never exported"""
+    try:
+        with open(os.path.join(_company_dir(company_id), "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _replace_file(path: str, write) -> None:
+    """Write a file through a uniquely named temporary file in the same directory, then rename it into place"""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as f:
+        temp_path = f.name
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def _write_json(path: str, data: Dict) -> None:
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+def _write_manifest(company_id: str, manifest: Dict) -> None:
+    _replace_file(os.path.join(_company_dir(company_id), "manifest.json"), lambda path: _write_json(path, manifest))
+
+def _write_partition(company_id: str, month: str, columns: Dict[str, List]) -> int:
+    os.makedirs(_company_dir(company_id), exist_ok=True)
+    table = pa.Table.from_pydict(columns, schema=SNAPSHOT_SCHEMA)
+    _replace_file(os.path.join(_company_dir(company_id), f"{month}.parquet"), lambda path: pq.write_table(table, path))
+    return len(columns["ticket_id"])
+
+def _remove_partitions(company_id: str, months: List[str]) -> None:
+    for month in months:
+        try:
+            os.remove(os.path.join(_company_dir(company_id), f"{month}.parquet"))
+        except FileNotFoundError:
+            pass
+
+def snapshot_pipeline(company_oid: ObjectId, since: Optional[datetime] = None) -> List[Dict]:
+    """Aggregation producing one snapshot row per ticket, ordered by creation time"""
+    match: Dict = {"companyId": company_oid}
+    if since:
+        match["createdAt"] = {"$gte": since}
+    return [
+        {"$match": match},
+        {"$sort": {"createdAt": 1}},
+        {"$project": {"agentId": 1, "status": 1, "createdAt": 1}},
+        {"$lookup": {"from": "utiltickets", "localField": "_id", "foreignField": "ticketId", "as": "util"}},
+        {"$lookup": {"from": "aitickets", "localField": "_id", "foreignField": "ticketId", "as": "ai"}},
+        {"$lookup": {"from": "solutiongrades", "localField": "_id", "foreignField": "ticketId", "as": "grade"}},
+        {"$project": {
+            "agentId": 1,
+            "status": 1,
+            "createdAt": 1,
+            "util": {"$arrayElemAt": ["$util", 0]},
+            "category": {"$arrayElemAt": ["$ai.category", 0]},
+            "priority": {"$arrayElemAt": ["$ai.priority_rate", 0]},
+            "analysis": {"$arrayElemAt": ["$grade.analysis", 0]}
+        }}
+    ]
+
+def _empty_columns() -> Dict[str, List]:
+    return {name: [] for name in SNAPSHOT_SCHEMA.names}
+
+def _append_row(columns: Dict[str, List], ticket: Dict) -> None:
+    util = ticket.get('util') or {}
+    analysis = ticket.get('analysis') or {}
+    handling_time = calculate_handling_time(ticket, util)
+    columns["ticket_id"].append(str(ticket['_id']))
+    columns["agent_id"].append(str(ticket['agentId']) if ticket.get('agentId') else None)
+    columns["status"].append(ticket.get('status'))
+    columns["created_at"].append(ticket['createdAt'])
+    columns["handling_minutes"].append(handling_time if handling_time > 0 else None)
+    columns["csat"].append(util.get('customer_review_rating') or None)
+    columns["category"].append(ticket.get('category'))
+    columns["priority"].append(ticket.get('priority'))
+    for key in SOLUTION_SCORE_KEYS:
+        columns[key].append(analysis.get(key) if isinstance(analysis.get(key), (int, float)) else None)
+
+async def _acquire_export_lease(company_id: str) -> Optional[ObjectId]:
+    """Take a company's export lease if it is free or expired, returning its token or None if another export holds it"""
+    token = ObjectId()
+    now = datetime.utcnow()
+    try:
+        await database.snapshotexportleases.update_one(
+            {"_id": company_id, "expiresAt": {"$lte": now}},
+            {"$set": {"token": token, "expiresAt": now + timedelta(seconds=AI_CONFIG["SNAPSHOTS"]["LEASE_SECONDS"])}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return None
+    return token
+
+async def _renew_export_lease(company_id: str, token: ObjectId) -> None:
+    """Extend a held export lease, raising if another export has taken it over"""
+    result = await database.snapshotexportleases.update_one(
+        {"_id": company_id, "token": token},
+        {"$set": {"expiresAt": datetime.utcnow() + timedelta(seconds=AI_CONFIG["SNAPSHOTS"]["LEASE_SECONDS"])}}
+    )
+    if not result.matched_count:
+        raise RuntimeError(f"Snapshot export lease for company {company_id} was lost")
+
+async def _release_export_lease(company_id: str, token: ObjectId) -> None:
+    await database.snapshotexportleases.delete_one({"_id": company_id, "token": token})
+
+async def export_company_snapshot(company_id: str, full: bool = False) -> Dict:
+    """Export a company's tickets to monthly Parquet partitions, returning the updated manifest
+
+    Waits for another worker's export of the same company to finish first.
+    """
+    while True:
+        token = await _acquire_export_lease(company_id)
+        if token:
+            break
+        await asyncio.sleep(AI_CONFIG["SNAPSHOTS"]["LEASE_RETRY_SECONDS"])
+    try:
+        return await _export_company_snapshot(company_id, full, token)
+    finally:
+        await _release_export_lease(company_id, token)
+
+async def _export_company_snapshot(company_id: str, full: bool, token: ObjectId) -> Dict:
+    previous = read_manifest(company_id)
+    now = datetime.utcnow()
+    since = None if full or not previous else _refresh_start(now)
+    manifest = previous if previous and since else {"months": {}}
+    exported_months = set()
+
+    cursor = database.tickets.aggregate(
+        snapshot_pipeline(ObjectId(company_id), since), allowDiskUse=True
+    ).batch_size(AI_CONFIG["SNAPSHOTS"]["CURSOR_BATCH_SIZE"])
+    month, columns = None, _empty_columns()
+    async for ticket in cursor:
+        if not ticket.get('createdAt'):
+            continue
+        ticket_month = _month_key(ticket['createdAt'])
+        if month and ticket_month != month:
+            rows = await asyncio.to_thread(_write_partition, company_id, month, columns)
+            manifest["months"][month] = {"rows": rows, "exportedAt": now.isoformat()}
+            exported_months.add(month)
+            columns = _empty_columns()
+            await _renew_export_lease(company_id, token)
+        month = ticket_month
+        _append_row(columns, ticket)
+    if month:
+        rows = await asyncio.to_thread(_write_partition, company_id, month, columns)
+        manifest["months"][month] = {"rows": rows, "exportedAt": now.isoformat()}
+        exported_months.add(month)
+
+    # Months the export covered that no longer have any tickets
+    first_month = _month_key(since) if since else ""
+    emptied = [key for key in (previous or {"months": {}})["months"] if key >= first_month and key not in exported_months]
+    for key in emptied:
+        manifest["months"].pop(key, None)
+
+    manifest["lastExport"] = now.isoformat()
+    manifest["lastExportFull"] = since is None
+    await _renew_export_lease(company_id, token)
+    os.makedirs(_company_dir(company_id), exist_ok=True)
+    await asyncio.to_thread(_write_manifest, company_id, manifest)
+    await asyncio.to_thread(_remove_partitions, company_id, emptied)
+    return manifest
+
+async def export_all_snapshots() -> int:
+    """Export every company's snapshot, one company at a time, returning the number exported
+
+    Companies another export currently holds the lease for are skipped until the next run.
+    """
+    exported = 0
+    async for company in database.companies.find({}, {"_id": 1}):
+        company_id = str(company['_id'])
+        token = None
+        try:
+            token = await _acquire_export_lease(company_id)
+            if not token:
+                continue
+            await _export_company_snapshot(company_id, False, token)
+            exported += 1
+        except Exception as e:
+            print(f"Error exporting analytics snapshot for company {company['_id']}: {e}")
+        finally:
+            if token:
+                await _release_export_lease(company_id, token)
+    return exported
+
+async def run_snapshot_exporter() -> None:
+    """Export analytics snapshots periodically until cancelled"""
+    while True:
+        try:
+            await export_all_snapshots()
+        except Exception as e:
+            print(f"Error exporting analytics snapshots: {e}")
+        await asyncio.sleep(AI_CONFIG["SNAPSHOTS"]["EXPORT_INTERVAL_SECONDS"])
+
+def _naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def load_snapshot(company_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> pd.DataFrame:
+    """Memory-map the partitions covering a date range into one DataFrame
+
+    Partitions hold naive UTC timestamps; timezone-aware bounds are converted to match.
+    """
+    start_date, end_date = _naive_utc(start_date), _naive_utc(end_date)
+    manifest = read_manifest(company_id) or {"months": {}}
+    first = _month_key(start_date) if start_date else None
+    last = _month_key(end_date) if end_date else None
+    tables = [
+        pq.read_table(os.path.join(_company_dir(company_id), f"{month}.parquet"), memory_map=True)
+        for month in sorted(manifest["months"])
+        if (not first or month >= first) and (not last or month <= last)
+    ]
+    if not tables:
+        return SNAPSHOT_SCHEMA.empty_table().to_pandas()
+    frame = pa.concat_tables(tables).to_pandas()
+    if start_date:
+        frame = frame[frame["created_at"] >= pd.Timestamp(start_date)]
+    if end_date:
+        frame = frame[frame["created_at"] <= pd.Timestamp(end_date)]
+    return frame
+
+def _counts(series: pd.Series) -> Dict[str, int]:
+    return {field_key(value): int(count) for value, count in series.value_counts().items()}
+
+def _category_keys(series: pd.Series) -> pd.Series:
+    return series.fillna("unknown")
+
+def _priority_keys(series: pd.Series) -> pd.Series:
+    return series.map(lambda value: "unknown" if pd.isna(value) else int(value) if float(value).is_integer() else value)
+
+def snapshot_company_analytics(frame: pd.DataFrame) -> Dict:
+    """Category and priority distributions of the analyzed tickets in a snapshot"""
+    analyzed = frame[frame["category"].notna() | frame["priority"].notna()]
+    return {
+        "total_tickets_analyzed": len(analyzed),
+        "category_distribution": _counts(_category_keys(analyzed["category"])),
+        "priority_distribution": _counts(_priority_keys(analyzed["priority"]))
+    }
+
+def snapshot_agent_performance(frame: pd.DataFrame) -> Dict[str, Dict]:
+    """Per-agent ticket counts, handling time, CSAT and solution scores of the closed tickets in a snapshot"""
+    closed = frame[(frame["status"] == "closed") & frame["agent_id"].notna()]
+    if closed.empty:
+        return {}
+    grouped = closed.groupby("agent_id")
+    summary = grouped.agg(
+        total_tickets=("ticket_id", "size"),
+        avg_handling_time=("handling_minutes", "mean"),
+        avg_csat=("csat", "mean"),
+        graded_tickets=(SOLUTION_SCORE_KEYS[0], "count")
+    )
+    handling_quantiles = grouped["handling_minutes"].quantile(list(DEFAULT_QUANTILES)).unstack()
+    scores = grouped[SOLUTION_SCORE_KEYS].mean()
+
+    performance = {}
+    for agent_id, row in summary.iterrows():
+        performance[agent_id] = {
+            "total_tickets": int(row["total_tickets"]),
+            "graded_tickets": int(row["graded_tickets"]),
+            "avg_handling_time": 0 if pd.isna(row["avg_handling_time"]) else float(row["avg_handling_time"]),
+            "handling_time_percentiles": {
+                f"p{quantile * 100:g}": float(value)
+                for quantile, value in handling_quantiles.loc[agent_id].items() if not pd.isna(value)
+            },
+            "avg_csat": 0 if pd.isna(row["avg_csat"]) else float(row["avg_csat"]),
+            "solution_scores": {key: float(value) for key, value in scores.loc[agent_id].items() if not pd.isna(value)}
+        }
+    return performance
+
+def snapshot_trends(frame: pd.DataFrame, granularity: str) -> List[Dict]:
+    """Category and priority counts of the analyzed tickets per day, week or month"""
+    analyzed = frame[frame["category"].notna() | frame["priority"].notna()]
+    if analyzed.empty:
+        return []
+    periods = analyzed["created_at"].dt.to_period({"day": "D", "week": "W-SUN", "month": "M"}[granularity]).dt.start_time
+    categories = pd.crosstab(periods, _category_keys(analyzed["category"]))
+    priorities = pd.crosstab(periods, _priority_keys(analyzed["priority"]))
+    totals = periods.value_counts().sort_index()
+    return [
+        {
+            "period_start": period.to_pydatetime(),
+            "total": int(total),
+            "categories": {field_key(key): int(count) for key, count in categories.loc[period].items() if count},
+            "priorities": {field_key(key): int(count) for key, count in priorities.loc[period].items() if count}
+        }
+        for period, total in totals.items()
+    ]
+
+@snapshot_router.post("/export")
+async def export_snapshots(request: SnapshotExportRequest, background_tasks: BackgroundTasks):
+    """Export one company's (or every company's) analytics snapshot in the background"""
+    if not database:
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    if request.company_id:
+        _company_dir(request.company_id)
+        background_tasks.add_task(export_company_snapshot, request.company_id, request.full)
+    else:
+        background_tasks.add_task(export_all_snapshots)
+    return {"company_id": request.company_id, "full": request.full, "status": "scheduled"}
+
+@snapshot_router.get("/status/{company_id}")
+async def get_snapshot_status(company_id: str):
+    """Get a company's exported partitions and when they were written"""
+    manifest = read_manifest(company_id)
+    if not manifest:
+        raise HTTPException(status_code=404, detail="No snapshot exported for this company")
+    return {"company_id": company_id, **manifest}
+
+@snapshot_router.get("/company-analytics/{company_id}")
+async def get_snapshot_company_analytics(company_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    """Get category and priority distributions from the company's snapshot"""
+    frame = await asyncio.to_thread(load_snapshot, company_id, start_date, end_date)
+    return {"company_id": company_id, **snapshot_company_analytics(frame), "source": "snapshot"}
+
+@snapshot_router.get("/agent-performance/{company_id}")
+async def get_snapshot_agent_performance(company_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    """Get per-agent performance from the company's snapshot"""
+    frame = await asyncio.to_thread(load_snapshot, company_id, start_date, end_date)
+    return {"company_id": company_id, "agents": await asyncio.to_thread(snapshot_agent_performance, frame), "source": "snapshot"}
+
+@snapshot_router.get("/trends/{company_id}")
+async def get_snapshot_trends(company_id: str, granularity: str = "month", start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    """Get category and priority distributions per period from the company's snapshot"""
+    if granularity not in TREND_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(TREND_GRANULARITIES)}")
+    frame = await asyncio.to_thread(load_snapshot, company_id, start_date, end_date)
+    return {
+        "company_id": company_id,
+        "granularity": granularity,
+        "buckets": await asyncio.to_thread(snapshot_trends, frame, granularity),
+        "source": "snapshot"
+    }
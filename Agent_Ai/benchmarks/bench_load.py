@@ -0,0 +1,377 @@
+"""
+End-to-end load benchmark for the FastAPI service
+
+Starts benchmarks/stub_server.py (the real app against an in-memory Mongo
+stand-in, a fake vector store and a fake LLM with configurable latency) in a
+subprocess, then drives each scenario at every concurrency level with a
+closed loop of workers: each worker sends its next request as soon as the
+previous one completes, until the level's request count is reached. Warmup
+requests are sent first and not measured, so the performance scenarios are
+measured with their grade and coaching caches warm.
+
+Per scenario and concurrency it reports throughput, p50/p95/p99/max latency,
+errors, the server's CPU time and utilisation and its peak and final RSS
+(sampled from /proc, Linux only). Results are written as JSON. A level with
+any failed request is marked failed and the run exits non-zero, since fast
+errors would otherwise read as throughput. --compare checks the results
+against an earlier run and exits non-zero when throughput drops or p95 grows
+by more than --tolerance, or when the error rate goes up.
+
+Scenarios: customer_chat (/customer-chat/respond), agent_ai (/agent-ai/respond),
+analyze_ticket (/analyze-ticket, a fresh ticket per request),
+agent_performance, team_performance, coaching_insights and
+quality_assessment (/performance/*).
+
+The in-memory stand-in (mongomock) does not implement every operator the
+/performance/* stats pipeline uses ($trim), so those scenarios only run with
+--mongo-url against a local mongod and are skipped otherwise. --server-log
+keeps the server output to see why requests failed.
+
+Requires httpx, uvicorn and mongomock-motor on top of the app's requirements.
+
+Usage (from Agent_Ai/):
+    python benchmarks/bench_load.py [--scenarios customer_chat agent_ai]
+        [--concurrency 1 8 32] [--requests 200] [--llm-latency-ms 800]
+        [--output results.json] [--compare benchmarks/results/baseline.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from stub_server import dataset_arguments, dataset_from_args
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_SCRIPT = os.path.join(BENCHMARK_DIR, "stub_server.py")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+RSS_SAMPLE_SECONDS = 0.1
+SCENARIOS = ("customer_chat", "agent_ai", "analyze_ticket", "agent_performance", "team_performance", "coaching_insights", "quality_assessment")
+MONGO_ONLY_SCENARIOS = ("agent_performance", "team_performance", "coaching_insights", "quality_assessment")
+
+CUSTOMER_QUERIES = [
+    "Where is my order? It has been two hours",
+    "How do I apply a coupon to my order?",
+    "I was charged twice for the same order!!!",
+    "Can I change my delivery address?",
+    "The app keeps logging me out when I pay",
+    "hi",
+    "What are your opening hours?",
+    "My package arrived broken, I want a refund",
+]
+AGENT_QUERIES = [
+    "What is our refund policy for damaged items?",
+    "How should I handle a customer charged twice?",
+    "Summarize the steps to reset a customer's login",
+    "What can we offer for a late delivery?",
+]
+
+Request = Tuple[str, str, Optional[Dict], Optional[Dict]]
+
+def build_scenarios(data: Dict[str, List[Dict]]) -> Dict[str, Callable[[int, int], Request]]:
+    """Request factories per scenario, called with (request number, worker number)"""
+    companies = [str(company["_id"]) for company in data["companies"]]
+    company_names = {str(company["_id"]): company["name"] for company in data["companies"]}
+    agents = [(str(agent["_id"]), str(agent["companyId"])) for agent in data["agents"]]
+    closed_tickets = [str(ticket["_id"]) for ticket in data["tickets"]]
+    open_tickets = iter(data["open_tickets"])
+
+    def customer_chat(number, worker):
+        company_id = companies[worker % len(companies)]
+        return "POST", "/customer-chat/respond", None, {
+            "query": CUSTOMER_QUERIES[number % len(CUSTOMER_QUERIES)],
+            "session_id": f"bench-{worker}",
+            "company_id": company_id,
+            "company_name": company_names[company_id],
+        }
+
+    def agent_ai(number, worker):
+        return "POST", "/agent-ai/respond", None, {"query": AGENT_QUERIES[number % len(AGENT_QUERIES)], "agent_id": agents[worker % len(agents)][0]}
+
+    def analyze_ticket(number, worker):
+        ticket = next(open_tickets, None) or data["open_tickets"][number % len(data["open_tickets"])]
+        return "POST", "/analyze-ticket", None, {"ticket_id": str(ticket["_id"]), "company_id": str(ticket["companyId"])}
+
+    def agent_performance(number, worker):
+        agent_id, company_id = agents[number % len(agents)]
+        return "GET", f"/performance/agent-performance/{agent_id}", {"company_id": company_id}, None
+
+    def team_performance(number, worker):
+        return "POST", "/performance/team-performance", None, {"company_id": companies[number % len(companies)]}
+
+    def coaching_insights(number, worker):
+        return "POST", "/performance/coaching-insights", None, {"company_id": companies[number % len(companies)]}
+
+    def quality_assessment(number, worker):
+        return "POST", "/performance/quality-assessment", None, {"ticket_id": closed_tickets[number % len(closed_tickets)]}
+
+    return {
+        "customer_chat": customer_chat,
+        "agent_ai": agent_ai,
+        "analyze_ticket": analyze_ticket,
+        "agent_performance": agent_performance,
+        "team_performance": team_performance,
+        "coaching_insights": coaching_insights,
+        "quality_assessment": quality_assessment,
+    }
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = min(max(1, math.ceil(fraction * len(sorted_values))), len(sorted_values))
+    return sorted_values[rank - 1]
+
+class ProcessSampler:
+    """CPU time and RSS of the server process, read from /proc"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+
+    def cpu_seconds(self) -> Optional[float]:
+        if not self.available:
+            return None
+        with open(f"/proc/{self.pid}/stat") as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def rss_mib(self) -> Optional[float]:
+        if not self.available:
+            return None
+        with open(f"/proc/{self.pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return None
+
+async def _sample_rss(sampler: ProcessSampler, peak: Dict) -> None:
+    while True:
+        rss = sampler.rss_mib()
+        if rss is not None:
+            peak["rss_mib"] = max(peak.get("rss_mib", 0.0), rss)
+        await asyncio.sleep(RSS_SAMPLE_SECONDS)
+
+async def _send(client: httpx.AsyncClient, request: Request) -> Tuple[float, bool]:
+    method, path, params, body = request
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, path, params=params, json=body)
+        failed = response.status_code >= 400
+    except httpx.HTTPError:
+        failed = True
+    return time.perf_counter() - start, failed
+
+async def run_level(client: httpx.AsyncClient, sampler: ProcessSampler, factory: Callable[[int, int], Request], concurrency: int, requests: int, warmup: int) -> Dict:
+    """Drive one scenario at one concurrency with a closed loop of workers"""
+    counter = itertools.count()
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(number: int, total: int, record: bool):
+        nonlocal errors
+        while True:
+            request_number = next(counter)
+            if request_number >= total:
+                return
+            elapsed, failed = await _send(client, factory(request_number, number))
+            if record:
+                latencies.append(elapsed)
+                errors += failed
+
+    await asyncio.gather(*(worker(number, warmup, False) for number in range(concurrency)))
+    counter = itertools.count()
+
+    peak: Dict = {}
+    rss_sampler = asyncio.create_task(_sample_rss(sampler, peak))
+    cpu_start, client_cpu_start, start = sampler.cpu_seconds(), time.process_time(), time.perf_counter()
+    await asyncio.gather(*(worker(number, requests, True) for number in range(concurrency)))
+    wall = time.perf_counter() - start
+    cpu_end, client_cpu = sampler.cpu_seconds(), time.process_time() - client_cpu_start
+    rss_sampler.cancel()
+
+    latencies.sort()
+    server_cpu = cpu_end - cpu_start if cpu_start is not None and cpu_end is not None else None
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "failed": errors > 0,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": {
+            name: round(value * 1000, 2) if value is not None else None
+            for name, value in (("p50", percentile(latencies, 0.50)), ("p95", percentile(latencies, 0.95)), ("p99", percentile(latencies, 0.99)), ("max", latencies[-1] if latencies else None))
+        },
+        "server_cpu_seconds": round(server_cpu, 3) if server_cpu is not None else None,
+        "server_cpu_percent": round(100 * server_cpu / wall, 1) if server_cpu is not None and wall else None,
+        "server_rss_peak_mib": round(peak["rss_mib"], 1) if "rss_mib" in peak else None,
+        "server_rss_end_mib": round(sampler.rss_mib(), 1) if sampler.available else None,
+        "client_cpu_seconds": round(client_cpu, 3),
+    }
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _server_command(args, port: int) -> List[str]:
+    command = [
+        sys.executable, SERVER_SCRIPT, "--port", str(port),
+        "--llm-latency-ms", str(args.llm_latency_ms), "--llm-jitter-ms", str(args.llm_jitter_ms),
+        "--vector-latency-ms", str(args.vector_latency_ms), "--embed-latency-ms", str(args.embed_latency_ms),
+        "--seed", str(args.seed), "--companies", str(args.companies), "--agents-per-company", str(args.agents_per_company),
+        "--closed-per-agent", str(args.closed_per_agent), "--open-tickets", str(args.open_tickets),
+    ]
+    if args.mongo_url:
+        command += ["--mongo-url", args.mongo_url]
+    return command
+
+async def wait_until_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Stub server exited with code {server.returncode}")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Stub server not ready after {timeout}s")
+
+async def run_benchmark(args) -> List[Dict]:
+    scenarios = build_scenarios(dataset_from_args(args))
+    port = _free_port()
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    server = subprocess.Popen(_server_command(args, port), cwd=os.path.dirname(BENCHMARK_DIR), stdout=log, stderr=subprocess.STDOUT)
+    results = []
+    try:
+        limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits) as client:
+            await wait_until_ready(client, server, args.startup_timeout)
+            sampler = ProcessSampler(server.pid)
+            print(f"{'scenario':<20} {'conc':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6} {'cpu %':>6} {'rss MiB':>8}")
+            for name in args.scenarios:
+                for concurrency in args.concurrency:
+                    result = {"scenario": name, **await run_level(client, sampler, scenarios[name], concurrency, args.requests, args.warmup)}
+                    results.append(result)
+                    latency = result["latency_ms"]
+                    print(f"{name:<20} {concurrency:>4} {result['throughput_rps']:>8} {latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9} {result['errors']:>6} {result['server_cpu_percent']!s:>6} {result['server_rss_peak_mib']!s:>8}")
+        if any(result["failed"] for result in results):
+            print("\nSome levels had failed requests" + (f"; see {args.server_log}" if args.server_log else "; rerun with --server-log to see why"))
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        if log is not subprocess.DEVNULL:
+            log.close()
+    return results
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(baseline: Dict, results: List[Dict], tolerance: float) -> List[str]:
+    """Regressions against a baseline run: throughput down or p95 up by more than `tolerance`, or a higher error rate"""
+    previous = {(result["scenario"], result["concurrency"]): result for result in baseline.get("results", [])}
+    regressions = []
+    print(f"\n{'scenario':<20} {'conc':>4} {'rps change':>11} {'p95 change':>11} {'errors':>15}")
+    for result in results:
+        before = previous.get((result["scenario"], result["concurrency"]))
+        if not before or not before["throughput_rps"] or not before["latency_ms"]["p95"]:
+            continue
+        rps_change = result["throughput_rps"] / before["throughput_rps"] - 1
+        p95_change = result["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1
+        error_rate = _error_rate(result)
+        error_rate_before = _error_rate(before)
+        print(f"{result['scenario']:<20} {result['concurrency']:>4} {rps_change:>+10.1%} {p95_change:>+10.1%} {error_rate_before:>6.1%} -> {error_rate:>5.1%}")
+        if rps_change < -tolerance or p95_change > tolerance or error_rate > error_rate_before:
+            regressions.append(f"{result['scenario']} @ {result['concurrency']}: throughput {rps_change:+.1%}, p95 {p95_change:+.1%}, error rate {error_rate_before:.1%} -> {error_rate:.1%}")
+    return regressions
+
+def _error_rate(result: Dict) -> float:
+    if "error_rate" in result:
+        return result["error_rate"]
+    return result["errors"] / result["requests"] if result["requests"] else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=None, help="default: all, or only the in-memory-safe ones without --mongo-url")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario and concurrency")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each level")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--vector-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--mongo-url", default=None, help="use (and reseed) a real MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--server-log", default=None, help="write the server's output to this file")
+    parser.add_argument("--output", default=None, help="results JSON (default benchmarks/results/load_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative throughput drop / p95 growth")
+    dataset_arguments(parser)
+    args = parser.parse_args()
+
+    if args.scenarios is None:
+        args.scenarios = [name for name in SCENARIOS if args.mongo_url or name not in MONGO_ONLY_SCENARIOS]
+    elif not args.mongo_url:
+        skipped = [name for name in args.scenarios if name in MONGO_ONLY_SCENARIOS]
+        if skipped:
+            print(f"Skipping {', '.join(skipped)}: they need --mongo-url")
+        args.scenarios = [name for name in args.scenarios if name not in MONGO_ONLY_SCENARIOS]
+    if not args.scenarios:
+        parser.error("no scenarios to run")
+
+    if "analyze_ticket" in args.scenarios:
+        args.open_tickets = max(args.open_tickets, len(args.concurrency) * (args.requests + args.warmup))
+
+    results = asyncio.run(run_benchmark(args))
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "arguments": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"load_{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults written to {output}")
+
+    failed = any(result["failed"] for result in results)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare_results(json.load(baseline_file), results, args.tolerance)
+        if regressions:
+            print("\nRegressions beyond tolerance:")
+            for regression in regressions:
+                print(f"  {regression}")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
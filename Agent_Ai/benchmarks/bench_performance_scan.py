@@ -0,0 +1,138 @@
+"""
+Peak-memory benchmark for the company-wide ticket scan
+
+Compares the old approach (to_list(length=None) over every closed ticket with
+full documents, then one $in grade lookup) against the streaming
+find_ungraded_tickets, for growing tenant sizes. The tickets collection is an
+in-memory stand-in that generates full documents, message arrays included, on
+demand and serves them through a cursor honouring projection and batch_size,
+so only the consumer's memory is measured. Peak is measured with tracemalloc.
+
+Half of the tickets have a current grade; both approaches must find the same
+number of ungraded tickets.
+
+Usage (from Agent_Ai/):
+    python benchmarks/bench_performance_scan.py [--sizes 1000 5000 20000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+import performance_monitor
+from performance_monitor import closed_ticket_query, find_ungraded_tickets, load_solution_grades, solution_content_hash
+
+WORDS = ["order", "refund", "delivery", "account", "payment", "late", "broken", "please", "update", "package", "login", "charge"]
+MESSAGES_PER_TICKET = 20
+COMPANY_ID = ObjectId()
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def build_ticket(index):
+    """Deterministically generate the full closed ticket document at `index`"""
+    rng = random.Random(index)
+    created = datetime(2026, 1, 1) + timedelta(minutes=index)
+    return {
+        "_id": index,
+        "title": _text(rng, 6),
+        "content": _text(rng, 60),
+        "solution": _text(rng, 45),
+        "status": "closed",
+        "agentId": index % 25,
+        "companyId": COMPANY_ID,
+        "createdAt": created,
+        "messages": [
+            {"content": _text(rng, 30), "attachment": None, "isAgent": bool(n % 2), "createdAt": created}
+            for n in range(MESSAGES_PER_TICKET)
+        ],
+    }
+
+class GeneratedCursor:
+    """Async cursor over generated documents, applying an inclusion projection"""
+
+    def __init__(self, indexes, projection=None):
+        self._indexes = iter(indexes)
+        self._fields = [field for field, include in (projection or {}).items() if include]
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            doc = self._make(next(self._indexes))
+        except StopIteration:
+            raise StopAsyncIteration
+        if self._fields:
+            doc = {"_id": doc["_id"], **{field: doc[field] for field in self._fields if field in doc}}
+        return doc
+
+    def _make(self, index):
+        return build_ticket(index)
+
+    async def to_list(self, length=None):
+        return [doc async for doc in self]
+
+class GradeCursor(GeneratedCursor):
+    def _make(self, index):
+        return {"_id": index, "ticketId": index, "contentHash": solution_content_hash(build_ticket(index)), "analysis": {"grade": "B"}}
+
+class TicketsCollection:
+    def __init__(self, size):
+        self.size = size
+
+    def find(self, query, projection=None):
+        return GeneratedCursor(range(self.size), projection)
+
+class GradesCollection:
+    def find(self, query, projection=None):
+        return GradeCursor([ticket_id for ticket_id in query["ticketId"]["$in"] if ticket_id % 2 == 0])
+
+class GeneratedDatabase:
+    def __init__(self, size):
+        self.tickets = TicketsCollection(size)
+        self.solutiongrades = GradesCollection()
+
+async def materialized_scan(company_id):
+    """The pre-streaming scan: load every closed ticket, then look up all their grades at once"""
+    tickets = await performance_monitor.database.tickets.find(closed_ticket_query(company_id)).to_list(length=None)
+    _, ungraded = await load_solution_grades(tickets)
+    return len(ungraded)
+
+async def streaming_scan(company_id):
+    found = await find_ungraded_tickets(company_id)
+    return found["total"]
+
+def measure(scan, size):
+    """Run one scan against a tenant of `size` tickets, returning (ungraded count, peak MiB)"""
+    performance_monitor.database = GeneratedDatabase(size)
+    tracemalloc.start()
+    ungraded = asyncio.run(scan(str(COMPANY_ID)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ungraded, peak / (1024 * 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000], help="closed tickets per tenant")
+    args = parser.parse_args()
+
+    print(f"{'tickets':>8} {'materialized MiB':>17} {'streaming MiB':>14} {'ungraded':>9}")
+    for size in args.sizes:
+        legacy_ungraded, legacy_peak = measure(materialized_scan, size)
+        streamed_ungraded, streamed_peak = measure(streaming_scan, size)
+        assert legacy_ungraded == streamed_ungraded, (legacy_ungraded, streamed_ungraded)
+        print(f"{size:>8} {legacy_peak:>17.1f} {streamed_peak:>14.1f} {streamed_ungraded:>9}")
+
+if __name__ == "__main__":
+    main()
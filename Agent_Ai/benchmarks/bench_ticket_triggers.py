@@ -0,0 +1,109 @@
+"""
+Micro-benchmark for ticket trigger detection
+
+Compares the per-phrase substring scan that should_create_ticket used to run
+(with and without the INFO logging it did on every call) against the compiled
+TriggerMatcher, across message lengths. Speedup is the unlogged scan /
+compiled, so it credits the matcher and not the removed logging.
+
+Usage (from Agent_Ai/):
+    python benchmarks/bench_ticket_triggers.py [--repeat 2000]
+"""
+import argparse
+import io
+import logging
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import AI_CONFIG
+from ticket_triggers import get_trigger_matcher
+
+FILLER_WORDS = [
+    "order", "delivery", "account", "yesterday", "please", "the", "my", "app",
+    "payment", "item", "package", "status", "update", "thanks", "when", "will",
+]
+
+legacy_logger = logging.getLogger("CustomerAI.legacy")
+legacy_logger.addHandler(logging.StreamHandler(io.StringIO()))
+legacy_logger.setLevel(logging.INFO)
+legacy_logger.propagate = False
+
+def legacy_scan(query, context_chunks):
+    """The per-phrase substring scan should_create_ticket ran before the compiled matcher"""
+    query_lower = query.lower()
+    for indicator in AI_CONFIG["TICKET"]["HELP_INDICATORS"]:
+        if indicator in query_lower:
+            return True
+    for signal in AI_CONFIG["TICKET"]["DISTRESS_SIGNALS"]:
+        if signal in query_lower:
+            return True
+    if "!!!" in query or (query.isupper() and len(query) > 10):
+        return True
+    if len(context_chunks) == 0 and len(query) > 100 and any(word in query_lower for word in AI_CONFIG["TICKET"]["COMPLEX_ISSUE_WORDS"]):
+        return True
+    for word in AI_CONFIG["TICKET"]["COMPLAINT_WORDS"]:
+        if word in query_lower:
+            return True
+    return False
+
+def legacy_logged_scan(query, context_chunks):
+    """The legacy scan including the INFO logging it did on every call"""
+    query_lower = query.lower()
+    legacy_logger.info(f"🎟️ Checking if ticket should be created for query: '{query[:50]}...'")
+    legacy_logger.info(f"📝 Query lowercase: '{query_lower}'")
+    legacy_logger.info(f"📚 Context chunks available: {len(context_chunks)}")
+    legacy_logger.info(f"🔍 Checking help indicators: {AI_CONFIG['TICKET']['HELP_INDICATORS']}")
+    legacy_logger.info("🔍 Checking distress signals...")
+    legacy_logger.info(f"🎭 Emotional intensity check - Multiple exclamation: {'!!!' in query}, All caps: {query.isupper()}")
+    legacy_logger.info("🔍 Checking complaint indicators...")
+    return legacy_scan(query, context_chunks)
+
+def build_message(length, trigger=None, seed=0):
+    """Build a benign message of roughly `length` characters, optionally ending in a trigger"""
+    rng = random.Random(seed)
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(FILLER_WORDS)
+        words.append(word)
+        size += len(word) + 1
+    if trigger:
+        words.append(trigger)
+    return " ".join(words)
+
+def time_per_call(func, query, context_chunks, repeat):
+    """Best-of-five mean time per call in microseconds"""
+    runs = timeit.repeat(lambda: func(query, context_chunks), number=repeat, repeat=5)
+    return min(runs) / repeat * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="calls per timing run")
+    args = parser.parse_args()
+
+    matcher = get_trigger_matcher()
+    context_chunks = ["kb chunk"]
+    cases = [
+        ("no trigger", None),
+        ("late trigger", "sort this out"),
+        ("late complaint", "unhappy"),
+    ]
+
+    print(f"{'length':>8} {'case':<14} {'logged us':>10} {'scan us':>10} {'compiled us':>12} {'speedup':>8}  rule")
+    for length in (50, 200, 1000, 5000, 20000):
+        number = max(args.repeat * 50 // length, 20)
+        for label, trigger in cases:
+            query = build_message(length, trigger)
+            logged = time_per_call(legacy_logged_scan, query, context_chunks, number)
+            scan = time_per_call(legacy_scan, query, context_chunks, number)
+            compiled = time_per_call(matcher.match, query, context_chunks, number)
+            fired = matcher.match(query, context_chunks)
+            rule = f"{fired['rule']}:{fired['trigger']}" if fired else "-"
+            print(f"{len(query):>8} {label:<14} {logged:>10.2f} {scan:>10.2f} {compiled:>12.2f} {scan / compiled:>7.1f}x  {rule}")
+
+if __name__ == "__main__":
+    main()
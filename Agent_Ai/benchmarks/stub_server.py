@@ -0,0 +1,291 @@
+"""
+The FastAPI app served against stub backends, for load benchmarks
+
+Before the app is imported, the sentence_transformers, pinecone and
+langchain_google_genai modules are replaced by in-process fakes:
+
+- FakeSentenceTransformer: deterministic unit vectors hashed from the text
+- FakeVectorIndex: brute-force cosine search over generated knowledge base
+  chunks, filtered by company_id like the Pinecone query
+- FakeChatModel: canned replies shaped like each prompt expects (category,
+  priority, grading JSON, coaching JSON, free text)
+
+Each fake sleeps for a configurable latency, with jitter for the LLM, so the
+app's own overhead can be measured apart from (or together with) realistic
+backend times. MongoDB is an in-memory mongomock_motor client, or a real
+server given with --mongo-url, seeded with a generated tenant from
+`build_dataset`. The dataset is a pure function of its arguments, so the
+load driver (bench_load.py) rebuilds it to know the ids to request.
+
+Requires uvicorn and mongomock-motor (pip install mongomock-motor) on top of
+the app's requirements. Usually started by bench_load.py; to run by hand
+(from Agent_Ai/):
+    python benchmarks/stub_server.py --port 8100 [--llm-latency-ms 800]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import time
+import types
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from bson import ObjectId
+
+EMBED_DIMENSION = 1024
+CATEGORIES = ["order", "delivery", "technical", "general"]
+WORDS = ["order", "refund", "delivery", "account", "payment", "late", "broken", "please", "update", "package", "login", "charge", "coupon", "menu", "app", "receipt"]
+KB_CHUNKS_PER_COMPANY = 200
+
+stub_latency = {"llm_ms": 0.0, "llm_jitter_ms": 0.0, "vector_ms": 0.0, "embed_ms": 0.0}
+_latency_rng = random.Random(0)
+
+def _sleep_seconds(base_ms: float, jitter_ms: float = 0.0) -> float:
+    return max(0.0, base_ms + _latency_rng.uniform(-jitter_ms, jitter_ms)) / 1000
+
+def _text_seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+def fake_embedding(text: str) -> np.ndarray:
+    """Deterministic unit vector for a text"""
+    vector = np.random.default_rng(_text_seed(text)).standard_normal(EMBED_DIMENSION).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+class FakeSentenceTransformer:
+    """SentenceTransformer stand-in returning hashed embeddings"""
+
+    def __init__(self, model_name_or_path=None, *args, **kwargs):
+        self.model_name = model_name_or_path
+
+    def encode(self, sentences, **kwargs):
+        if stub_latency["embed_ms"]:
+            time.sleep(_sleep_seconds(stub_latency["embed_ms"]))
+        if isinstance(sentences, str):
+            return fake_embedding(sentences)
+        return np.stack([fake_embedding(sentence) for sentence in sentences])
+
+class FakeMatch(dict):
+    """Pinecone match readable both as attributes and as a mapping"""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+class FakeQueryResponse(dict):
+    @property
+    def matches(self):
+        return self["matches"]
+
+class FakeVectorIndex:
+    """Brute-force cosine search over knowledge base chunks, filterable by company_id"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.metadata: List[Dict] = []
+        self.vectors = np.zeros((0, EMBED_DIMENSION), dtype=np.float32)
+
+    def upsert_chunks(self, chunks: List[Dict]) -> None:
+        self.ids.extend(chunk["id"] for chunk in chunks)
+        self.metadata.extend(chunk["metadata"] for chunk in chunks)
+        self.vectors = np.vstack([self.vectors] + [fake_embedding(chunk["metadata"]["text"])[None, :] for chunk in chunks])
+
+    def query(self, vector=None, top_k=10, include_metadata=True, filter=None, namespace=None, **kwargs):
+        if stub_latency["vector_ms"]:
+            time.sleep(_sleep_seconds(stub_latency["vector_ms"]))
+        scores = self.vectors @ np.asarray(vector, dtype=np.float32)
+        company_id = (filter or {}).get("company_id")
+        candidates = [i for i, metadata in enumerate(self.metadata) if not company_id or metadata.get("company_id") == company_id]
+        ranked = sorted(candidates, key=lambda i: scores[i], reverse=True)[:top_k]
+        return FakeQueryResponse(matches=[
+            FakeMatch(id=self.ids[i], score=float(scores[i]), metadata=self.metadata[i] if include_metadata else {})
+            for i in ranked
+        ])
+
+vector_index = FakeVectorIndex()
+
+class FakePinecone:
+    """Pinecone client stand-in serving the shared in-memory index"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def Index(self, *args, **kwargs):
+        return vector_index
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+def _grade(rng: random.Random, ticket: int = None) -> Dict:
+    grade = {key: rng.randint(5, 10) for key in ("completeness", "clarity", "empathy", "proactiveness", "technical_accuracy", "customer_focus")}
+    grade.update({
+        "strengths": ["Clear steps", "Polite tone", "Accurate"],
+        "improvements": ["More empathy", "Follow up"],
+        "grade": rng.choice("ABC"),
+        "feedback": _words(rng, 20),
+    })
+    if ticket is not None:
+        grade = {"ticket": ticket, **grade}
+    return grade
+
+def fake_llm_reply(prompt: str) -> str:
+    """Reply in the shape the prompt asks for, deterministically per prompt"""
+    rng = random.Random(_text_seed(prompt))
+    if "JSON array holding one object per ticket" in prompt:
+        tickets = len(re.findall(r"^Ticket \d+:", prompt, re.MULTILINE))
+        return json.dumps([_grade(rng, number) for number in range(1, tickets + 1)])
+    if '"technical_accuracy"' in prompt:
+        return json.dumps(_grade(rng))
+    if '"short_term_goals"' in prompt:
+        return json.dumps({key: [_words(rng, 5) for _ in range(3)] for key in ("strengths", "improvements", "training", "short_term_goals", "long_term_plan")})
+    if "Return only the category name" in prompt:
+        return rng.choice(CATEGORIES)
+    if "Return only a number from 1-5" in prompt:
+        return str(rng.randint(1, 5))
+    return _words(rng, 60).capitalize() + "."
+
+class FakeChatModel:
+    """ChatGoogleGenerativeAI stand-in with configurable latency"""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def invoke(self, messages, **kwargs):
+        time.sleep(_sleep_seconds(stub_latency["llm_ms"], stub_latency["llm_jitter_ms"]))
+        return FakeMessage(fake_llm_reply(messages[-1].content))
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(_sleep_seconds(stub_latency["llm_ms"], stub_latency["llm_jitter_ms"]))
+        return FakeMessage(fake_llm_reply(messages[-1].content))
+
+def install_stub_backends(llm_ms: float = 0.0, llm_jitter_ms: float = 0.0, vector_ms: float = 0.0, embed_ms: float = 0.0) -> None:
+    """Register the fake embedding, vector store and LLM modules; must run before the app is imported"""
+    stub_latency.update(llm_ms=llm_ms, llm_jitter_ms=llm_jitter_ms, vector_ms=vector_ms, embed_ms=embed_ms)
+    for name, attributes in (
+        ("sentence_transformers", {"SentenceTransformer": FakeSentenceTransformer}),
+        ("pinecone", {"Pinecone": FakePinecone}),
+        ("langchain_google_genai", {"ChatGoogleGenerativeAI": FakeChatModel}),
+    ):
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+def build_dataset(seed: int = 7, companies: int = 2, agents_per_company: int = 5, closed_per_agent: int = 40, open_tickets: int = 500) -> Dict[str, List[Dict]]:
+    """Generate a deterministic tenant: companies, agents, closed tickets with util rows, open tickets to analyze and KB chunks"""
+    rng = random.Random(seed)
+
+    def new_id() -> ObjectId:
+        return ObjectId(rng.getrandbits(96).to_bytes(12, "big"))
+
+    start = datetime(2026, 1, 1)
+    data: Dict[str, List[Dict]] = {name: [] for name in ("companies", "agents", "tickets", "utiltickets", "knowledgebases", "kb_chunks", "open_tickets")}
+    for company_number in range(companies):
+        company_id = new_id()
+        data["companies"].append({"_id": company_id, "name": f"Bench Company {company_number}"})
+        data["knowledgebases"].append({"_id": new_id(), "companyId": company_id, "knowledgeBases": [{"title": _words(rng, 4)} for _ in range(10)]})
+        data["kb_chunks"].extend(
+            {"id": f"{company_id}-{chunk}", "metadata": {"company_id": str(company_id), "text": _words(rng, 80), "title": _words(rng, 4), "category": rng.choice(CATEGORIES)}}
+            for chunk in range(KB_CHUNKS_PER_COMPANY)
+        )
+        agent_ids = []
+        for agent_number in range(agents_per_company):
+            agent_id = new_id()
+            agent_ids.append(agent_id)
+            data["agents"].append({"_id": agent_id, "companyId": company_id, "name": f"Agent {company_number}-{agent_number}", "email": f"agent{company_number}.{agent_number}@bench.local"})
+            for _ in range(closed_per_agent):
+                ticket_id = new_id()
+                created = start + timedelta(minutes=rng.randint(0, 60 * 24 * 120))
+                data["tickets"].append({
+                    "_id": ticket_id, "companyId": company_id, "agentId": agent_id, "status": "closed",
+                    "title": _words(rng, 6), "content": _words(rng, 50), "solution": _words(rng, 40),
+                    "messages": [{"content": _words(rng, 20), "isAgent": bool(n % 2), "createdAt": created} for n in range(6)],
+                    "createdAt": created, "updatedAt": created,
+                })
+                seen = created + timedelta(minutes=rng.randint(1, 60))
+                data["utiltickets"].append({
+                    "_id": new_id(), "ticketId": ticket_id, "agentId": agent_id, "companyId": company_id,
+                    "seen_time": seen, "resolved_time": seen + timedelta(minutes=rng.randint(5, 240)),
+                    "customer_review_rating": rng.randint(1, 5), "updatedAt": seen,
+                })
+    for _ in range(open_tickets):
+        company = rng.choice(data["companies"])
+        data["open_tickets"].append({
+            "_id": new_id(), "companyId": company["_id"], "status": "open",
+            "title": _words(rng, 6), "content": _words(rng, 50), "solution": None,
+            "messages": [{"content": _words(rng, 20), "isAgent": False, "createdAt": start}],
+            "createdAt": start, "updatedAt": start,
+        })
+    return data
+
+async def seed_database(db, data: Dict[str, List[Dict]]) -> None:
+    """Insert the dataset into the app's collections"""
+    await db.companies.insert_many(data["companies"])
+    await db.agents.insert_many(data["agents"])
+    await db.Agent.insert_many(data["agents"])
+    await db.tickets.insert_many(data["tickets"] + data["open_tickets"])
+    await db.utiltickets.insert_many(data["utiltickets"])
+    await db.knowledgebases.insert_many(data["knowledgebases"])
+    vector_index.upsert_chunks(data["kb_chunks"])
+
+def dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    """Dataset options shared by this server and the load driver"""
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--companies", type=int, default=2)
+    parser.add_argument("--agents-per-company", type=int, default=5)
+    parser.add_argument("--closed-per-agent", type=int, default=40)
+    parser.add_argument("--open-tickets", type=int, default=500, help="unanalyzed tickets for /analyze-ticket")
+
+def dataset_from_args(args) -> Dict[str, List[Dict]]:
+    return build_dataset(args.seed, args.companies, args.agents_per_company, args.closed_per_agent, args.open_tickets)
+
+async def serve(args) -> None:
+    import uvicorn
+    import database
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(args.mongo_url)
+        await client.drop_database(args.database)
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    await seed_database(client[args.database], dataset_from_args(args))
+    database.AsyncIOMotorClient = lambda *_args, **_kwargs: client
+
+    from main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False))
+    await server.serve()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--vector-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0)
+    parser.add_argument("--mongo-url", default=None, help="seed and use a real MongoDB instead of the in-memory stand-in")
+    parser.add_argument("--database", default="loadbench", help="database name (dropped and reseeded with --mongo-url)")
+    dataset_arguments(parser)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_NAME"] = args.database
+    os.environ.setdefault("ANALYTICS_SNAPSHOTS_ENABLED", "false")
+    os.environ.setdefault("TRACING_ENABLED", "false")
+    install_stub_backends(args.llm_latency_ms, args.llm_jitter_ms, args.vector_latency_ms, args.embed_latency_ms)
+    asyncio.run(serve(args))
+
+if __name__ == "__main__":
+    main()
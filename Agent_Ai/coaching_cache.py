@@ -0,0 +1,99 @@
+"""
+Persisted coaching plans keyed on a fingerprint of the agent's performance
+
+`coachingplans` holds one document per (company, agent) with the last plan
+generated and the fingerprint of the performance summary it was generated
+from: the ticket count and the coaching prompt's metrics, rounded, plus the
+common issues. A plan is reused while the fingerprint still matches and the
+plan is younger than MAX_AGE_SECONDS; otherwise it is regenerated and
+replaced. Default (fallback) plans are never stored.
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from bson import ObjectId
+from pymongo import ASCENDING, UpdateOne
+
+from config import AI_CONFIG
+
+database = None
+
+coaching_cache_stats = {"hits": 0, "misses": 0, "stale": 0, "stored": 0, "errors": 0}
+
+def initialize_coaching_cache(db):
+    """Initialize MongoDB connection for the coaching plan cache"""
+    global database
+    database = db
+
+async def ensure_coaching_cache_indexes():
+    """Create the unique (company, agent) index for cached coaching plans"""
+    await database.coachingplans.create_index([("companyId", ASCENDING), ("agentId", ASCENDING)], name="coaching_plan_agent", unique=True)
+
+def coaching_fingerprint(performance: Dict) -> str:
+    """Hash the rounded performance summary a coaching plan is generated from"""
+    config = AI_CONFIG["COACHING_CACHE"]
+    summary = {
+        "total_tickets": performance.get('total_tickets', 0),
+        "avg_handling_time": round(performance.get('avg_handling_time', 0), config["HANDLING_TIME_DECIMALS"]),
+        "avg_csat": round(performance.get('avg_csat', 0), config["CSAT_DECIMALS"]),
+        "solution_scores": {key: round(score, config["SCORE_DECIMALS"]) for key, score in sorted(performance.get('solution_scores', {}).items())},
+        "common_issues": list(performance.get('common_issues', [])),
+    }
+    return hashlib.sha256(json.dumps(summary, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def load_cached_plans(company_id: str, performance_by_agent: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Get the stored plans that are still valid for the agents' current performance"""
+    if not performance_by_agent:
+        return {}
+    try:
+        docs = await database.coachingplans.find(
+            {"companyId": ObjectId(company_id), "agentId": {"$in": [ObjectId(agent_id) for agent_id in performance_by_agent]}},
+            {"agentId": 1, "fingerprint": 1, "recommendations": 1, "generatedAt": 1}
+        ).to_list(length=None)
+    except Exception as e:
+        print(f"Error loading cached coaching plans: {e}")
+        coaching_cache_stats["errors"] += 1
+        docs = []
+
+    oldest = datetime.utcnow() - timedelta(seconds=AI_CONFIG["COACHING_CACHE"]["MAX_AGE_SECONDS"])
+    stored = {str(doc['agentId']): doc for doc in docs}
+    plans = {}
+    for agent_id, performance in performance_by_agent.items():
+        doc = stored.get(agent_id)
+        if doc and doc.get('fingerprint') == coaching_fingerprint(performance) and doc.get('generatedAt', oldest) > oldest:
+            plans[agent_id] = doc['recommendations']
+            coaching_cache_stats["hits"] += 1
+        else:
+            coaching_cache_stats["stale" if doc else "misses"] += 1
+    return plans
+
+async def store_plans(company_id: str, plans: Dict[str, Tuple[Dict, Dict]]) -> None:
+    """Persist freshly generated plans, given as agent id -> (performance, recommendations)"""
+    if not plans:
+        return
+    now = datetime.utcnow()
+    updates = [
+        UpdateOne(
+            {"companyId": ObjectId(company_id), "agentId": ObjectId(agent_id)},
+            {"$set": {"fingerprint": coaching_fingerprint(performance), "recommendations": recommendations, "generatedAt": now}},
+            upsert=True
+        )
+        for agent_id, (performance, recommendations) in plans.items()
+    ]
+    try:
+        await database.coachingplans.bulk_write(updates, ordered=False)
+        coaching_cache_stats["stored"] += len(updates)
+    except Exception as e:
+        print(f"Error storing coaching plans: {e}")
+        coaching_cache_stats["errors"] += 1
+
+def get_coaching_cache_stats() -> Dict:
+    """Get coaching cache hit/miss counters and the LLM calls saved"""
+    lookups = coaching_cache_stats["hits"] + coaching_cache_stats["misses"] + coaching_cache_stats["stale"]
+    return {
+        **coaching_cache_stats,
+        "llm_calls_saved": coaching_cache_stats["hits"],
+        "hit_rate": coaching_cache_stats["hits"] / lookups if lookups else 0.0,
+    }
@@ -24,6 +24,17 @@ AI_CONFIG = {
         "RECENT_HISTORY": 5,
         "TOP_K_RESULTS": 10,
         "MAX_CONTEXT_CHUNKS": 5,
+        "RESPONSE_DEADLINE_SECONDS": 20,
+        "COMPACTION_BATCH": 2,
+        "SUMMARY_MAX_TOKENS": 250,
+        "TURN_MAX_TOKENS": 300,
+        "CONTEXT_TOKEN_BUDGETS": {
+            "customer": 1200,
+            "agent": 2000,
+            "ticket": 1200,
+            "default": 1500,
+        },
+        "DEDUP_SIMILARITY": 0.85,
     },    "TICKET": {
         "HELP_INDICATORS": [
             'create ticket', 'need help', 'contact support', 'speak to agent',
@@ -33,6 +44,108 @@ AI_CONFIG = {
             'terrible service', 'poor service', 'bad experience', 'manager',
             'supervisor', 'resolve this', 'fix this', 'sort this out'
         ],
+        "DISTRESS_SIGNALS": [
+            "urgent", "emergency", "problem", "broken", "not working", "help me",
+            "frustrated", "angry", "mad", "upset", "disappointed", "terrible",
+            "awful", "horrible", "worst", "hate", "disgusted", "furious",
+            "outraged", "livid", "annoyed", "irritated", "fed up", "sick of",
+            "can't stand", "ridiculous", "stupid", "useless", "pathetic",
+            "unacceptable", "outrageous", "shocking", "appalling", "fix this",
+            "doesn't work", "not functioning", "issue with", "trouble with"
+        ],
+        "COMPLAINT_WORDS": [
+            "complain", "complaint", "report", "dissatisfied", "unhappy",
+            "refund", "compensation", "manager", "supervisor", "escalate"
+        ],
+        "COMPLEX_ISSUE_WORDS": ["issue", "problem", "error", "fail", "wrong"],
+        "COMPLEX_ISSUE_MIN_LENGTH": 100,
+    },
+    "AGENT_CONTEXT_CACHE": {
+        "IDLE_TTL_SECONDS": 900,
+        "MAX_AGE_SECONDS": 120,
+        "MAX_AGENTS": 1000,
+    },
+    "INTENT": {
+        "ENABLED": True,
+        "MODE": "template",
+        "MAX_QUERY_WORDS": 6,
+        "EMBEDDING_THRESHOLD": 0.9,
+        "PROTOTYPES": {
+            "greeting": ["hi", "hello", "hey", "hi there", "hello there", "good morning", "good afternoon", "good evening"],
+            "thanks": ["thanks", "thank you", "thanks a lot", "thank you so much", "many thanks", "appreciate it", "ok thanks"],
+            "acknowledgement": ["ok", "okay", "k", "got it", "sure", "alright", "cool", "great", "understood", "sounds good", "perfect", "noted"],
+            "goodbye": ["bye", "goodbye", "bye bye", "see you", "that's all", "that is all", "have a nice day"],
+        },
+        "TEMPLATES": {
+            "greeting": "Hello! How can I help you today?",
+            "thanks": "You're welcome! Is there anything else I can help you with?",
+            "acknowledgement": "Great! Let me know if there's anything else you need.",
+            "goodbye": "Thanks for reaching out. Have a great day!",
+        },
+    },
+    "LLM_FANOUT": {
+        "GLOBAL_CONCURRENCY": 16,
+        "TENANT_CONCURRENCY": 4,
+        "MAX_RETRIES": 4,
+        "BACKOFF_BASE_SECONDS": 0.5,
+        "BACKOFF_MAX_SECONDS": 8,
+        "DEADLINE_SECONDS": 25,
+    },
+    "SOLUTION_GRADING": {
+        "BATCH_SIZE": 8,
+        "BATCH_TOKEN_BUDGET": 6000,
+    },
+    "PERFORMANCE_ROLLUPS": {
+        "BATCH_SIZE": 500,
+        "SWEEP_INTERVAL_SECONDS": 30,
+    },
+    "PERFORMANCE_SCAN": {
+        "CURSOR_BATCH_SIZE": 500,
+        "MAX_INLINE_GRADING": 200,
+    },
+    "QUANTILE_SKETCH": {
+        "RELATIVE_ACCURACY": 0.01,
+    },
+    "SOLUTION_SAMPLING": {
+        "CONFIDENCE": 0.95,
+        "TARGET_MARGIN": 0.5,
+        "PRIOR_STDDEV": 1.5,
+        "TIME_BUCKETS": 4,
+        "MIN_PER_STRATUM": 2,
+        "MAX_SAMPLE_SIZE": 400,
+    },
+    "COACHING_CACHE": {
+        "MAX_AGE_SECONDS": 604800,
+        "HANDLING_TIME_DECIMALS": 0,
+        "CSAT_DECIMALS": 1,
+        "SCORE_DECIMALS": 1,
+    },
+    "COMPANY_ANALYTICS": {
+        "REBUILD_ATTEMPTS": 5,
+        "REBUILD_RETRY_SECONDS": 0.2,
+        "RESERVATION_LEASE_SECONDS": 60,
+    },
+    "DB_STATS": {
+        "CACHE_TTL_SECONDS": 10,
+    },
+    "SNAPSHOTS": {
+        "ENABLED": os.getenv("ANALYTICS_SNAPSHOTS_ENABLED", "true").lower() == "true",
+        "DIRECTORY": os.getenv("ANALYTICS_SNAPSHOT_DIR", "snapshots"),
+        "EXPORT_INTERVAL_SECONDS": 3600,
+        "REFRESH_MONTHS": 2,
+        "CURSOR_BATCH_SIZE": 1000,
+        "LEASE_SECONDS": 600,
+        "LEASE_RETRY_SECONDS": 5,
+    },
+    "TRACING": {
+        "ENABLED": os.getenv("TRACING_ENABLED", "false").lower() == "true",
+        "SERVICE_NAME": os.getenv("TRACING_SERVICE_NAME", "agent-ai"),
+        "EXPORT_PATH": os.getenv("TRACE_EXPORT_PATH", "traces/spans.jsonl"),
+        "SAMPLE_RATIO": float(os.getenv("TRACE_SAMPLE_RATIO", "0.01")),
+        "FLUSH_INTERVAL_SECONDS": 2,
+        "MAX_BUFFERED_SPANS": 20000,
+        "MAX_EXPORT_BYTES": int(os.getenv("TRACE_EXPORT_MAX_BYTES", str(64 * 1024 * 1024))),
+        "EXPORT_BACKUPS": 3,
     },
 }
 
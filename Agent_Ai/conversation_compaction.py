@@ -0,0 +1,97 @@
+"""
+Rolling conversation summarization shared by the customer and agent chat modules
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from ai_utils import agenerate_llm_response, estimate_tokens
+from config import AI_CONFIG
+
+compaction_metrics = {
+    "prompts": 0,
+    "raw_context_tokens": 0,
+    "compacted_context_tokens": 0,
+    "summaries_generated": 0,
+    "summary_failures": 0,
+}
+_pending_compactions: Dict[str, asyncio.Task] = {}
+
+def clip_turn(text: str, max_tokens: Optional[int] = None) -> str:
+    """Clip a single conversation turn to a token budget"""
+    max_tokens = max_tokens or AI_CONFIG["CHAT"]["TURN_MAX_TOKENS"]
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * 4].rstrip() + " ..."
+
+def build_compacted_context(summary: str, turns: List[Tuple[str, str]], summarized_raw_tokens: int = 0) -> str:
+    """Build prompt context from the running summary plus the recent turns
+
+    `turns` is a list of (speaker, text) pairs. Token counts for the raw and the
+    compacted context are recorded so the savings can be reported.
+    """
+    context_parts = []
+    if summary:
+        context_parts.append(f"Summary of earlier conversation: {summary}")
+    raw_tokens = summarized_raw_tokens
+    for speaker, text in turns:
+        raw_tokens += estimate_tokens(text)
+        context_parts.append(f"{speaker}: {clip_turn(text)}")
+
+    context = "\n".join(context_parts)
+    compaction_metrics["prompts"] += 1
+    compaction_metrics["raw_context_tokens"] += raw_tokens
+    compaction_metrics["compacted_context_tokens"] += estimate_tokens(context)
+    return context
+
+async def summarize_turns(previous_summary: str, turns: List[Tuple[str, str]]) -> Optional[str]:
+    """Fold older turns into the running summary, returning None if the LLM call fails"""
+    max_tokens = AI_CONFIG["CHAT"]["SUMMARY_MAX_TOKENS"]
+    transcript = "\n".join(f"{speaker}: {text}" for speaker, text in turns)
+    prompt = f"""Update the running summary of a support conversation with the new turns below.
+Keep facts the assistant will need later: the user's issue, details they gave (order numbers, products, dates), what was already suggested and anything still unresolved.
+Write plain prose in at most {max_tokens * 3 // 4} words. Return only the updated summary.
+
+Current summary:
+{previous_summary or "(none)"}
+
+New turns:
+{transcript}
+
+Updated summary:"""
+
+    summary = (await agenerate_llm_response(prompt)).strip()
+    if not summary or summary.startswith("I apologize, but I'm having trouble"):
+        compaction_metrics["summary_failures"] += 1
+        return None
+    compaction_metrics["summaries_generated"] += 1
+    return clip_turn(summary, max_tokens)
+
+def schedule_compaction(key: str, coroutine_factory) -> bool:
+    """Run a compaction in the background unless one is already running for this key"""
+    task = _pending_compactions.get(key)
+    if task is not None and not task.done():
+        return False
+
+    async def run():
+        try:
+            await coroutine_factory()
+        except Exception as e:
+            compaction_metrics["summary_failures"] += 1
+            print(f"Error compacting conversation {key}: {e}")
+        finally:
+            _pending_compactions.pop(key, None)
+
+    _pending_compactions[key] = asyncio.get_running_loop().create_task(run())
+    return True
+
+def get_compaction_metrics() -> Dict:
+    """Get prompt token savings from conversation compaction"""
+    raw = compaction_metrics["raw_context_tokens"]
+    compacted = compaction_metrics["compacted_context_tokens"]
+    return {
+        **compaction_metrics,
+        "tokens_saved": max(raw - compacted, 0),
+        "savings_ratio": (raw - compacted) / raw if raw else 0.0,
+        "avg_context_tokens": compacted / compaction_metrics["prompts"] if compaction_metrics["prompts"] else 0.0,
+        "pending_compactions": len(_pending_compactions),
+    }
@@ -4,11 +4,21 @@
 Customer AI Chat module with optimized structure
 """
 from typing import List, Dict, Optional
+from collections import defaultdict
 import uuid
 import datetime
 import logging
-from ai_utils import get_context_from_kb, generate_llm_response
+import asyncio
+import time
+import re
+import itertools
+import numpy as np
+from ai_utils import aget_scored_context_from_kb, aget_query_embedding, agenerate_llm_response, generate_llm_response, get_query_embedding, estimate_tokens
+from conversation_compaction import build_compacted_context, summarize_turns, schedule_compaction
 from config import AI_CONFIG
+from ticket_triggers import get_trigger_matcher
+from metrics import stage, observe_stage
+from tracing import start_span
 
                    
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,29 +26,40 @@ logger = logging.getLogger("CustomerAI")
 
                                 
 conversation_memory: Dict[str, List[Dict]] = {}
+conversation_summaries: Dict[str, Dict] = {}
+exchange_sequence = itertools.count(1)
 support_tickets: Dict[str, Dict] = {}
+company_intent_configs: Dict[str, Dict] = {}
+intent_metrics: Dict[str, Dict] = defaultdict(lambda: {"total": 0, "short_circuited": 0, "by_intent": defaultdict(int), "by_method": defaultdict(int)})
+_prototype_embeddings: Dict[str, np.ndarray] = {}
+_small_talk_keywords: Dict[Optional[str], Dict[str, str]] = {}
 
 def initialize_customer_ai():
     """Initialize customer AI module"""
     logger.info("Initializing Customer AI module")
+    if AI_CONFIG["INTENT"]["ENABLED"]:
+        for phrases in AI_CONFIG["INTENT"]["PROTOTYPES"].values():
+            for phrase in phrases:
+                if phrase not in _prototype_embeddings:
+                    _prototype_embeddings[phrase] = _unit_vector(get_query_embedding(phrase))
 
                                  
                        
                                  
 def get_conversation_context(session_id: str) -> str:
-    """Get recent conversation history for context"""
-    if session_id not in conversation_memory:
+    """Get the running summary plus recent conversation history for context"""
+    session_summary = conversation_summaries.get(session_id, {})
+    if session_id not in conversation_memory and not session_summary:
         return ""
         
-    history = conversation_memory[session_id]
-    recent_history = history[-AI_CONFIG["CHAT"]["RECENT_HISTORY"]:]
+    recent_history = _unsummarized_exchanges(session_id)[-AI_CONFIG["CHAT"]["RECENT_HISTORY"]:]
     
-    context_parts = []
+    turns = []
     for exchange in recent_history:
-        context_parts.append(f"User: {exchange['query']}")
-        context_parts.append(f"Chatbot: {exchange['response']}")
+        turns.append(("User", exchange['query']))
+        turns.append(("Chatbot", exchange['response']))
     
-    return "\n".join(context_parts)
+    return build_compacted_context(session_summary.get("summary", ""), turns, session_summary.get("raw_tokens", 0))
 
 def store_conversation(session_id: str, query: str, response: str) -> None:
     """Store conversation exchange in memory"""
@@ -48,6 +69,7 @@ def store_conversation(session_id: str, query: str, response: str) -> None:
     conversation_memory[session_id].append({
         'query': query,
         'response': response,
+        'seq': next(exchange_sequence),
         'timestamp': datetime.datetime.utcnow()
     })
     
@@ -56,8 +78,51 @@ def store_conversation(session_id: str, query: str, response: str) -> None:
     if len(conversation_memory[session_id]) > max_history:
         conversation_memory[session_id] = conversation_memory[session_id][-max_history:]
 
+def _unsummarized_exchanges(session_id: str) -> List[Dict]:
+    summarized_through = conversation_summaries.get(session_id, {}).get("summarized_through")
+    history = conversation_memory.get(session_id, [])
+    if summarized_through is None:
+        return history
+    return [exchange for exchange in history if exchange['seq'] > summarized_through]
+
+async def compact_conversation(session_id: str) -> bool:
+    """Fold exchanges older than the recent window into the session's running summary
+
+    Only the prompt context is compacted; the session history itself is kept
+    for /customer-chat/get-conversation.
+    """
+    older = _unsummarized_exchanges(session_id)[:-AI_CONFIG["CHAT"]["RECENT_HISTORY"]]
+    if not older:
+        return False
+
+    session_summary = conversation_summaries.get(session_id, {})
+    turns = []
+    for exchange in older:
+        turns.append(("User", exchange['query']))
+        turns.append(("Chatbot", exchange['response']))
+
+    summary = await summarize_turns(session_summary.get("summary", ""), turns)
+    if summary is None or session_id not in conversation_memory:
+        return False
+
+    conversation_summaries[session_id] = {
+        "summary": summary,
+        "summarized_through": older[-1]['seq'],
+        "raw_tokens": session_summary.get("raw_tokens", 0) + sum(estimate_tokens(text) for _, text in turns),
+        "updated_at": datetime.datetime.utcnow()
+    }
+    return True
+
+def maybe_compact_conversation(session_id: str) -> bool:
+    """Schedule compaction off the hot path once enough exchanges have left the recent window"""
+    overflow = len(_unsummarized_exchanges(session_id)) - AI_CONFIG["CHAT"]["RECENT_HISTORY"]
+    if overflow < AI_CONFIG["CHAT"]["COMPACTION_BATCH"]:
+        return False
+    return schedule_compaction(f"customer:{session_id}", lambda: compact_conversation(session_id))
+
 def clear_conversation_memory(session_id: str) -> bool:
     """Clear conversation memory for a session"""
+    conversation_summaries.pop(session_id, None)
     if session_id in conversation_memory:
         del conversation_memory[session_id]
         logger.info(f"Cleared conversation memory for session {session_id}")
@@ -73,80 +138,154 @@ def get_conversation_summary(session_id: str) -> dict:
     return {
         "session_id": session_id,
         "total_exchanges": len(history),
+        "summary": conversation_summaries.get(session_id, {}).get("summary"),
         "conversation": history
     }
 
                                  
                        
                                  
-def should_create_ticket(query: str, context_chunks: List[str]) -> bool:
+def detect_ticket_trigger(query: str, context_chunks: List[str], company_id: Optional[str] = None) -> Optional[Dict]:
+    """Return the ticket trigger rule that fired for the query, or None"""
+    trigger = get_trigger_matcher(company_id).match(query, context_chunks)
+    if trigger:
+        logger.info(f"Ticket creation triggered by {trigger['rule']}: '{trigger['trigger']}'")
+    else:
+        logger.debug("No ticket creation triggers found")
+    return trigger
+
+def should_create_ticket(query: str, context_chunks: List[str], company_id: Optional[str] = None) -> bool:
     """Determine if a support ticket should be created based on user query"""
-    
-    query_lower = query.lower()
-    logger.info(f"🎟️ Checking if ticket should be created for query: '{query[:50]}...'")
-    logger.info(f"📝 Query lowercase: '{query_lower}'")
-    logger.info(f"📚 Context chunks available: {len(context_chunks)}")
-    
-                                               
-    try:
-        help_indicators = AI_CONFIG["TICKET"]["HELP_INDICATORS"]
-        logger.info(f"🔍 Checking help indicators: {help_indicators}")
-        for indicator in help_indicators:
-            if indicator in query_lower:
-                logger.info(f"✅ Ticket creation triggered by help indicator: '{indicator}'")
-                return True
-    except Exception as e:
-        logger.error(f"❌ Error accessing AI_CONFIG help indicators: {e}")
-    
-                                         
-    distress_signals = [
-        "urgent", "emergency", "problem", "broken", "not working", "help me",
-        "frustrated", "angry", "mad", "upset", "disappointed", "terrible",
-        "awful", "horrible", "worst", "hate", "disgusted", "furious",
-        "outraged", "livid", "annoyed", "irritated", "fed up", "sick of",
-        "can't stand", "ridiculous", "stupid", "useless", "pathetic",
-        "unacceptable", "outrageous", "shocking", "appalling", "fix this",
-        "doesn't work", "not functioning", "issue with", "trouble with"
-    ]
-    
-    logger.info(f"🔍 Checking distress signals...")
-    for signal in distress_signals:
-        if signal in query_lower:
-            logger.info(f"✅ Ticket creation triggered by distress signal: '{signal}'")
-            return True
-    
-                                                                       
-    has_multiple_exclamation = "!!!" in query
-    has_caps = query.isupper() and len(query) > 10
-    logger.info(f"🎭 Emotional intensity check - Multiple exclamation: {has_multiple_exclamation}, All caps: {has_caps}")
-    
-    if has_multiple_exclamation or has_caps:
-        logger.info("✅ Ticket creation triggered by emotional intensity")
-        return True
-    
-                                            
-    no_relevant_context = len(context_chunks) == 0
-    is_complex_issue = len(query) > 100 and any(word in query_lower for word in ["issue", "problem", "error", "fail", "wrong"])
-    logger.info(f"🧩 Complex issue check - No context: {no_relevant_context}, Complex: {is_complex_issue}")
-    
-    if no_relevant_context and is_complex_issue:
-        logger.info("✅ Ticket creation triggered by complex issue without context")
-        return True
-    
-                          
-    complaint_words = [
-        "complain", "complaint", "report", "dissatisfied", "unhappy",
-        "refund", "compensation", "manager", "supervisor", "escalate"
-    ]
-    
-    logger.info(f"🔍 Checking complaint indicators...")
-    for word in complaint_words:
-        if word in query_lower:
-            logger.info(f"✅ Ticket creation triggered by complaint indicator: '{word}'")
-            return True
-    
-    logger.info("❌ No ticket creation triggers found")
-    return False
+    return detect_ticket_trigger(query, context_chunks, company_id) is not None
+
+                                 
+                       
+                                 
+def get_intent_config(company_id: Optional[str] = None) -> Dict:
+    """Get the intent routing config for a company, merged over the defaults"""
+    config = dict(AI_CONFIG["INTENT"])
+    overrides = company_intent_configs.get(company_id) if company_id else None
+    if overrides:
+        prototypes = {intent: list(phrases) for intent, phrases in config["PROTOTYPES"].items()}
+        for intent, phrases in (overrides.get("prototypes") or {}).items():
+            prototypes[intent] = prototypes.get(intent, []) + list(phrases)
+        threshold = overrides.get("embedding_threshold")
+        config.update({
+            "ENABLED": overrides.get("enabled", config["ENABLED"]),
+            "MODE": overrides.get("mode") or config["MODE"],
+            "EMBEDDING_THRESHOLD": config["EMBEDDING_THRESHOLD"] if threshold is None else threshold,
+            "PROTOTYPES": prototypes,
+            "TEMPLATES": {**config["TEMPLATES"], **(overrides.get("templates") or {})},
+        })
+    return config
+
+def set_company_intent_config(company_id: str, overrides: Optional[Dict]) -> Dict:
+    """Install or remove intent routing overrides for one company"""
+    if overrides:
+        company_intent_configs[company_id] = overrides
+    else:
+        company_intent_configs.pop(company_id, None)
+    _small_talk_keywords.pop(company_id, None)
+    return get_intent_config(company_id)
+
+def get_small_talk_keywords(company_id: Optional[str] = None, config: Optional[Dict] = None) -> Dict[str, str]:
+    """Get the normalized prototype phrase -> intent lookup for a company, built once per config"""
+    key = company_id if company_id in company_intent_configs else None
+    keywords = _small_talk_keywords.get(key)
+    if keywords is None:
+        keywords = {}
+        for intent, phrases in (config or get_intent_config(key))["PROTOTYPES"].items():
+            for phrase in phrases:
+                keywords.setdefault(_normalize_small_talk(phrase), intent)
+        _small_talk_keywords[key] = keywords
+    return keywords
+
+def small_talk_template(intent: str, company_id: Optional[str] = None, config: Optional[Dict] = None) -> str:
+    """Get the template reply for a small talk intent, falling back to the acknowledgement"""
+    templates = (config or get_intent_config(company_id))["TEMPLATES"]
+    return templates.get(intent) or AI_CONFIG["INTENT"]["TEMPLATES"]["acknowledgement"]
+
+def _normalize_small_talk(query: str) -> str:
+    return " ".join(re.sub(r"[^a-z' ]+", " ", query.lower()).split())
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+async def _get_prototype_embedding(phrase: str) -> np.ndarray:
+    embedding = _prototype_embeddings.get(phrase)
+    if embedding is None:
+        embedding = _prototype_embeddings[phrase] = _unit_vector(await aget_query_embedding(phrase))
+    return embedding
+
+async def classify_intent(query: str, company_id: Optional[str] = None) -> Dict:
+    """Classify a message as small talk using keyword then embedding prototypes
+
+    Returns the intent (None for anything that needs retrieval), the method that
+    decided it and, when one was computed, the query embedding so retrieval can
+    reuse it.
+    """
+    config = get_intent_config(company_id)
+    result = {"intent": None, "method": None, "score": None, "embedding": None}
+    if not config["ENABLED"]:
+        return result
+
+    normalized = _normalize_small_talk(query)
+    keyword_intent = get_small_talk_keywords(company_id, config).get(normalized)
+    if keyword_intent:
+        result.update(intent=keyword_intent, method="keyword", score=1.0)
+        return result
+
+    if not normalized or len(normalized.split()) > config["MAX_QUERY_WORDS"]:
+        return result
+
+    embedding = await aget_query_embedding(query)
+    result["embedding"] = embedding
+    vector = _unit_vector(embedding)
+
+    best_intent, best_score = None, -1.0
+    for intent, phrases in config["PROTOTYPES"].items():
+        for phrase in phrases:
+            score = float(np.dot(vector, await _get_prototype_embedding(phrase)))
+            if score > best_score:
+                best_intent, best_score = intent, score
+
+    if best_score >= config["EMBEDDING_THRESHOLD"]:
+        result.update(intent=best_intent, method="embedding", score=round(best_score, 4))
+    return result
+
+async def generate_small_talk_response(intent: str, query: str, company_id: Optional[str] = None, company_name: Optional[str] = None) -> str:
+    """Answer small talk from a template, or a short prompt with no retrieval"""
+    config = get_intent_config(company_id)
+    if config["MODE"] == "llm":
+        company_context = f" for {company_name}" if company_name else ""
+        prompt = f"""You are a friendly customer support assistant{company_context}.
+The customer sent a short {intent} message: "{query}"
+Reply in one short, warm sentence and invite them to share anything they need help with."""
+        return (await agenerate_llm_response(prompt)).strip()
+    return small_talk_template(intent, config=config)
+
+def record_intent_route(company_id: Optional[str], intent_result: Dict, short_circuited: bool) -> None:
+    """Count a routed message for the intent routing metrics"""
+    for key in ("all", company_id or "none"):
+        metrics = intent_metrics[key]
+        metrics["total"] += 1
+        if short_circuited:
+            metrics["short_circuited"] += 1
+            metrics["by_intent"][intent_result["intent"]] += 1
+            metrics["by_method"][intent_result["method"]] += 1
+
+def get_intent_metrics(company_id: Optional[str] = None) -> Dict:
+    """Get the fraction of traffic the intent router answered without retrieval"""
+    metrics = intent_metrics.get(company_id or "all") or {"total": 0, "short_circuited": 0, "by_intent": {}, "by_method": {}}
+    return {
+        "company_id": company_id,
+        "total": metrics["total"],
+        "short_circuited": metrics["short_circuited"],
+        "short_circuit_rate": metrics["short_circuited"] / metrics["total"] if metrics["total"] else 0.0,
+        "by_intent": dict(metrics["by_intent"]),
+        "by_method": dict(metrics["by_method"]),
+    }
 
 def create_support_ticket(session_id: str, issue: str) -> str:
     """Create a support ticket in memory"""
@@ -165,21 +304,22 @@ def create_support_ticket(session_id: str, issue: str) -> str:
                                  
                              
                                  
-def generate_customer_response(context_chunks: List[str], question: str, conversation_context: str = "", company_name: str = None) -> str:
+async def generate_customer_response(context_chunks: List[str], question: str, conversation_context: str = "", company_name: str = None) -> str:
     """Generate response specifically for customer queries"""
-                                
-    context_text = "\n\n".join(context_chunks) if context_chunks else "No specific information found on this topic."
-    
-    company_context = f"You are a customer support AI for {company_name}." if company_name else "You are a customer support AI."
-    
-    system_prompt = f"""
+    with stage("build_prompt"):
+                                    
+        context_text = "\n\n".join(context_chunks) if context_chunks else "No specific information found on this topic."
+        
+        company_context = f"You are a customer support AI for {company_name}." if company_name else "You are a customer support AI."
+        
+        system_prompt = f"""
     {company_context}
     Be helpful, friendly, and concise in your responses.
     If you don't know something, be honest about it.
     Only offer to create a support ticket if the user has an actual problem that needs human assistance.
     """
-    
-    prompt = f"""
+        
+        prompt = f"""
     Conversation History:
     {conversation_context}
     
@@ -191,55 +331,133 @@ def generate_customer_response(context_chunks: List[str], question: str, convers
     Your helpful response:
     """
     
-    return generate_llm_response(prompt, system_prompt)
+    return await agenerate_llm_response(prompt, system_prompt)
+
+async def _timed_stage(timings: Dict[str, float], stage: str, awaitable, timeout: Optional[float] = None):
+    """Await a pipeline stage, recording its wall time in milliseconds, in the latency histograms and as a trace span"""
+    stage_start = time.perf_counter()
+    failed = False
+    try:
+        with start_span(stage):
+            if timeout is None:
+                return await awaitable
+            return await asyncio.wait_for(awaitable, timeout=max(timeout, 0))
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - stage_start
+        timings[f"{stage}_ms"] = round(elapsed * 1000, 2)
+        observe_stage(stage, elapsed, failed)
 
                                  
                     
                                  
-def chatbot_respond_to_user(
+async def chatbot_respond_to_user(
     query: str, 
     session_id: str = "default",
     company_id: Optional[str] = None,
-    company_name: Optional[str] = None
+    company_name: Optional[str] = None,
+    deadline_seconds: Optional[float] = None
 ) -> dict:
     """Main function to generate customer chatbot responses"""
-                                           
+    started = time.perf_counter()
+    deadline = started + (deadline_seconds or AI_CONFIG["CHAT"]["RESPONSE_DEADLINE_SECONDS"])
+    timings: Dict[str, float] = {}
+    deadline_exceeded = False
+
     if not session_id or session_id == "default":
         session_id = f"chat-{uuid.uuid4().hex[:8]}"
         
     logger.info(f"Processing query for session {session_id[:10]}...")
     
-                              
-    conversation_context = get_conversation_context(session_id)
-    
-                                         
-    context_chunks = get_context_from_kb(query, company_id)
-    
-                                        
-    ticket_creation = should_create_ticket(query, context_chunks)
-    ticket_id = None
-    
-                       
-    if not context_chunks:
-        response = generate_customer_response([], query, conversation_context, company_name)
+    matcher = get_trigger_matcher(company_id)
+    trigger_task = asyncio.ensure_future(_timed_stage(timings, "ticket_trigger", asyncio.to_thread(matcher.match_keywords, query)))
+    try:
+        intent_result = await _timed_stage(timings, "intent", classify_intent(query, company_id), deadline - time.perf_counter())
+    except asyncio.TimeoutError:
+        logger.warning(f"Intent classification exceeded the deadline for session {session_id[:10]}")
+        deadline_exceeded = True
+        intent_result = {"intent": None, "method": None, "score": None, "embedding": None}
+    trigger_result = (await asyncio.gather(trigger_task, return_exceptions=True))[0]
+    short_circuit = intent_result["intent"] is not None and not isinstance(trigger_result, dict)
+    record_intent_route(company_id, intent_result, short_circuit)
+    if short_circuit:
+        try:
+            response = await _timed_stage(
+                timings, "generation",
+                generate_small_talk_response(intent_result["intent"], query, company_id, company_name),
+                deadline - time.perf_counter()
+            )
+        except asyncio.TimeoutError:
+            deadline_exceeded = True
+            response = small_talk_template(intent_result["intent"], company_id)
+        store_conversation(session_id, query, response)
+        maybe_compact_conversation(session_id)
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return {
+            "answer": response,
+            "sources": [],
+            "source_scores": [],
+            "session_id": session_id,
+            "timings": timings,
+            "deadline_exceeded": deadline_exceeded,
+            "intent": {key: intent_result[key] for key in ("intent", "method", "score")},
+        }
+
+    history_result, retrieval_result = await asyncio.gather(
+        _timed_stage(timings, "history", asyncio.to_thread(get_conversation_context, session_id)),
+        _timed_stage(timings, "retrieval", aget_scored_context_from_kb(query, company_id, intent_result["embedding"], "customer"), deadline - time.perf_counter()),
+        return_exceptions=True
+    )
+
+    conversation_context = history_result if isinstance(history_result, str) else ""
+    if isinstance(retrieval_result, asyncio.TimeoutError):
+        logger.warning(f"Knowledge base retrieval exceeded the deadline for session {session_id[:10]}")
+        deadline_exceeded = True
+        scored_chunks = []
+    elif isinstance(retrieval_result, Exception):
+        logger.error(f"Knowledge base retrieval failed: {retrieval_result}")
+        scored_chunks = []
     else:
-        response = generate_customer_response(context_chunks, query, conversation_context, company_name)
-                                        
-    store_conversation(session_id, query, response)
+        scored_chunks = retrieval_result
+    context_chunks = [chunk["text"] for chunk in scored_chunks]
+
+    ticket_trigger = trigger_result if isinstance(trigger_result, dict) else None
+    if not ticket_trigger:
+        ticket_trigger = matcher.match_complex_issue(query, context_chunks)
+    if ticket_trigger:
+        logger.info(f"Ticket creation triggered by {ticket_trigger['rule']}: '{ticket_trigger['trigger']}'")
+
+    try:
+        response = await _timed_stage(
+            timings, "generation",
+            generate_customer_response(context_chunks, query, conversation_context, company_name),
+            deadline - time.perf_counter()
+        )
+        store_conversation(session_id, query, response)
+        maybe_compact_conversation(session_id)
+    except asyncio.TimeoutError:
+        logger.warning(f"Response generation exceeded the deadline for session {session_id[:10]}")
+        deadline_exceeded = True
+        response = "I'm sorry, this is taking longer than expected. Please try again in a moment or ask to speak with a support agent."
+
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
     
-                                          
     result = {
         "answer": response,
         "sources": context_chunks,
+        "source_scores": [chunk["score"] for chunk in scored_chunks],
         "session_id": session_id,
+        "timings": timings,
+        "deadline_exceeded": deadline_exceeded,
     }
     
-                                                  
-    if ticket_creation:
+    if ticket_trigger:
         result["should_create_ticket"] = True
+        result["ticket_trigger"] = ticket_trigger
         result["ticket_title"] = f"Customer Support Request: {query[:50]}..."
         result["ticket_content"] = query
-                                                                           
     
     return result
 
@@ -275,6 +493,7 @@ def get_support_ticket(ticket_id: str) -> Dict:
            
                                  
 def clear_conversation_memory(session_id: str) -> bool:
+    conversation_summaries.pop(session_id, None)
     if session_id in conversation_memory:
         del conversation_memory[session_id]
         logger.info(f"Cleared conversation memory for session {session_id}")
@@ -288,6 +507,7 @@ def get_conversation_summary(session_id: str) -> dict:
     return {
         "session_id": session_id,
         "total_exchanges": len(history),
+        "summary": conversation_summaries.get(session_id, {}).get("summary"),
         "conversation": history
     }
 
@@ -5,6 +5,8 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from typing import Dict, List, Optional, Any
 
+from metrics import timed
+
                           
 mongodb_client = None
 database = None
@@ -30,12 +32,14 @@ async def close_mongodb_connection():
         mongodb_client.close()
 
                                            
+@timed("mongo.find_one")
 async def find_one(collection: str, query: Dict) -> Optional[Dict]:
     """Wrapper for MongoDB find_one operation"""
     if not database:
         raise ValueError("Database not initialized")
     return await database[collection].find_one(query)
 
+@timed("mongo.find_many")
 async def find_many(collection: str, query: Dict, limit: Optional[int] = None) -> List[Dict]:
     """Wrapper for MongoDB find operation"""
     if not database:
@@ -45,6 +49,7 @@ async def find_many(collection: str, query: Dict, limit: Optional[int] = None) -
         cursor = cursor.limit(limit)
     return await cursor.to_list(length=limit)
 
+@timed("mongo.insert_one")
 async def insert_one(collection: str, document: Dict) -> str:
     """Wrapper for MongoDB insert_one operation"""
     if not database:
@@ -52,6 +57,7 @@ async def insert_one(collection: str, document: Dict) -> str:
     result = await database[collection].insert_one(document)
     return str(result.inserted_id)
 
+@timed("mongo.update_one")
 async def update_one(collection: str, query: Dict, update: Dict, upsert: bool = False) -> int:
     """Wrapper for MongoDB update_one operation"""
     if not database:
@@ -59,12 +65,14 @@ async def update_one(collection: str, query: Dict, update: Dict, upsert: bool =
     result = await database[collection].update_one(query, update, upsert=upsert)
     return result.modified_count
 
+@timed("mongo.count_documents")
 async def count_documents(collection: str, query: Dict) -> int:
     """Wrapper for MongoDB count_documents operation"""
     if not database:
         raise ValueError("Database not initialized")
     return await database[collection].count_documents(query)
 
+@timed("mongo.aggregate")
 async def aggregate(collection: str, pipeline: List[Dict], limit: Optional[int] = None) -> List[Dict]:
     """Wrapper for MongoDB aggregate operation"""
     if not database:
@@ -0,0 +1,114 @@
+"""
+Bounded-concurrency fan-out for batches of LLM calls
+
+Each call holds a slot of its tenant's semaphore and then a slot of the global
+semaphore, so one company's large report cannot take every slot. Rate-limit
+errors are retried with full-jitter exponential backoff, sleeping outside both
+semaphores. When the deadline passes, calls still running are cancelled and
+reported as pending so the caller can return partial results.
+"""
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import AI_CONFIG
+
+RATE_LIMIT_MARKERS = ("429", "rate limit", "ratelimit", "quota", "resource exhausted", "resource_exhausted", "too many requests")
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an LLM client error is a rate-limit or quota rejection"""
+    if getattr(error, "code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    if type(error).__name__ in ("ResourceExhausted", "RateLimitError", "TooManyRequests"):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+class LLMFanOutExecutor:
+    """Runs keyed LLM calls concurrently under global and per-tenant caps"""
+
+    def __init__(self, global_limit: int, tenant_limit: int, max_retries: int, backoff_base: float, backoff_max: float):
+        self.global_limit = global_limit
+        self.tenant_limit = tenant_limit
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._global: Optional[asyncio.Semaphore] = None
+        self._tenants: Dict[str, asyncio.Semaphore] = {}
+        self.stats = {"calls": 0, "succeeded": 0, "failed": 0, "rate_limited": 0, "retries": 0, "timed_out": 0, "in_flight": 0}
+
+    def _semaphores(self, tenant: str):
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.global_limit)
+        if tenant not in self._tenants:
+            self._tenants[tenant] = asyncio.Semaphore(self.tenant_limit)
+        return self._tenants[tenant], self._global
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def call(self, tenant: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        """Run one call under the tenant and global caps, retrying rate-limit errors"""
+        tenant_slot, global_slot = self._semaphores(tenant)
+        attempt = 0
+        while True:
+            async with tenant_slot:
+                async with global_slot:
+                    self.stats["calls"] += 1
+                    self.stats["in_flight"] += 1
+                    try:
+                        return await func(*args)
+                    except Exception as e:
+                        if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                            raise
+                        self.stats["rate_limited"] += 1
+                    finally:
+                        self.stats["in_flight"] -= 1
+            self.stats["retries"] += 1
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+
+    async def map(self, tenant: str, items: Dict[str, Any], func: Callable[[Any], Awaitable[Any]], deadline_seconds: Optional[float] = None) -> Dict:
+        """Apply func to every item concurrently and collect what finished before the deadline
+
+        Returns results and failures keyed like `items`, the keys still pending
+        at the deadline, and whether the deadline was hit.
+        """
+        start = time.perf_counter()
+        tasks = {asyncio.ensure_future(self.call(tenant, func, item)): key for key, item in items.items()}
+        results, failed, pending = {}, {}, []
+        if tasks:
+            done, not_done = await asyncio.wait(tasks, timeout=deadline_seconds)
+            for task in not_done:
+                task.cancel()
+                pending.append(tasks[task])
+            await asyncio.gather(*not_done, return_exceptions=True)
+            self.stats["timed_out"] += len(not_done)
+            for task in done:
+                key = tasks[task]
+                if task.exception() is not None:
+                    failed[key] = str(task.exception())
+                    self.stats["failed"] += 1
+                else:
+                    results[key] = task.result()
+                    self.stats["succeeded"] += 1
+        return {
+            "results": results,
+            "failed": failed,
+            "pending": pending,
+            "deadline_exceeded": bool(pending),
+            "took_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    def get_stats(self) -> Dict:
+        """Get call, retry and timeout counters"""
+        return {**self.stats, "tenants": len(self._tenants)}
+
+llm_executor = LLMFanOutExecutor(
+    global_limit=AI_CONFIG["LLM_FANOUT"]["GLOBAL_CONCURRENCY"],
+    tenant_limit=AI_CONFIG["LLM_FANOUT"]["TENANT_CONCURRENCY"],
+    max_retries=AI_CONFIG["LLM_FANOUT"]["MAX_RETRIES"],
+    backoff_base=AI_CONFIG["LLM_FANOUT"]["BACKOFF_BASE_SECONDS"],
+    backoff_max=AI_CONFIG["LLM_FANOUT"]["BACKOFF_MAX_SECONDS"],
+)
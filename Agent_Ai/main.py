@@ -1,4 +1,5 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, BackgroundTasks, Depends
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import pandas as pd
@@ -9,12 +10,31 @@ from datetime import datetime
 import os
 import asyncio
 import re
+import time
 from contextlib import asynccontextmanager
 
-from config import MONGODB_URL, DATABASE_NAME
+from config import MONGODB_URL, DATABASE_NAME, AI_CONFIG
 from database import initialize_mongodb, get_db, get_client, close_mongodb_connection
 from ai_utils import get_context_from_kb, generate_llm_response
 from performance_monitor import performance_router
+from analytics_snapshots import snapshot_router, initialize_analytics_snapshots, run_snapshot_exporter
+from ticket_triggers import get_trigger_matcher, set_company_triggers, reload_triggers
+from conversation_compaction import get_compaction_metrics
+from agent_context_cache import agent_context_cache
+from metrics import timed, bind_endpoint, latency_histograms, RequestLatencyMiddleware
+from tracing import TracingMiddleware, run_span_exporter, span_exporter
+from ticket_analytics import (
+    initialize_ticket_analytics,
+    ensure_ticket_analytics_indexes,
+    compute_company_analytics,
+    load_company_analytics,
+    rebuild_company_analytics,
+    reserve_ticket_analysis,
+    record_ticket_analysis,
+    analytics_response,
+    load_company_trends,
+    TREND_GRANULARITIES
+)
 
 from agent_assist import (
     answer_agent_query, 
@@ -23,6 +43,9 @@ from agent_assist import (
     get_ticket_ai_response, 
     get_customer_ticket_history,
     get_similar_tickets,
+    search_agent_conversations,
+    ensure_agent_search_indexes,
+    backfill_agent_search_index,
     initialize_agent_assist
 )
 
@@ -30,6 +53,9 @@ from customer_ai import (
     chatbot_respond_to_user as customer_chatbot_respond,
     clear_conversation_memory as customer_clear_conversation,
     get_conversation_summary as customer_get_conversation_summary,
+    get_intent_config,
+    get_intent_metrics,
+    set_company_intent_config,
     initialize_customer_ai
 )
 
@@ -42,22 +68,56 @@ async def lifespan(app: FastAPI):
     db = initialize_mongodb(MONGODB_URL, DATABASE_NAME)
     
     initialize_agent_assist(db)
+    search_backfill = None
+    try:
+        await ensure_agent_search_indexes()
+        search_backfill = asyncio.create_task(backfill_agent_search_index())
+    except Exception as e:
+        print(f"Error preparing agent conversation search: {e}")
     initialize_customer_ai()
+    initialize_ticket_analytics(db)
+    try:
+        await ensure_ticket_analytics_indexes()
+    except Exception as e:
+        print(f"Error preparing ticket analytics indexes: {e}")
+    await load_ticket_trigger_sets()
+    await load_intent_configs()
     
-    from performance_monitor import initialize_performance_mongodb
+    from performance_monitor import initialize_performance_mongodb, ensure_performance_indexes
+    from performance_rollups import run_rollup_sweeper
     initialize_performance_mongodb(db)
+    try:
+        await ensure_performance_indexes()
+    except Exception as e:
+        print(f"Error preparing performance indexes: {e}")
+    rollup_sweeper = asyncio.create_task(run_rollup_sweeper())
+    
+    initialize_analytics_snapshots(db)
+    snapshot_exporter = asyncio.create_task(run_snapshot_exporter()) if AI_CONFIG["SNAPSHOTS"]["ENABLED"] else None
+    span_exporter = asyncio.create_task(run_span_exporter()) if AI_CONFIG["TRACING"]["ENABLED"] else None
     
     yield
     
+    rollup_sweeper.cancel()
+    if search_backfill:
+        search_backfill.cancel()
+    if snapshot_exporter:
+        snapshot_exporter.cancel()
+    if span_exporter:
+        span_exporter.cancel()
     await close_mongodb_connection()
 
 app = FastAPI(
     title="AI Customer Support API",
     description="API for AI-powered customer support features",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    dependencies=[Depends(bind_endpoint)]
 )
+app.add_middleware(RequestLatencyMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(performance_router)
+app.include_router(snapshot_router)
 
 class TicketAnalysisRequest(BaseModel):
     ticket_id: str 
@@ -83,18 +143,43 @@ class ResolvedTicket(BaseModel):
     solution: str
     agent_involvement: bool
     
+class AgentConversationSearchRequest(BaseModel):
+    agent_id: str
+    query: str
+    limit: Optional[int] = 10
+    cursor: Optional[str] = None
+
 class CustomerChatRequest(BaseModel):
     query: str
     session_id: Optional[str] = "default"
     company_id: Optional[str] = None
     company_name: Optional[str] = None
+    deadline_ms: Optional[int] = None
 
 class CustomerChatResponse(BaseModel):
     answer: str
     sources: List[str]
+    source_scores: Optional[List[Optional[float]]] = None
     session_id: str
     should_create_ticket: Optional[bool] = False
     ticket_id: Optional[str] = None
+    ticket_trigger: Optional[Dict] = None
+    timings: Optional[Dict[str, float]] = None
+    deadline_exceeded: Optional[bool] = False
+    intent: Optional[Dict] = None
+
+class TicketTriggerSet(BaseModel):
+    help_indicators: Optional[List[str]] = None
+    distress_signals: Optional[List[str]] = None
+    complaint_words: Optional[List[str]] = None
+    mode: Optional[str] = "extend"
+
+class IntentRoutingConfig(BaseModel):
+    enabled: Optional[bool] = None
+    mode: Optional[str] = None
+    embedding_threshold: Optional[float] = None
+    prototypes: Optional[Dict[str, List[str]]] = None
+    templates: Optional[Dict[str, str]] = None
 
 class AgentTicketQuery(BaseModel):
     query: str
@@ -111,6 +196,30 @@ class SimilarTicketsRequest(BaseModel):
     ticket_id: str
     limit: Optional[int] = 3
 
+async def load_ticket_trigger_sets():
+    """Load per-company ticket trigger sets from MongoDB and rebuild the matchers"""
+    try:
+        database = get_db()
+        trigger_docs = await database.tickettriggers.find({}).to_list(length=None)
+        trigger_sets = {str(doc["companyId"]): doc.get("triggers", {}) for doc in trigger_docs}
+        return reload_triggers(trigger_sets)
+    except Exception as e:
+        print(f"Error loading ticket trigger sets: {e}")
+        return reload_triggers()
+
+async def load_intent_configs():
+    """Load per-company intent routing overrides from MongoDB"""
+    try:
+        database = get_db()
+        config_docs = await database.intentconfigs.find({}).to_list(length=None)
+        for doc in config_docs:
+            set_company_intent_config(str(doc["companyId"]), doc.get("config"))
+        return len(config_docs)
+    except Exception as e:
+        print(f"Error loading intent configs: {e}")
+        return 0
+
+@timed("get_ticket_by_id")
 async def get_ticket_by_id(ticket_id: str):
     """Fetch ticket by ID from MongoDB"""
     from error_handler import safe_object_id
@@ -134,6 +243,7 @@ async def get_ticket_by_id(ticket_id: str):
         print(f"Error fetching ticket {ticket_id}: {e}")
         return None
 
+@timed("get_chat_by_id")
 async def get_chat_by_id(chat_id: str):
     """Fetch chat by ID from MongoDB"""
     try:
@@ -144,6 +254,7 @@ async def get_chat_by_id(chat_id: str):
         print(f"Error fetching chat: {e}")
         return None
 
+@timed("get_company_tickets")
 async def get_company_tickets(company_id: str, limit: int = 100):
     """Get resolved tickets for a company for similarity analysis"""    
     try:
@@ -158,6 +269,7 @@ async def get_company_tickets(company_id: str, limit: int = 100):
         print(f"Error fetching company tickets: {e}")
         return []
 
+@timed("get_knowledge_base")
 async def get_knowledge_base(company_id: str):
     """Get knowledge base for a company"""
     try:
@@ -168,16 +280,24 @@ async def get_knowledge_base(company_id: str):
         print(f"Error fetching knowledge base: {e}")
         return None
 
+@timed("save_ai_ticket_analysis")
 async def save_ai_ticket_analysis(analysis_data: Dict):
     """Save AI ticket analysis to MongoDB"""    
     try:
         database = get_db()
-        result = await database.aitickets.insert_one(analysis_data)
+        reservation = await reserve_ticket_analysis(analysis_data["companyId"])
+        try:
+            result = await database.aitickets.insert_one(analysis_data)
+        except Exception:
+            await record_ticket_analysis(analysis_data, reservation, saved=False)
+            raise
+        await record_ticket_analysis(analysis_data, reservation)
         return str(result.inserted_id)
     except Exception as e:
         print(f"Error saving AI ticket analysis: {e}")
         return None
 
+@timed("check_existing_analysis")
 async def check_existing_analysis(ticket_id: str):
     """Check if analysis already exists for this ticket"""
     from error_handler import safe_object_id
@@ -488,51 +608,79 @@ async def get_ticket_analysis(ticket_id: str):
         handle_db_error(e, f"fetching analysis for ticket {ticket_id}")
 
 @app.get("/company-analytics/{company_id}")
-async def get_company_analytics(company_id: str):
-    """Get analytics for a company"""
+async def get_company_analytics(company_id: str, live: bool = False):
+    """Get analytics for a company from its materialized document, or from aitickets with live=true"""
+    try:
+        if live:
+            return analytics_response(company_id, await compute_company_analytics(company_id), "live")
+        return analytics_response(company_id, await load_company_analytics(company_id), "materialized")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+
+@app.get("/company-analytics/{company_id}/trends")
+async def get_company_trends(company_id: str, granularity: str = "day", start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
+    """Get category and priority distributions per day, week or month"""
+    if granularity not in TREND_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(TREND_GRANULARITIES)}")
     try:
-        database = get_db()
-        total_analyzed = await database.aitickets.count_documents({"companyId": ObjectId(company_id)})
-
-        pipeline = [
-            {"$match": {"companyId": ObjectId(company_id)}},
-            {"$group": {"_id": "$category", "count": {"$sum": 1}}}
-        ]
-        category_stats = await database.aitickets.aggregate(pipeline).to_list(length=100)
-
-        pipeline = [
-            {"$match": {"companyId": ObjectId(company_id)}},
-            {"$group": {"_id": "$priority_rate", "count": {"$sum": 1}}}
-        ]
-        priority_stats = await database.aitickets.aggregate(pipeline).to_list(length=100)
-        
         return {
             "company_id": company_id,
-            "total_tickets_analyzed": total_analyzed,
-            "category_distribution": {stat["_id"]: stat["count"] for stat in category_stats},
-            "priority_distribution": {stat["_id"]: stat["count"] for stat in priority_stats}
+            "granularity": granularity,
+            "buckets": await load_company_trends(company_id, granularity, start_date, end_date)
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching trends: {str(e)}")
+
+@app.post("/company-analytics/{company_id}/rebuild")
+async def rebuild_company_analytics_endpoint(company_id: str):
+    """Recompute a company's materialized analytics from aitickets"""
+    try:
+        return analytics_response(company_id, await rebuild_company_analytics(company_id), "materialized")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rebuilding analytics: {str(e)}")
 
 
 @app.post("/agent-assist-chat")
-async def agent_assist_chat(request: AgentQuery):
-    return await answer_agent_query(request.query, request.agent_id)
+async def agent_assist_chat(request: AgentQuery, background_tasks: BackgroundTasks):
+    return await answer_agent_query(request.query, request.agent_id, background_tasks)
 
 @app.post("/agent-assist/clear-session")
-def clear_agent_session(request: SessionAction):
+async def clear_agent_session(request: SessionAction):
     """Clear conversation memory for a specific session"""
-    success = clear_conversation_memory(request.session_id)
+    success = await clear_conversation_memory(request.session_id)
     return {
         "message": f"Session {request.session_id} cleared successfully" if success else "Session not found",
         "success": success
     }
 
 @app.post("/agent-assist/get-conversation")
-def get_agent_conversation(request: SessionAction):
+async def get_agent_conversation(request: SessionAction):
     """Get conversation history for a specific session"""
-    return get_conversation_summary(request.session_id)
+    return await get_conversation_summary(request.session_id)
+
+@app.post("/agent-assist/search")
+async def search_agent_conversation_history(request: AgentConversationSearchRequest):
+    """Full-text search over an agent's conversation history with cursor pagination"""
+    from error_handler import validate_object_id
+
+    validate_object_id(request.agent_id, "agent")
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Search query must not be empty")
+    if not 1 <= request.limit <= 50:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 50")
+
+    try:
+        result = await search_agent_conversations(request.agent_id, request.query, request.limit, request.cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=f"Error searching agent conversations: {result['error']}")
+    return result
+
+@app.get("/agent-assist/context-cache/stats")
+async def get_agent_context_cache_stats():
+    """Get hit rate and size of the per-agent context cache"""
+    return agent_context_cache.get_stats()
 
 @app.post("/customer-chatbot/respond")
 async def customer_chatbot_respond_endpoint(request: AgentQuery):
@@ -557,6 +705,11 @@ def get_customer_chat_conversation(request: SessionAction):
     """Get customer chat conversation history for a specific session"""
     return customer_get_conversation_summary(request.session_id)
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-endpoint, per-stage latency histograms and trace export counters in Prometheus text format"""
+    return PlainTextResponse(latency_histograms.render_prometheus() + span_exporter.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 def root():
     return {"message": "AI Customer Support System with MongoDB and Performance Monitoring is running"}                                                 
@@ -580,11 +733,12 @@ async def customer_chat_respond(request: CustomerChatRequest):
     try:
         print(f"Processing customer chat request: {request.query[:50]}...")
         
-        raw_response = customer_chatbot_respond(
+        raw_response = await customer_chatbot_respond(
             query=request.query,
             session_id=request.session_id,
             company_id=request.company_id,
-            company_name=request.company_name
+            company_name=request.company_name,
+            deadline_seconds=request.deadline_ms / 1000 if request.deadline_ms else None
         )
         
         answer = raw_response.get("answer", "")
@@ -594,6 +748,7 @@ async def customer_chat_respond(request: CustomerChatRequest):
                                                    
         should_create_ticket = raw_response.get("should_create_ticket", False)
         ticket_id = raw_response.get("ticket_id")
+        ticket_trigger = raw_response.get("ticket_trigger")
         
                                                                                                  
         if not ticket_id:
@@ -605,14 +760,92 @@ async def customer_chat_respond(request: CustomerChatRequest):
         return CustomerChatResponse(
             answer=answer,
             sources=sources,
+            source_scores=raw_response.get("source_scores"),
             session_id=session_id,
             should_create_ticket=should_create_ticket,
-            ticket_id=ticket_id
+            ticket_id=ticket_id,
+            ticket_trigger=ticket_trigger,
+            timings=raw_response.get("timings"),
+            deadline_exceeded=raw_response.get("deadline_exceeded", False),
+            intent=raw_response.get("intent")
         )
     except Exception as e:
         print(f"Error processing customer chat: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing customer chat: {str(e)}")
 
+@app.get("/customer-chat/ticket-triggers/{company_id}")
+async def get_ticket_triggers(company_id: str):
+    """Get the effective ticket trigger set for a company"""
+    return {"company_id": company_id, **get_trigger_matcher(company_id).describe()}
+
+@app.put("/customer-chat/ticket-triggers/{company_id}")
+async def update_ticket_triggers(company_id: str, request: TicketTriggerSet):
+    """Save a company's ticket trigger set and recompile its matcher"""
+    from error_handler import validate_object_id, handle_db_error
+
+    company_oid = validate_object_id(company_id, "company")
+    if request.mode not in ("extend", "replace"):
+        raise HTTPException(status_code=400, detail="mode must be 'extend' or 'replace'")
+
+    trigger_set = request.dict()
+    try:
+        database = get_db()
+        await database.tickettriggers.update_one(
+            {"companyId": company_oid},
+            {"$set": {"triggers": trigger_set, "updatedAt": datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        handle_db_error(e, f"saving ticket triggers for company {company_id}")
+
+    matcher = set_company_triggers(company_id, trigger_set)
+    return {"company_id": company_id, **matcher.describe()}
+
+@app.post("/customer-chat/ticket-triggers/reload")
+async def reload_ticket_triggers():
+    """Hot reload all ticket trigger sets from MongoDB"""
+    version = await load_ticket_trigger_sets()
+    return {"message": "Ticket triggers reloaded", "version": version}
+
+@app.get("/customer-chat/intent-config/{company_id}")
+async def get_company_intent_config(company_id: str):
+    """Get the effective intent routing config for a company"""
+    config = get_intent_config(company_id)
+    return {"company_id": company_id, **{key.lower(): value for key, value in config.items()}}
+
+@app.put("/customer-chat/intent-config/{company_id}")
+async def update_company_intent_config(company_id: str, request: IntentRoutingConfig):
+    """Save a company's intent routing overrides"""
+    from error_handler import validate_object_id, handle_db_error
+
+    company_oid = validate_object_id(company_id, "company")
+    if request.mode and request.mode not in ("template", "llm"):
+        raise HTTPException(status_code=400, detail="mode must be 'template' or 'llm'")
+
+    overrides = request.dict(exclude_none=True)
+    try:
+        database = get_db()
+        await database.intentconfigs.update_one(
+            {"companyId": company_oid},
+            {"$set": {"config": overrides, "updatedAt": datetime.utcnow()}},
+            upsert=True
+        )
+    except Exception as e:
+        handle_db_error(e, f"saving intent config for company {company_id}")
+
+    config = set_company_intent_config(company_id, overrides)
+    return {"company_id": company_id, **{key.lower(): value for key, value in config.items()}}
+
+@app.get("/customer-chat/intent-metrics")
+async def get_customer_intent_metrics(company_id: Optional[str] = None):
+    """Get how much customer chat traffic the intent router short-circuits"""
+    return get_intent_metrics(company_id)
+
+@app.get("/conversation-compaction/metrics")
+async def get_conversation_compaction_metrics():
+    """Get prompt token savings from rolling conversation summaries"""
+    return get_compaction_metrics()
+
 @app.post("/customer-chat/clear-memory")
 async def clear_customer_chat_memory(request: SessionAction):
     """Clear the conversation memory for a customer chat session"""
@@ -625,31 +858,52 @@ async def get_customer_chat_summary(request: SessionAction):
     summary = customer_get_conversation_summary(request.session_id)
     return summary
 
+DB_STATS_COLLECTIONS = {
+    "tickets": "tickets",
+    "ai_tickets": "aitickets",
+    "chats": "chats",
+    "agents": "agents",
+    "customers": "customers",
+    "companies": "companies",
+    "knowledge_bases": "knowledgebases",
+    "util_tickets": "utiltickets",
+    "a_chats": "a_chats"
+}
+
+_db_stats_cache: Dict[str, tuple] = {}
+
+async def count_collection(collection, exact: bool) -> tuple:
+    """Count a collection's documents, returning the count and the time taken in ms"""
+    start = time.perf_counter()
+    count = await collection.count_documents({}) if exact else await collection.estimated_document_count()
+    return count, round((time.perf_counter() - start) * 1000, 1)
+
 @app.get("/db-stats")
-async def get_database_stats():
-    """Get database statistics"""    
+async def get_database_stats(exact: bool = False):
+    """Get database statistics, from collection metadata unless exact counts are requested"""    
+    mode = "exact" if exact else "estimated"
+    cached = _db_stats_cache.get(mode)
+    if cached and cached[0] > time.monotonic():
+        return {**cached[1], "cached": True}
     try:
         database = get_db()
-        stats = {
-            "tickets": await database.tickets.count_documents({}),
-            "ai_tickets": await database.aitickets.count_documents({}),
-            "chats": await database.chats.count_documents({}),            "agents": await database.agents.count_documents({}),
-            "customers": await database.customers.count_documents({}),
-            "companies": await database.companies.count_documents({}),
-            "knowledge_bases": await database.knowledgebases.count_documents({}),
-            "util_tickets": await database.utiltickets.count_documents({}),
-            "a_chats": await database.a_chats.count_documents({})
-        }
-        return stats
+        start = time.perf_counter()
+        counts = await asyncio.gather(*(count_collection(database[name], exact) for name in DB_STATS_COLLECTIONS.values()))
+        stats = {key: count for key, (count, _) in zip(DB_STATS_COLLECTIONS, counts)}
+        stats["timings_ms"] = {key: took_ms for key, (_, took_ms) in zip(DB_STATS_COLLECTIONS, counts)}
+        stats["took_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        stats["mode"] = mode
+        _db_stats_cache[mode] = (time.monotonic() + AI_CONFIG["DB_STATS"]["CACHE_TTL_SECONDS"], stats)
+        return {**stats, "cached": False}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching database stats: {str(e)}")
 
                     
 @app.post("/agent-ai/respond")
-async def agent_ai_respond(request: AgentQuery):
+async def agent_ai_respond(request: AgentQuery, background_tasks: BackgroundTasks):
     """Generate AI response to general agent queries"""
     try:
-        result = await answer_agent_query(request.query, request.agent_id)
+        result = await answer_agent_query(request.query, request.agent_id, background_tasks)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
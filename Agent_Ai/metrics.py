@@ -0,0 +1,160 @@
+"""
+In-process latency histograms exposed in Prometheus text format
+
+Stages are timed with the `timed` decorator or the `stage` context manager and
+recorded into a histogram labelled by endpoint and stage. The endpoint label
+is the matched route template (e.g. /performance/agent-performance/{agent_id}),
+set per request by the `bind_endpoint` dependency and carried by a context
+variable, so it follows work into asyncio.to_thread and background tasks.
+Work outside a request is labelled "background". `RequestLatencyMiddleware`
+records each whole request as the "request" stage. Each stage is also traced
+as a child span of the current request's span (see tracing.py).
+
+Recording a sample is two perf_counter calls, a bisect over the bucket bounds
+and a few integer increments under a lock.
+"""
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Tuple
+
+from fastapi import Request
+
+from tracing import start_span
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="background")
+
+class LatencyHistograms:
+    """Fixed-bucket latency histograms and error counters keyed by (endpoint, stage)"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, str], List] = {}
+        self._errors: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, stage: str, seconds: float, error: bool = False) -> None:
+        """Record one stage duration"""
+        index = bisect_left(self.buckets, seconds)
+        key = (endpoint, stage)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+            if error:
+                self._errors[key] = self._errors.get(key, 0) + 1
+
+    def snapshot(self) -> Tuple[Dict[Tuple[str, str], List], Dict[Tuple[str, str], int]]:
+        with self._lock:
+            return {key: [list(series[0]), series[1], series[2]] for key, series in self._series.items()}, dict(self._errors)
+
+    def render_prometheus(self) -> str:
+        """Render histograms and error counters in the Prometheus text exposition format"""
+        series, errors = self.snapshot()
+        lines = [
+            "# HELP stage_latency_seconds Latency of request pipeline stages",
+            "# TYPE stage_latency_seconds histogram",
+        ]
+        for (endpoint, stage), (counts, total, count) in sorted(series.items()):
+            labels = f'endpoint="{_escape(endpoint)}",stage="{_escape(stage)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'stage_latency_seconds_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'stage_latency_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"stage_latency_seconds_sum{{{labels}}} {total:.6f}")
+            lines.append(f"stage_latency_seconds_count{{{labels}}} {count}")
+        lines.append("# HELP stage_errors_total Stages that raised an exception")
+        lines.append("# TYPE stage_errors_total counter")
+        for (endpoint, stage), count in sorted(errors.items()):
+            lines.append(f'stage_errors_total{{endpoint="{_escape(endpoint)}",stage="{_escape(stage)}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+latency_histograms = LatencyHistograms()
+
+def observe_stage(stage_name: str, seconds: float, error: bool = False) -> None:
+    """Record a stage duration measured by the caller under the current endpoint"""
+    latency_histograms.observe(current_endpoint.get(), stage_name, seconds, error)
+
+@contextmanager
+def stage(stage_name: str):
+    """Time the enclosed block as a stage of the current endpoint, within a child span of the current trace"""
+    start = time.perf_counter()
+    error = False
+    try:
+        with start_span(stage_name):
+            yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe_stage(stage_name, time.perf_counter() - start, error)
+
+def timed(stage_name: str):
+    """Decorator timing every call of a sync or async function as a stage"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(stage_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _route_template(scope: Dict) -> str:
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+async def bind_endpoint(request: Request) -> None:
+    """App-level dependency labelling the request's stages with its route template"""
+    current_endpoint.set(_route_template(request.scope))
+
+class RequestLatencyMiddleware:
+    """ASGI middleware recording each HTTP request's latency, counting 5xx responses as errors
+
+    The timer stops when the last body chunk is sent, so BackgroundTasks that
+    run after the response are not counted.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {"code": 500, "recorded": False}
+
+        def record():
+            if not status["recorded"]:
+                status["recorded"] = True
+                latency_histograms.observe(_route_template(scope), "request", time.perf_counter() - start, status["code"] >= 500)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            record()
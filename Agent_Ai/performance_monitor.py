@@ -2,19 +2,32 @@
 Performance monitoring module for agent performance analysis
 Optimized with shared modules for configuration, database access, and AI utilities
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Tuple, AsyncIterator
 from datetime import datetime, timedelta
 import statistics
 import json
+import hashlib
+import asyncio
 from collections import defaultdict
 from bson import ObjectId
+from pymongo import ASCENDING
 
                        
 from config import AI_CONFIG
 from database import get_db
-from ai_utils import generate_llm_response
+from ai_utils import generate_llm_response, ainvoke_llm, estimate_tokens
+from llm_executor import llm_executor
+from quantile_sketch import LOG_GAMMA, sketch_quantiles
+from solution_sampling import required_sample_size, time_bucket, allocate_sample, draw_stratified_sample, stratified_estimate, StratumReservoir
+from performance_rollups import (
+    SOLUTION_SCORE_KEYS, calculate_handling_time, issue_key, merge_stats,
+    initialize_performance_rollups, ensure_rollup_indexes, load_rollup_stats,
+    apply_ticket_event, rebuild_company_rollups, get_rollup_state
+)
+from coaching_cache import initialize_coaching_cache, ensure_coaching_cache_indexes, load_cached_plans, store_plans, get_coaching_cache_stats
 from error_handler import safe_object_id, handle_db_error
 
                                           
@@ -23,10 +36,25 @@ performance_router = APIRouter(prefix="/performance", tags=["Agent Performance"]
                     
 database = None
 
+GRADING_PROJECTION = {"title": 1, "content": 1, "solution": 1, "agentId": 1, "companyId": 1, "createdAt": 1}
+
+_grade_backfill_queue: set = set()
+_grade_backfill_tasks: set = set()
+_range_backfill_tasks: Dict[tuple, asyncio.Task] = {}
+
 def initialize_performance_mongodb(db):
     """Initialize MongoDB connection for performance monitoring"""
     global database
     database = db
+    initialize_performance_rollups(db)
+    initialize_coaching_cache(db)
+
+async def ensure_performance_indexes():
+    """Create indexes for persisted performance data"""
+    await ensure_rollup_indexes()
+    await ensure_coaching_cache_indexes()
+    await database.solutiongrades.create_index([("ticketId", ASCENDING)], name="solution_grade_ticket", unique=True)
+    await database.solutiongrades.create_index([("agentId", ASCENDING), ("ticketCreatedAt", ASCENDING)], name="solution_grade_agent")
 
                  
 class PerformanceRequest(BaseModel):
@@ -34,6 +62,7 @@ class PerformanceRequest(BaseModel):
     company_id: str
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
+    deadline_ms: Optional[int] = None
 
 class QualityAssessmentRequest(BaseModel):
     ticket_id: str
@@ -42,29 +71,43 @@ class AgentComparisonRequest(BaseModel):
     company_id: str
     agent_ids: List[str]
 
+class RollupRebuildRequest(BaseModel):
+    company_id: str
+
                           
-async def get_agent_tickets(agent_id: str, company_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
-    """Get all tickets handled by a specific agent"""
-    try:
-        query = {
-            "agentId": ObjectId(agent_id),
-            "companyId": ObjectId(company_id),
-            "status": "closed"                               
-        }
-        
-        if start_date or end_date:
-            date_filter = {}
-            if start_date:
-                date_filter["$gte"] = start_date
-            if end_date:
-                date_filter["$lte"] = end_date
-            query["createdAt"] = date_filter
-        
-        tickets = await database.tickets.find(query).to_list(length=None)
-        return tickets
-    except Exception as e:
-        print(f"Error fetching agent tickets: {e}")
-        return []
+def closed_ticket_query(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict:
+    """Build the filter for a company's (or one agent's) closed tickets in a date range"""
+    query = {
+        "companyId": ObjectId(company_id),
+        "status": "closed"
+    }
+    if agent_id:
+        query["agentId"] = ObjectId(agent_id)
+    
+    if start_date or end_date:
+        date_filter = {}
+        if start_date:
+            date_filter["$gte"] = start_date
+        if end_date:
+            date_filter["$lte"] = end_date
+        query["createdAt"] = date_filter
+    return query
+
+async def iter_closed_ticket_batches(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, projection: Optional[Dict] = None, batch_size: Optional[int] = None) -> AsyncIterator[List[Dict]]:
+    """Stream closed tickets from a server-side cursor in fixed-size batches"""
+    batch_size = batch_size or AI_CONFIG["PERFORMANCE_SCAN"]["CURSOR_BATCH_SIZE"]
+    cursor = database.tickets.find(
+        closed_ticket_query(company_id, agent_id, start_date, end_date),
+        projection or GRADING_PROJECTION
+    ).batch_size(batch_size)
+    batch = []
+    async for ticket in cursor:
+        batch.append(ticket)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 async def get_util_tickets_by_ticket_ids(ticket_ids: List[str]):
     """Get util ticket data for performance metrics"""
@@ -110,58 +153,35 @@ async def get_company_agents(company_id: str):
         handle_db_error(e, f"fetching company agents for {company_id}")
         return []
 
-async def get_company_tickets(company_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None):
-    """Get all tickets for a company"""
-    try:
-        query = {
-            "companyId": ObjectId(company_id),
-            "status": "closed"
-        }
-        
-        if start_date or end_date:
-            date_filter = {}
-            if start_date:
-                date_filter["$gte"] = start_date
-            if end_date:
-                date_filter["$lte"] = end_date
-            query["createdAt"] = date_filter
-        
-        tickets = await database.tickets.find(query).to_list(length=None)
-        return tickets
-    except Exception as e:
-        print(f"Error fetching company tickets: {e}")
-        return []
+def _parse_json_response(result: str) -> Any:
+    """Parse JSON from an LLM response, tolerating a surrounding markdown code fence"""
+    text = result.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return json.loads(text)
 
-def calculate_handling_time(ticket_data: Dict, util_data: Dict) -> float:
-    """Calculate handling time in minutes"""
-    if not util_data or not util_data.get('seen_time') or not util_data.get('resolved_time'):
-        return 0.0
-    
-    handling_time = (util_data['resolved_time'] - util_data['seen_time']).total_seconds() / 60
-    return max(handling_time, 0.0)
+NO_SOLUTION_ANALYSIS = {
+    "completeness": 1,
+    "clarity": 1,
+    "empathy": 1,
+    "proactiveness": 1,
+    "technical_accuracy": 1,
+    "customer_focus": 1,
+    "strengths": ["No solution provided"],
+    "improvements": ["Provide detailed solution", "Address customer needs", "Show empathy"],
+    "grade": "F",
+    "feedback": "No solution was provided for the customer issue."
+}
 
-def analyze_solution_quality(ticket: Dict) -> Dict:
-    """Analyze the quality of agent's solution using Gemini"""
-    
+SOLUTION_GRADING_SYSTEM_PROMPT = "You are a customer service quality analyst evaluating agent solutions."
+
+def _solution_grading_prompt(ticket: Dict) -> str:
     customer_issue = ticket.get('content', '')
     agent_solution = ticket.get('solution', '')
     issue_title = ticket.get('title', '')
     
-    if not agent_solution:
-        return {
-            "completeness": 1,
-            "clarity": 1,
-            "empathy": 1,
-            "proactiveness": 1,
-            "technical_accuracy": 1,
-            "customer_focus": 1,
-            "strengths": ["No solution provided"],
-            "improvements": ["Provide detailed solution", "Address customer needs", "Show empathy"],
-            "grade": "F",
-            "feedback": "No solution was provided for the customer issue."
-        }
-    
-    prompt = f"""Analyze this customer service ticket solution for quality:
+    return f"""Analyze this customer service ticket solution for quality:
 
 Customer Issue: {issue_title}
 Customer Description: {customer_issue}
@@ -191,40 +211,652 @@ Respond with a valid JSON object with exactly this structure:
 }}
 
 Scores should be 1-10. Grade should be A, B, C, D, or F. Return only valid JSON, no additional text."""
+
+def _validate_solution_grade(analysis: Any) -> Dict:
+    """Check a parsed grade has every rubric field, raising ValueError otherwise"""
+    if not isinstance(analysis, dict):
+        raise ValueError("Grade is not a JSON object")
+    required_keys = ["completeness", "clarity", "empathy", "proactiveness", "technical_accuracy", "customer_focus", "strengths", "improvements", "grade", "feedback"]
+    for key in required_keys:
+        if key not in analysis:
+            raise ValueError(f"Missing key: {key}")
+    for key in SOLUTION_SCORE_KEYS:
+        if not isinstance(analysis[key], (int, float)) or not 1 <= analysis[key] <= 10:
+            raise ValueError(f"Score out of range: {key}")
+    return analysis
+
+                                 
+                              
+                                 
+BATCH_GRADING_RUBRIC = """Evaluate each agent's solution quality based on:
+
+1. Completeness - Does it fully address the customer's issue?
+2. Clarity - Is the solution clear and easy to understand?
+3. Empathy - Does it show understanding and care for customer's situation?
+4. Proactiveness - Does it go beyond minimum requirements?
+5. Technical Accuracy - Is the solution technically sound and feasible?
+6. Customer Focus - Is it focused on customer satisfaction?
+
+Respond with a valid JSON array holding one object per ticket, in ticket order, with exactly this structure:
+[
+    {
+        "ticket": 1,
+        "completeness": 8,
+        "clarity": 7,
+        "empathy": 9,
+        "proactiveness": 8,
+        "technical_accuracy": 7,
+        "customer_focus": 9,
+        "strengths": ["strength1", "strength2", "strength3"],
+        "improvements": ["improvement1", "improvement2"],
+        "grade": "B",
+        "feedback": "Detailed feedback about the solution quality"
+    }
+]
+
+Scores should be 1-10. Grade should be A, B, C, D, or F. Grade every ticket independently. Return only valid JSON, no additional text."""
+
+def _batch_ticket_section(number: int, ticket: Dict) -> str:
+    return f"""Ticket {number}:
+Customer Issue: {ticket.get('title', '')}
+Customer Description: {ticket.get('content', '')}
+Agent Solution: {ticket.get('solution', '')}
+"""
+
+def _batch_grading_prompt(tickets: List[Dict]) -> str:
+    sections = "\n".join(_batch_ticket_section(number, ticket) for number, ticket in enumerate(tickets, 1))
+    return f"""Analyze these {len(tickets)} customer service ticket solutions for quality:
+
+{sections}
+{BATCH_GRADING_RUBRIC}"""
+
+def split_grading_batches(tickets: List[Dict], batch_size: Optional[int] = None, token_budget: Optional[int] = None) -> List[List[Dict]]:
+    """Pack tickets into grading batches that stay under the batch size and prompt token budget
+
+    A ticket too large to share a prompt is graded in a batch of its own.
+    """
+    batch_size = batch_size or AI_CONFIG["SOLUTION_GRADING"]["BATCH_SIZE"]
+    token_budget = token_budget or AI_CONFIG["SOLUTION_GRADING"]["BATCH_TOKEN_BUDGET"]
+    budget = token_budget - estimate_tokens(BATCH_GRADING_RUBRIC)
+    batches, batch, batch_tokens = [], [], 0
+    for ticket in tickets:
+        tokens = estimate_tokens(_batch_ticket_section(0, ticket))
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > budget):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(ticket)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def agrade_solutions_batch(tickets: List[Dict]) -> Dict[str, Optional[Dict]]:
+    """Grade several solutions with one prompt, returning None for each ticket without a valid grade
+
+    Tickets without a solution are graded locally. LLM client errors propagate
+    so the fan-out executor can retry rate limits.
+    """
+    grades: Dict[str, Optional[Dict]] = {}
+    to_grade = []
+    for ticket in tickets:
+        if ticket.get('solution'):
+            to_grade.append(ticket)
+        else:
+            grades[str(ticket['_id'])] = dict(NO_SOLUTION_ANALYSIS)
+    if not to_grade:
+        return grades
+    if len(to_grade) == 1:
+        grades[str(to_grade[0]['_id'])] = await agrade_solution(to_grade[0])
+        return grades
+
+    result = await ainvoke_llm(_batch_grading_prompt(to_grade), SOLUTION_GRADING_SYSTEM_PROMPT)
     try:
-                                                           
-        system_prompt = "You are a customer service quality analyst evaluating agent solutions."
-        result = generate_llm_response(prompt, system_prompt)
-        
-                             
-        analysis = json.loads(result)
-        
-                                
-        required_keys = ["completeness", "clarity", "empathy", "proactiveness", "technical_accuracy", "customer_focus", "strengths", "improvements", "grade", "feedback"]
-        for key in required_keys:
-            if key not in analysis:
-                raise ValueError(f"Missing key: {key}")
-        
-        return analysis
-        
+        items = _parse_json_response(result)
+        if not isinstance(items, list):
+            raise ValueError("Batch grade is not a JSON array")
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Error in batch solution analysis: {e}")
+        items = []
+
+    by_number = {}
+    for item in items:
+        if isinstance(item, dict):
+            try:
+                by_number[int(item.get('ticket'))] = item
+            except (TypeError, ValueError):
+                continue
+    for number, ticket in enumerate(to_grade, 1):
+        try:
+            analysis = _validate_solution_grade(by_number.get(number))
+            analysis.pop('ticket', None)
+            grades[str(ticket['_id'])] = analysis
+        except ValueError as e:
+            print(f"Error in batch solution analysis for ticket {ticket['_id']}: {e}")
+            grades[str(ticket['_id'])] = None
+    return grades
+
+def grade_solution(ticket: Dict) -> Optional[Dict]:
+    """Grade the agent's solution with Gemini, returning None when no valid grade came back"""
+    if not ticket.get('solution'):
+        return dict(NO_SOLUTION_ANALYSIS)
+    try:
+        result = generate_llm_response(_solution_grading_prompt(ticket), SOLUTION_GRADING_SYSTEM_PROMPT)
+        return _validate_solution_grade(_parse_json_response(result))
     except (json.JSONDecodeError, ValueError, Exception) as e:
         print(f"Error in solution analysis: {e}")
-        return {
-            "completeness": 6,
-            "clarity": 6,
-            "empathy": 6,
-            "proactiveness": 6,
-            "technical_accuracy": 6,
-            "customer_focus": 6,
-            "strengths": ["Provided solution", "Addressed issue", "Professional tone"],
-            "improvements": ["More detailed explanation", "Show more empathy", "Proactive follow-up"],
-            "grade": "C",
-            "feedback": "Average solution quality with room for improvement in customer engagement and detail."
+        return None
+
+async def agrade_solution(ticket: Dict) -> Optional[Dict]:
+    """Grade the agent's solution without blocking, returning None for an unusable reply
+
+    LLM client errors propagate so the fan-out executor can retry rate limits.
+    """
+    if not ticket.get('solution'):
+        return dict(NO_SOLUTION_ANALYSIS)
+    result = await ainvoke_llm(_solution_grading_prompt(ticket), SOLUTION_GRADING_SYSTEM_PROMPT)
+    try:
+        return _validate_solution_grade(_parse_json_response(result))
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Error in solution analysis: {e}")
+        return None
+
+def _fallback_solution_analysis() -> Dict:
+    return {
+        "completeness": 6,
+        "clarity": 6,
+        "empathy": 6,
+        "proactiveness": 6,
+        "technical_accuracy": 6,
+        "customer_focus": 6,
+        "strengths": ["Provided solution", "Addressed issue", "Professional tone"],
+        "improvements": ["More detailed explanation", "Show more empathy", "Proactive follow-up"],
+        "grade": "C",
+        "feedback": "Average solution quality with room for improvement in customer engagement and detail."
+    }
+
+def analyze_solution_quality(ticket: Dict) -> Dict:
+    """Analyze the quality of agent's solution using Gemini"""
+    return grade_solution(ticket) or _fallback_solution_analysis()
+
+                                 
+                              
+                                 
+def solution_content_hash(ticket: Dict) -> str:
+    """Hash the parts of a ticket a solution grade depends on"""
+    content = "\x1f".join([ticket.get('title') or '', ticket.get('content') or '', ticket.get('solution') or ''])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+async def load_solution_grades(tickets: List[Dict]) -> Tuple[Dict[str, Dict], List[Dict]]:
+    """Load persisted grades for tickets, returning grades by ticket id and the tickets that need grading"""
+    grades: Dict[str, Dict] = {}
+    if not tickets:
+        return grades, []
+    try:
+        grade_docs = await database.solutiongrades.find(
+            {"ticketId": {"$in": [ticket['_id'] for ticket in tickets]}},
+            {"ticketId": 1, "contentHash": 1, "analysis": 1}
+        ).to_list(length=None)
+    except Exception as e:
+        print(f"Error loading solution grades: {e}")
+        grade_docs = []
+
+    stored = {str(doc['ticketId']): doc for doc in grade_docs}
+    ungraded = []
+    for ticket in tickets:
+        doc = stored.get(str(ticket['_id']))
+        if doc and doc.get('contentHash') == solution_content_hash(ticket):
+            grades[str(ticket['_id'])] = doc['analysis']
+        else:
+            ungraded.append(ticket)
+    return grades, ungraded
+
+async def save_solution_grade(ticket: Dict, analysis: Dict) -> None:
+    """Persist a ticket's grade keyed by ticket id and content hash"""
+    await database.solutiongrades.update_one(
+        {"ticketId": ticket['_id']},
+        {"$set": {
+            "contentHash": solution_content_hash(ticket),
+            "analysis": analysis,
+            "agentId": ticket.get('agentId'),
+            "companyId": ticket.get('companyId'),
+            "ticketCreatedAt": ticket.get('createdAt'),
+            "gradedAt": datetime.utcnow()
+        }},
+        upsert=True
+    )
+    await apply_ticket_event(ticket['_id'])
+
+async def grade_and_store_ticket(ticket: Dict) -> Optional[Dict]:
+    """Grade one ticket and persist the grade, returning None if grading failed"""
+    analysis = await agrade_solution(ticket)
+    if analysis is None:
+        return None
+    try:
+        await save_solution_grade(ticket, analysis)
+    except Exception as e:
+        print(f"Error saving solution grade for ticket {ticket['_id']}: {e}")
+    return analysis
+
+async def get_or_grade_solution(ticket: Dict) -> Dict:
+    """Get the persisted grade for a ticket, grading it now if it is new or was edited"""
+    grades, ungraded = await load_solution_grades([ticket])
+    if not ungraded:
+        return grades[str(ticket['_id'])]
+    try:
+        analysis = await llm_executor.call(str(ticket.get('companyId')), grade_and_store_ticket, ticket)
+    except Exception as e:
+        print(f"Error in solution analysis: {e}")
+        analysis = None
+    return analysis or _fallback_solution_analysis()
+
+async def grade_and_store_batch(tickets: List[Dict]) -> Dict[str, Optional[Dict]]:
+    """Grade a batch of tickets with one prompt and persist the valid grades"""
+    grades = await agrade_solutions_batch(tickets)
+    for ticket in tickets:
+        analysis = grades.get(str(ticket['_id']))
+        if analysis is not None:
+            try:
+                await save_solution_grade(ticket, analysis)
+            except Exception as e:
+                print(f"Error saving solution grade for ticket {ticket['_id']}: {e}")
+    return grades
+
+async def grade_tickets(company_id: str, tickets: List[Dict], deadline_seconds: Optional[float] = None, batch_size: Optional[int] = None) -> Dict:
+    """Grade and persist tickets concurrently in batches, reporting the ones not graded by the deadline
+
+    Tickets a batch reply left without a valid grade are retried one prompt
+    each in the time that remains.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_seconds if deadline_seconds is not None else None
+    batches = split_grading_batches(tickets, batch_size)
+    fanout = await llm_executor.map(company_id, dict(enumerate(batches)), grade_and_store_batch, deadline_seconds)
+    grades = {}
+    for batch_grades in fanout["results"].values():
+        grades.update({ticket_id: analysis for ticket_id, analysis in batch_grades.items() if analysis is not None})
+    attempted = list(fanout["results"]) + list(fanout["failed"]) + fanout["pending"]
+    llm_calls = sum(1 for index in attempted if any(ticket.get('solution') for ticket in batches[index]))
+
+    retry = [ticket for index in fanout["results"] for ticket in batches[index]
+             if len(batches[index]) > 1 and str(ticket['_id']) not in grades]
+    deadline_exceeded = fanout["deadline_exceeded"]
+    if retry and (deadline is None or deadline > loop.time()):
+        single = await llm_executor.map(
+            company_id,
+            {str(ticket['_id']): ticket for ticket in retry},
+            grade_and_store_ticket,
+            max(deadline - loop.time(), 0) if deadline is not None else None
+        )
+        grades.update({ticket_id: analysis for ticket_id, analysis in single["results"].items() if analysis is not None})
+        llm_calls += len(retry)
+        deadline_exceeded = deadline_exceeded or single["deadline_exceeded"]
+
+    ungraded = [ticket for ticket in tickets if str(ticket['_id']) not in grades]
+    return {"grades": grades, "ungraded": ungraded, "deadline_exceeded": deadline_exceeded, "llm_calls": llm_calls}
+
+async def _run_grade_backfill(tickets: List[Dict]) -> None:
+    try:
+        tickets_by_company = defaultdict(list)
+        for ticket in tickets:
+            tickets_by_company[str(ticket.get('companyId'))].append(ticket)
+        for company_id, company_tickets in tickets_by_company.items():
+            await grade_tickets(company_id, company_tickets)
+    finally:
+        for ticket in tickets:
+            _grade_backfill_queue.discard(str(ticket['_id']))
+
+def schedule_grade_backfill(tickets: List[Dict]) -> int:
+    """Grade new or edited tickets in the background, skipping ones already queued"""
+    queued = [ticket for ticket in tickets if str(ticket['_id']) not in _grade_backfill_queue]
+    if not queued:
+        return 0
+    _grade_backfill_queue.update(str(ticket['_id']) for ticket in queued)
+    task = asyncio.get_running_loop().create_task(_run_grade_backfill(queued))
+    _grade_backfill_tasks.add(task)
+    task.add_done_callback(_grade_backfill_tasks.discard)
+    return len(queued)
+
+def _deadline_at(deadline_ms: Optional[int] = None) -> float:
+    seconds = deadline_ms / 1000 if deadline_ms else AI_CONFIG["LLM_FANOUT"]["DEADLINE_SECONDS"]
+    return asyncio.get_running_loop().time() + seconds
+
+def _remaining(deadline: float) -> float:
+    return max(deadline - asyncio.get_running_loop().time(), 0)
+
+async def grade_within_deadline(company_id: str, ungraded: List[Dict], deadline: float) -> Dict:
+    """Grade ungraded tickets until the deadline and backfill the rest"""
+    grading = await grade_tickets(company_id, ungraded, _remaining(deadline)) if ungraded else {"grades": {}, "ungraded": [], "deadline_exceeded": False, "llm_calls": 0}
+    schedule_grade_backfill(grading["ungraded"])
+    return {
+        "graded_now": len(grading["grades"]),
+        "pending": len(grading["ungraded"]),
+        "llm_calls": grading["llm_calls"],
+        "deadline_exceeded": grading["deadline_exceeded"]
+    }
+
+async def generate_coaching_plans(company_id: str, performance_by_agent: Dict[str, Dict], deadline: float) -> Dict:
+    """Get coaching plans for several agents, reusing cached plans and generating the rest concurrently until the deadline"""
+    cached = await load_cached_plans(company_id, performance_by_agent)
+    stale = {agent_id: performance for agent_id, performance in performance_by_agent.items() if agent_id not in cached}
+    coaching = await llm_executor.map(company_id, stale, agenerate_coaching_recommendations, _remaining(deadline))
+    default_plan = default_coaching_recommendations()
+    await store_plans(company_id, {
+        agent_id: (stale[agent_id], plan) for agent_id, plan in coaching["results"].items() if plan != default_plan
+    })
+    coaching["results"].update(cached)
+    coaching["cached"] = list(cached)
+    return coaching
+
+                                 
+                              
+                                 
+def performance_stats_pipeline(match: Dict) -> List[Dict]:
+    """Aggregation joining closed tickets to their util rows and grades and returning per-agent stats
+
+    Produces the same stats shape as the rollups: ticket counts, count/sum/sum
+    of squares and sketch buckets for handling time (minutes, positive only)
+    and CSAT (rated only), solution-score totals and first-title-word issue
+    counts.
+    """
+    handling_time = {"$cond": [
+        {"$and": [{"$gt": ["$util.seen_time", None]}, {"$gt": ["$util.resolved_time", None]}]},
+        {"$divide": [{"$subtract": ["$util.resolved_time", "$util.seen_time"]}, 60000]},
+        0
+    ]}
+    is_handled = {"$gt": ["$handlingTime", 0]}
+    is_rated = {"$gt": ["$rating", 0]}
+
+    def sketch_buckets(field: str) -> List[Dict]:
+        return [
+            {"$match": {field: {"$gt": 0}}},
+            {"$group": {
+                "_id": {"agentId": "$agentId", "bucket": {"$ceil": {"$divide": [{"$ln": f"${field}"}, LOG_GAMMA]}}},
+                "count": {"$sum": 1}
+            }}
+        ]
+
+    return [
+        {"$match": match},
+        {"$project": {
+            "agentId": 1,
+            "issue": {"$arrayElemAt": [{"$split": [{"$trim": {"input": {"$ifNull": ["$title", ""]}}}, " "]}, 0]}
+        }},
+        {"$lookup": {"from": "utiltickets", "localField": "_id", "foreignField": "ticketId", "as": "util"}},
+        {"$lookup": {"from": "solutiongrades", "localField": "_id", "foreignField": "ticketId", "as": "grade"}},
+        {"$project": {
+            "agentId": 1,
+            "issue": 1,
+            "util": {"$arrayElemAt": ["$util", 0]},
+            "analysis": {"$arrayElemAt": ["$grade.analysis", 0]}
+        }},
+        {"$project": {
+            "agentId": 1,
+            "issue": 1,
+            "analysis": 1,
+            "handlingTime": handling_time,
+            "rating": {"$ifNull": ["$util.customer_review_rating", 0]}
+        }},
+        {"$facet": {
+            "agents": [{"$group": {
+                "_id": "$agentId",
+                "tickets": {"$sum": 1},
+                "handlingCount": {"$sum": {"$cond": [is_handled, 1, 0]}},
+                "handlingSum": {"$sum": {"$cond": [is_handled, "$handlingTime", 0]}},
+                "handlingSumSq": {"$sum": {"$cond": [is_handled, {"$multiply": ["$handlingTime", "$handlingTime"]}, 0]}},
+                "csatCount": {"$sum": {"$cond": [is_rated, 1, 0]}},
+                "csatSum": {"$sum": {"$cond": [is_rated, "$rating", 0]}},
+                "csatSumSq": {"$sum": {"$cond": [is_rated, {"$multiply": ["$rating", "$rating"]}, 0]}},
+                "scoreCount": {"$sum": {"$cond": [{"$gt": ["$analysis", None]}, 1, 0]}},
+                **{f"score_{key}": {"$sum": f"$analysis.{key}"} for key in SOLUTION_SCORE_KEYS}
+            }}],
+            "issues": [
+                {"$match": {"issue": {"$nin": [None, ""]}}},
+                {"$group": {"_id": {"agentId": "$agentId", "issue": "$issue"}, "count": {"$sum": 1}}}
+            ],
+            "handlingSketch": sketch_buckets("handlingTime"),
+            "csatSketch": sketch_buckets("rating")
+        }}
+    ]
+
+async def compute_agent_stats(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict[str, Dict]:
+    """Compute per-agent stats server-side from closed tickets, their util rows and grades"""
+    pipeline = performance_stats_pipeline(closed_ticket_query(company_id, agent_id, start_date, end_date))
+    try:
+        results = await database.tickets.aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+    except Exception as e:
+        print(f"Error aggregating performance stats: {e}")
+        return {}
+    if not results:
+        return {}
+
+    stats_by_agent: Dict[str, Dict] = {}
+    for row in results[0]["agents"]:
+        stats_by_agent[str(row["_id"])] = {
+            "tickets": row["tickets"],
+            "handlingTime": {"count": row["handlingCount"], "sum": row["handlingSum"], "sumSq": row["handlingSumSq"], "sketch": {}},
+            "csat": {"count": row["csatCount"], "sum": row["csatSum"], "sumSq": row["csatSumSq"], "sketch": {}},
+            "scores": {"count": row["scoreCount"], **{key: row[f"score_{key}"] for key in SOLUTION_SCORE_KEYS}},
+            "issues": {}
         }
+    for row in results[0]["issues"]:
+        agent_stats = stats_by_agent.get(str(row["_id"]["agentId"]))
+        issue = issue_key(row["_id"]["issue"])
+        if agent_stats is not None and issue:
+            agent_stats["issues"][issue] = agent_stats["issues"].get(issue, 0) + row["count"]
+    for facet, field in (("handlingSketch", "handlingTime"), ("csatSketch", "csat")):
+        for row in results[0][facet]:
+            agent_stats = stats_by_agent.get(str(row["_id"]["agentId"]))
+            if agent_stats is not None:
+                agent_stats[field]["sketch"][str(int(row["_id"]["bucket"]))] = row["count"]
+    return stats_by_agent
 
-def generate_coaching_recommendations(agent_performance: Dict) -> Dict:
-    """Generate personalized coaching recommendations based on solution quality"""
-    
+async def load_agent_stats(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict:
+    """Get per-agent stats from the company's rollups when they are ready, otherwise from its tickets"""
+    try:
+        stats = await load_rollup_stats(company_id, agent_id, start_date, end_date)
+    except Exception as e:
+        print(f"Error loading performance rollups: {e}")
+        stats = None
+    if stats is not None:
+        return {"stats": stats, "source": "rollups"}
+    return {"stats": await compute_agent_stats(company_id, agent_id, start_date, end_date), "source": "tickets"}
+
+async def find_ungraded_tickets(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, limit: Optional[int] = None) -> Dict:
+    """Stream closed tickets, keeping up to `limit` that have no grade for their current content and counting all of them"""
+    limit = AI_CONFIG["PERFORMANCE_SCAN"]["MAX_INLINE_GRADING"] if limit is None else limit
+    ungraded = []
+    total = 0
+    try:
+        async for batch in iter_closed_ticket_batches(company_id, agent_id, start_date, end_date):
+            _, batch_ungraded = await load_solution_grades(batch)
+            total += len(batch_ungraded)
+            ungraded.extend(batch_ungraded[:max(limit - len(ungraded), 0)])
+    except Exception as e:
+        print(f"Error scanning tickets for grading: {e}")
+    return {"tickets": ungraded, "total": total}
+
+async def _run_range_backfill(company_id: str, agent_id: Optional[str], start_date: Optional[datetime], end_date: Optional[datetime]) -> None:
+    try:
+        async for batch in iter_closed_ticket_batches(company_id, agent_id, start_date, end_date):
+            _, ungraded = await load_solution_grades(batch)
+            queued = [ticket for ticket in ungraded if str(ticket['_id']) not in _grade_backfill_queue]
+            if queued:
+                _grade_backfill_queue.update(str(ticket['_id']) for ticket in queued)
+                await _run_grade_backfill(queued)
+    except Exception as e:
+        print(f"Error backfilling solution grades for company {company_id}: {e}")
+
+def schedule_range_backfill(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> bool:
+    """Stream a date range's tickets in the background and grade the ungraded ones batch by batch"""
+    key = (company_id, agent_id, start_date, end_date)
+    task = _range_backfill_tasks.get(key)
+    if task is not None and not task.done():
+        return False
+    task = asyncio.get_running_loop().create_task(_run_range_backfill(company_id, agent_id, start_date, end_date))
+    _range_backfill_tasks[key] = task
+    task.add_done_callback(lambda _: _range_backfill_tasks.pop(key, None))
+    return True
+
+async def grade_missing_solutions(company_id: str, stats: Dict, deadline: float, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Dict:
+    """Grade the range's ungraded tickets within the deadline if the stats show any
+
+    At most MAX_INLINE_GRADING tickets are graded inline; the rest of the range
+    is left to a streaming background backfill.
+    """
+    if stats.get("scores", {}).get("count", 0) >= stats.get("tickets", 0):
+        return {"graded_now": 0, "pending": 0, "llm_calls": 0, "deadline_exceeded": False}
+    found = await find_ungraded_tickets(company_id, agent_id, start_date, end_date)
+    grading = await grade_within_deadline(company_id, found["tickets"], deadline)
+    overflow = found["total"] - len(found["tickets"])
+    if overflow > 0:
+        schedule_range_backfill(company_id, agent_id, start_date, end_date)
+        grading["pending"] += overflow
+    return grading
+
+async def load_sampling_bounds(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Optional[Dict]:
+    """Get the number of closed tickets in a range and their first and last creation time"""
+    pipeline = [
+        {"$match": closed_ticket_query(company_id, agent_id, start_date, end_date)},
+        {"$group": {"_id": None, "population": {"$sum": 1}, "first": {"$min": "$createdAt"}, "last": {"$max": "$createdAt"}}}
+    ]
+    try:
+        bounds = await database.tickets.aggregate(pipeline).to_list(length=1)
+    except Exception as e:
+        print(f"Error loading sampling bounds: {e}")
+        return None
+    return bounds[0] if bounds and bounds[0]["population"] else None
+
+async def load_sampling_frame(company_id: str, agent_id: Optional[str], start_date: Optional[datetime], end_date: Optional[datetime], bounds: Dict, time_buckets: int, capacity: int, seed: int) -> Dict[str, StratumReservoir]:
+    """Stream the range's closed tickets into per-stratum reservoirs of AI category and creation-time bucket"""
+    pipeline = [
+        {"$match": closed_ticket_query(company_id, agent_id, start_date, end_date)},
+        {"$project": {"createdAt": 1}},
+        {"$lookup": {"from": "aitickets", "localField": "_id", "foreignField": "ticketId", "as": "ai"}},
+        {"$project": {"createdAt": 1, "category": {"$ifNull": [{"$arrayElemAt": ["$ai.category", 0]}, "uncategorized"]}}}
+    ]
+    reservoirs: Dict[str, StratumReservoir] = {}
+    try:
+        async for ticket in database.tickets.aggregate(pipeline, batchSize=AI_CONFIG["PERFORMANCE_SCAN"]["CURSOR_BATCH_SIZE"]):
+            stratum = f"{ticket['category']}:{time_bucket(ticket['createdAt'], bounds['first'], bounds['last'], time_buckets)}"
+            if stratum not in reservoirs:
+                reservoirs[stratum] = StratumReservoir(capacity, seed)
+            reservoirs[stratum].add(ticket['_id'])
+    except Exception as e:
+        print(f"Error loading sampling frame: {e}")
+        return {}
+    return reservoirs
+
+def _overall_score(analysis: Dict) -> Optional[float]:
+    scores = [analysis[key] for key in SOLUTION_SCORE_KEYS if isinstance(analysis.get(key), (int, float))]
+    return sum(scores) / len(scores) if scores else None
+
+async def estimate_solution_quality(company_id: str, agent_id: Optional[str], deadline: float, confidence: Optional[float] = None, target_margin: Optional[float] = None, seed: int = 0, time_buckets: Optional[int] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Optional[Dict]:
+    """Estimate solution scores from a stratified random sample instead of grading every ticket
+
+    Tickets are stratified by AI category and equal-width creation-time bucket.
+    The sample is sized for the target interval half-width on the overall
+    (1-10) score, and sampled tickets without a current grade are graded
+    within the deadline.
+    """
+    config = AI_CONFIG["SOLUTION_SAMPLING"]
+    confidence = config["CONFIDENCE"] if confidence is None else confidence
+    target_margin = config["TARGET_MARGIN"] if target_margin is None else target_margin
+    time_buckets = config["TIME_BUCKETS"] if time_buckets is None else time_buckets
+
+    bounds = await load_sampling_bounds(company_id, agent_id, start_date, end_date)
+    if not bounds:
+        return None
+    planned = min(required_sample_size(bounds["population"], config["PRIOR_STDDEV"], target_margin, confidence), config["MAX_SAMPLE_SIZE"])
+    reservoirs = await load_sampling_frame(company_id, agent_id, start_date, end_date, bounds, time_buckets, max(planned, config["MIN_PER_STRATUM"]), seed)
+    if not reservoirs:
+        return None
+    strata_sizes = {stratum: reservoir.size for stratum, reservoir in reservoirs.items()}
+
+    allocation = allocate_sample(strata_sizes, planned, config["MIN_PER_STRATUM"])
+    sample = draw_stratified_sample(reservoirs, allocation)
+    stratum_of = {ticket_id: stratum for stratum, members in sample.items() for ticket_id in members}
+
+    tickets = await database.tickets.find({"_id": {"$in": list(stratum_of)}}, GRADING_PROJECTION).to_list(length=None)
+    grades, ungraded = await load_solution_grades(tickets)
+    grading = await grade_within_deadline(company_id, ungraded, deadline)
+    if grading["graded_now"]:
+        grades, _ = await load_solution_grades(tickets)
+
+    observations: Dict[str, Dict[str, List[float]]] = {key: defaultdict(list) for key in ["overall", *SOLUTION_SCORE_KEYS]}
+    for ticket in tickets:
+        analysis = grades.get(str(ticket['_id']))
+        overall = _overall_score(analysis) if analysis else None
+        if overall is None:
+            continue
+        stratum = stratum_of[ticket['_id']]
+        observations["overall"][stratum].append(overall)
+        for key in SOLUTION_SCORE_KEYS:
+            if isinstance(analysis.get(key), (int, float)):
+                observations[key][stratum].append(analysis[key])
+
+    estimates = {key: stratified_estimate(strata_sizes, values, confidence) for key, values in observations.items()}
+    overall = estimates.pop("overall")
+    return {
+        "estimate": overall,
+        "dimensions": {key: estimate for key, estimate in estimates.items() if estimate},
+        "population": sum(strata_sizes.values()),
+        "planned_sample_size": sum(allocation.values()),
+        "sample_size": overall["sample_size"] if overall else 0,
+        "strata": {stratum: {"population": size, "sampled": len(sample[stratum])} for stratum, size in strata_sizes.items()},
+        "target_met": bool(overall) and overall["margin"] <= target_margin,
+        "parameters": {"confidence": confidence, "target_margin": target_margin, "seed": seed, "time_buckets": time_buckets},
+        "grading": grading
+    }
+
+async def get_recent_feedback(company_id: str, agent_id: str, limit: int = 3) -> List[str]:
+    """Get grading feedback for the agent's most recent graded tickets, oldest first"""
+    try:
+        grade_docs = await database.solutiongrades.find(
+            {"companyId": ObjectId(company_id), "agentId": ObjectId(agent_id)},
+            {"analysis.feedback": 1}
+        ).sort("ticketCreatedAt", -1).limit(limit).to_list(length=limit)
+    except Exception as e:
+        print(f"Error fetching recent feedback: {e}")
+        return []
+    return [doc['analysis']['feedback'] for doc in reversed(grade_docs) if doc.get('analysis', {}).get('feedback')]
+
+def merge_agent_stats(stats_by_agent: Dict[str, Dict]) -> Dict:
+    """Merge per-agent stats into team-wide stats"""
+    team_stats: Dict = {}
+    for stats in stats_by_agent.values():
+        merge_stats(team_stats, stats)
+    return team_stats
+
+def _mean(accumulator: Optional[Dict]) -> float:
+    if not accumulator or not accumulator.get("count"):
+        return 0
+    return accumulator["sum"] / accumulator["count"]
+
+def _stddev(accumulator: Optional[Dict]) -> float:
+    if not accumulator or accumulator.get("count", 0) < 2:
+        return 0
+    count = accumulator["count"]
+    variance = (accumulator["sumSq"] - accumulator["sum"] ** 2 / count) / (count - 1)
+    return max(variance, 0) ** 0.5
+
+def summarize_stats(stats: Dict) -> Dict:
+    """Turn merged ticket stats into the averages the performance endpoints report"""
+    scores = stats.get("scores", {})
+    issues = stats.get("issues", {})
+    return {
+        "total_tickets": stats.get("tickets", 0),
+        "graded_tickets": scores.get("count", 0),
+        "avg_handling_time": _mean(stats.get("handlingTime")),
+        "handling_time_stddev": _stddev(stats.get("handlingTime")),
+        "handling_time_percentiles": sketch_quantiles(stats.get("handlingTime", {}).get("sketch", {})),
+        "avg_csat": _mean(stats.get("csat")),
+        "csat_stddev": _stddev(stats.get("csat")),
+        "csat_percentiles": sketch_quantiles(stats.get("csat", {}).get("sketch", {})),
+        "solution_scores": {key: scores.get(key, 0) / scores["count"] for key in SOLUTION_SCORE_KEYS} if scores.get("count") else {},
+        "common_issues": [issue for issue, count in sorted(issues.items(), key=lambda item: -item[1]) if count > 0][:5]
+    }
+
+def _coaching_prompt(agent_performance: Dict) -> str:
     performance_summary = f"""
 Agent Performance Summary:
 - Average Handling Time: {agent_performance.get('avg_handling_time', 0):.1f} minutes
@@ -234,7 +866,7 @@ Agent Performance Summary:
 - Common Issue Types: {agent_performance.get('common_issues', [])}
 """
     
-    prompt = f"""Based on this agent performance data focused on solution quality, provide personalized coaching recommendations:
+    return f"""Based on this agent performance data focused on solution quality, provide personalized coaching recommendations:
 
 {performance_summary}
 
@@ -250,55 +882,180 @@ Respond with a valid JSON object with exactly this structure:
 Focus on solution writing skills, customer empathy, technical knowledge, and response quality. 
 Make sure to provide exactly 3 items for each array and return only valid JSON, no additional text."""
 
+def _parse_coaching_recommendations(result: str) -> Dict:
+    """Parse and validate a coaching plan, raising ValueError if a section is missing"""
+    recommendations = _parse_json_response(result)
+    required_keys = ["strengths", "improvements", "training", "short_term_goals", "long_term_plan"]
+    for key in required_keys:
+        if not isinstance(recommendations, dict) or not isinstance(recommendations.get(key), list):
+            raise ValueError(f"Missing or invalid key: {key}")
+    return recommendations
+
+def generate_coaching_recommendations(agent_performance: Dict) -> Dict:
+    """Generate personalized coaching recommendations based on solution quality"""
     try:
-                                        
-        result = generate_llm_response(prompt)
-        
-                             
-        recommendations = json.loads(result)
-        
-                            
-        required_keys = ["strengths", "improvements", "training", "short_term_goals", "long_term_plan"]
-        for key in required_keys:
-            if key not in recommendations or not isinstance(recommendations[key], list):
-                raise ValueError(f"Missing or invalid key: {key}")
-        
-        return recommendations
-        
+        return _parse_coaching_recommendations(generate_llm_response(_coaching_prompt(agent_performance)))
     except (json.JSONDecodeError, ValueError, Exception) as e:
         print(f"Error generating coaching recommendations: {e}")
-        return {
-            "strengths": [
-                "Solution-focused approach", 
-                "Technical problem-solving skills", 
-                "Professional communication"
-            ],
-            "improvements": [
-                "Enhance empathy in responses", 
-                "Provide more detailed explanations", 
-                "Include proactive follow-up steps"
-            ],
-            "training": [
-                "Customer empathy workshop", 
-                "Technical writing skills", 
-                "Advanced problem-solving techniques"
-            ],
-            "short_term_goals": [
-                "Improve solution clarity scores", 
-                "Increase customer satisfaction to 4.5+", 
-                "Reduce response time by 15%"
-            ],
-            "long_term_plan": [
-                "Become subject matter expert", 
-                "Mentor new agents on solution quality", 
-                "Lead solution template development"
-            ]
-        }
+        return default_coaching_recommendations()
+
+async def agenerate_coaching_recommendations(agent_performance: Dict) -> Dict:
+    """Generate coaching recommendations without blocking, falling back to the default plan on a bad reply
+
+    LLM client errors propagate so the fan-out executor can retry rate limits.
+    """
+    result = await ainvoke_llm(_coaching_prompt(agent_performance))
+    try:
+        return _parse_coaching_recommendations(result)
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Error generating coaching recommendations: {e}")
+        return default_coaching_recommendations()
+
+def default_coaching_recommendations() -> Dict:
+    """Generic coaching plan used when the LLM gives no usable recommendations"""
+    return {
+        "strengths": [
+            "Solution-focused approach", 
+            "Technical problem-solving skills", 
+            "Professional communication"
+        ],
+        "improvements": [
+            "Enhance empathy in responses", 
+            "Provide more detailed explanations", 
+            "Include proactive follow-up steps"
+        ],
+        "training": [
+            "Customer empathy workshop", 
+            "Technical writing skills", 
+            "Advanced problem-solving techniques"
+        ],
+        "short_term_goals": [
+            "Improve solution clarity scores", 
+            "Increase customer satisfaction to 4.5+", 
+            "Reduce response time by 15%"
+        ],
+        "long_term_plan": [
+            "Become subject matter expert", 
+            "Mentor new agents on solution quality", 
+            "Lead solution template development"
+        ]
+    }
+
+def team_member_performance(agent_id: str, summary: Dict, agent_info: Dict) -> Dict:
+    """Build one agent's entry of the team performance report"""
+    return {
+        'name': agent_info.get('name', f"Agent {agent_id}"),
+        'email': agent_info.get('email', ''),
+        'total_tickets': summary['total_tickets'],
+        'avg_handling_time': summary['avg_handling_time'],
+        'handling_time_percentiles': summary['handling_time_percentiles'],
+        'avg_csat': summary['avg_csat'],
+        'csat_percentiles': summary['csat_percentiles'],
+        'solution_quality_scores': summary['solution_scores']
+    }
+
+def team_overview(team_stats: Dict[str, Dict], team_summary: Dict) -> Tuple[Dict, Dict]:
+    """Build the team overview and performance trends from the agents' report entries"""
+    all_handling_times = [agent_data['avg_handling_time'] for agent_data in team_stats.values() if agent_data['avg_handling_time'] > 0]
+    all_csat_scores = [agent_data['avg_csat'] for agent_data in team_stats.values() if agent_data['avg_csat'] > 0]
+    
+                                                                    
+    top_performer = None
+    if team_stats:
+        def performance_score(agent_data):
+            csat = agent_data['avg_csat']
+            solution_avg = statistics.mean(agent_data['solution_quality_scores'].values()) if agent_data['solution_quality_scores'] else 0
+            return (csat * 0.4) + (solution_avg * 0.6)
+        
+        top_performer = max(team_stats.keys(), key=lambda x: performance_score(team_stats[x]))
+    
+    overview = {
+        'total_agents': len(team_stats),
+        'total_tickets': sum(agent_data['total_tickets'] for agent_data in team_stats.values()),
+        'avg_team_handling_time': statistics.mean(all_handling_times) if all_handling_times else 0,
+        'team_handling_time_percentiles': team_summary['handling_time_percentiles'],
+        'avg_team_csat': statistics.mean(all_csat_scores) if all_csat_scores else 0,
+        'team_csat_percentiles': team_summary['csat_percentiles'],
+        'top_performer': top_performer
+    }
+    trends = {
+        'high_performers': [aid for aid, data in team_stats.items() if data['avg_csat'] >= 4.5],
+        'needs_attention': [aid for aid, data in team_stats.items() if data['avg_csat'] < 3.5]
+    }
+    return overview, trends
+
+def coaching_insight(agent_id: str, summary: Dict, agent_info: Dict) -> Tuple[Dict, Dict]:
+    """Build an agent's performance data for the coaching prompt and its coaching insight"""
+    performance_data = {
+        'avg_handling_time': summary['avg_handling_time'],
+        'avg_csat': summary['avg_csat'],
+        'total_tickets': summary['total_tickets'],
+        'solution_scores': summary['solution_scores'],
+        'common_issues': summary['common_issues']
+    }
+    
+                                                           
+    avg_solution_score = statistics.mean(summary['solution_scores'].values()) if summary['solution_scores'] else 0
+    priority = 'high' if (performance_data['avg_csat'] < 3.5 or avg_solution_score < 6) else 'medium' if (performance_data['avg_csat'] < 4 or avg_solution_score < 7) else 'low'
+    
+    insight = {
+        'agent_name': agent_info.get('name', f"Agent {agent_id}"),
+        'agent_email': agent_info.get('email', ''),
+        'performance_summary': performance_data,
+        'priority_level': priority,
+        'focus_areas': ['Solution Quality', 'Customer Empathy', 'Technical Accuracy'] if priority == 'high' else ['Advanced Skills', 'Leadership']
+    }
+    return performance_data, insight
+
+def attach_coaching_plan(agent_id: str, insight: Dict, coaching: Dict) -> None:
+    """Attach an agent's generated (or default) coaching plan and its status to the insight"""
+    insight['coaching_plan'] = coaching['results'].get(agent_id) or default_coaching_recommendations()
+    insight['coaching_status'] = 'ready' if agent_id in coaching['results'] else 'pending' if agent_id in coaching['pending'] else 'failed'
+
+                                 
+                              
+                                 
+def _ndjson(record: Dict) -> bytes:
+    return (json.dumps(record, default=str) + "\n").encode("utf-8")
+
+async def _as_completed(coroutines: List) -> AsyncIterator[Any]:
+    """Yield results in completion order, cancelling the rest if the consumer stops early"""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def _merge_grading(total: Dict, grading: Dict) -> None:
+    for key in ("graded_now", "pending", "llm_calls", "graded"):
+        total[key] = total.get(key, 0) + grading.get(key, 0)
+    total["deadline_exceeded"] = total.get("deadline_exceeded", False) or grading["deadline_exceeded"]
+
+async def grade_agent_stats(request: PerformanceRequest, agent_id: str, stats: Dict, deadline: float) -> Tuple[str, Dict, Dict]:
+    """Grade one agent's missing solutions within the deadline and reload its stats if anything was graded"""
+    grading = await grade_missing_solutions(request.company_id, stats, deadline, agent_id, request.start_date, request.end_date)
+    if grading["graded_now"]:
+        performance = await load_agent_stats(request.company_id, agent_id, request.start_date, request.end_date)
+        stats = performance["stats"].get(agent_id, stats)
+    grading["graded"] = stats.get("scores", {}).get("count", 0)
+    return agent_id, stats, grading
+
+async def _load_streamed_stats(request: PerformanceRequest, agent_id: Optional[str], not_found: str) -> Tuple[Dict, Dict[str, Dict]]:
+    if not database:
+        raise HTTPException(status_code=500, detail="Database not initialized")
+    performance = await load_agent_stats(request.company_id, agent_id, request.start_date, request.end_date)
+    if not performance["stats"]:
+        raise HTTPException(status_code=404, detail=not_found)
+    company_agents = await get_company_agents(request.company_id)
+    return performance, {str(agent['_id']): agent for agent in company_agents}
 
 @performance_router.get("/agent-performance/{agent_id}")
-async def get_agent_performance(agent_id: str, company_id: str):
+async def get_agent_performance(agent_id: str, company_id: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None, deadline_ms: Optional[int] = None, sampling: bool = False, confidence: Optional[float] = Query(None, gt=0, lt=1), target_margin: Optional[float] = Query(None, gt=0), seed: int = 0, time_buckets: Optional[int] = Query(None, ge=1)):
     """Get comprehensive performance metrics for a specific agent based on solution quality"""
     
+    deadline = _deadline_at(deadline_ms)
     if not database:
         raise HTTPException(status_code=500, detail="Database not initialized")
     try:
@@ -310,76 +1067,55 @@ async def get_agent_performance(agent_id: str, company_id: str):
         handle_db_error(e, f"retrieving agent info for {agent_id}")
     
                        
-    agent_tickets = await get_agent_tickets(agent_id, company_id)
+    performance = await load_agent_stats(company_id, agent_id, start_date, end_date)
+    agent_stats = performance["stats"].get(agent_id)
     
-    if not agent_tickets:
+    if not agent_stats:
         raise HTTPException(status_code=404, detail="No tickets found for this agent")
     
-                          
-    ticket_ids = [str(ticket['_id']) for ticket in agent_tickets]
-    util_tickets_dict = await get_util_tickets_by_ticket_ids(ticket_ids)
-    
-                       
-    handling_times = []
-    csat_scores = []
-    solution_analyses = []
-    
-    for ticket in agent_tickets:
-        ticket_id_str = str(ticket['_id'])
-        util_data = util_tickets_dict.get(ticket_id_str, {})
-        
-                                 
-        handling_time = calculate_handling_time(ticket, util_data)
-        if handling_time > 0:
-            handling_times.append(handling_time)
-        
-                        
-        if util_data.get('customer_review_rating'):
-            csat_scores.append(util_data['customer_review_rating'])
-        
-                                  
-        solution_analysis = analyze_solution_quality(ticket)
-        solution_analyses.append(solution_analysis)
-    
-                        
-    avg_handling_time = statistics.mean(handling_times) if handling_times else 0
-    avg_csat = statistics.mean(csat_scores) if csat_scores else 0
-    
-                                     
-    avg_solution_scores = {}
-    if solution_analyses:
-        avg_solution_scores = {
-            "completeness": statistics.mean([a["completeness"] for a in solution_analyses]),
-            "clarity": statistics.mean([a["clarity"] for a in solution_analyses]),  
-            "empathy": statistics.mean([a["empathy"] for a in solution_analyses]),
-            "proactiveness": statistics.mean([a["proactiveness"] for a in solution_analyses]),
-            "technical_accuracy": statistics.mean([a["technical_accuracy"] for a in solution_analyses]),
-            "customer_focus": statistics.mean([a["customer_focus"] for a in solution_analyses])
-        }
-    
-                                
-    common_issues = list(set([ticket['title'].split()[0] for ticket in agent_tickets]))[:5]
+                                                     
+    sample_estimate = None
+    if sampling:
+        sample_estimate = await estimate_solution_quality(company_id, agent_id, deadline, confidence, target_margin, seed, time_buckets, start_date, end_date)
+        grading = sample_estimate.pop("grading") if sample_estimate else {"graded_now": 0, "pending": 0, "llm_calls": 0, "deadline_exceeded": False}
+    else:
+        grading = await grade_missing_solutions(company_id, agent_stats, deadline, agent_id, start_date, end_date)
+        if grading["graded_now"]:
+            performance = await load_agent_stats(company_id, agent_id, start_date, end_date)
+            agent_stats = performance["stats"].get(agent_id, agent_stats)
+    summary = summarize_stats(agent_stats)
+    grading["graded"] = summary["graded_tickets"]
+    if sample_estimate:
+        summary["solution_scores"] = {key: estimate["mean"] for key, estimate in sample_estimate["dimensions"].items()}
     
                          
     performance_data = {
         "agent_id": agent_id,
         "agent_name": agent_info.get('name', f"Agent {agent_id}"),
         "agent_email": agent_info.get('email', ''),
-        "total_tickets": len(agent_tickets),
-        "avg_handling_time": avg_handling_time,
-        "avg_csat": avg_csat,
-        "solution_scores": avg_solution_scores,
-        "common_issues": common_issues,
-        "performance_trend": "improving" if avg_csat >= 4 else "needs_attention"
+        "total_tickets": summary["total_tickets"],
+        "avg_handling_time": summary["avg_handling_time"],
+        "handling_time_stddev": summary["handling_time_stddev"],
+        "handling_time_percentiles": summary["handling_time_percentiles"],
+        "avg_csat": summary["avg_csat"],
+        "csat_percentiles": summary["csat_percentiles"],
+        "solution_scores": summary["solution_scores"],
+        "common_issues": summary["common_issues"],
+        "performance_trend": "improving" if summary["avg_csat"] >= 4 else "needs_attention"
     }
     
                                        
-    coaching = generate_coaching_recommendations(performance_data)
+    coaching = await generate_coaching_plans(company_id, {agent_id: performance_data}, deadline)
     
     return {
         "agent_performance": performance_data,
-        "coaching_recommendations": coaching,
-        "recent_feedback": [analysis["feedback"] for analysis in solution_analyses[-3:]]
+        "coaching_recommendations": coaching["results"].get(agent_id) or default_coaching_recommendations(),
+        "recent_feedback": await get_recent_feedback(company_id, agent_id),
+        "grading": grading,
+        "coaching_cached": agent_id in coaching["cached"],
+        "sampling": sample_estimate,
+        "stats_source": performance["source"],
+        "partial": grading["deadline_exceeded"] or agent_id not in coaching["results"]
     }
 
 @performance_router.post("/quality-assessment")
@@ -402,7 +1138,7 @@ async def assess_ticket_quality(request: QualityAssessmentRequest):
     util_data = util_tickets_dict.get(request.ticket_id, {})
     
                               
-    quality_analysis = analyze_solution_quality(ticket)
+    quality_analysis = await get_or_grade_solution(ticket)
     
                        
     handling_time = calculate_handling_time(ticket, util_data)
@@ -425,188 +1161,108 @@ async def assess_ticket_quality(request: QualityAssessmentRequest):
 async def get_team_performance(request: PerformanceRequest):
     """Get team-wide performance analytics based on solution quality"""
     
+    deadline = _deadline_at(request.deadline_ms)
     if not database:
         raise HTTPException(status_code=500, detail="Database not initialized")
     
                              
-    company_tickets = await get_company_tickets(request.company_id, request.start_date, request.end_date)
+    performance = await load_agent_stats(request.company_id, None, request.start_date, request.end_date)
     
-    if not company_tickets:
+    if not performance["stats"]:
         raise HTTPException(status_code=404, detail="No tickets found for this company")
     
-                                      
-    ticket_ids = [str(ticket['_id']) for ticket in company_tickets]
-    util_tickets_dict = await get_util_tickets_by_ticket_ids(ticket_ids)
+                                                     
+    grading = await grade_missing_solutions(request.company_id, merge_agent_stats(performance["stats"]), deadline, None, request.start_date, request.end_date)
+    if grading["graded_now"]:
+        performance = await load_agent_stats(request.company_id, None, request.start_date, request.end_date)
+    team_summary = summarize_stats(merge_agent_stats(performance["stats"]))
+    grading["graded"] = team_summary["graded_tickets"]
     
                         
     company_agents = await get_company_agents(request.company_id)
     agents_dict = {str(agent['_id']): agent for agent in company_agents}
     
-                    
-    agent_metrics = defaultdict(list)
-    
-    for ticket in company_tickets:
-        agent_id = str(ticket['agentId'])
-        ticket_id_str = str(ticket['_id'])
-        util_data = util_tickets_dict.get(ticket_id_str, {})
-        
-                                  
-        solution_analysis = analyze_solution_quality(ticket)
-        
-        agent_metrics[agent_id].append({
-            'handling_time': calculate_handling_time(ticket, util_data),
-            'csat': util_data.get('customer_review_rating', 0),
-            'solution_quality': solution_analysis,
-            'ticket': ticket
-        })
-    
                             
-    team_stats = {}
-    for agent_id, metrics in agent_metrics.items():
-        handling_times = [m['handling_time'] for m in metrics if m['handling_time'] > 0]
-        csat_scores = [m['csat'] for m in metrics if m['csat'] > 0]
-        
-                                                   
-        avg_solution_quality = {}
-        if metrics:
-            solution_keys = ['completeness', 'clarity', 'empathy', 'proactiveness', 'technical_accuracy', 'customer_focus']
-            for key in solution_keys:
-                scores = [m['solution_quality'][key] for m in metrics if key in m['solution_quality']]
-                avg_solution_quality[key] = statistics.mean(scores) if scores else 0
-        
-        agent_info = agents_dict.get(agent_id, {})
-        agent_name = agent_info.get('name', f"Agent {agent_id}")
-        
-        team_stats[agent_id] = {
-            'name': agent_name,
-            'email': agent_info.get('email', ''),
-            'total_tickets': len(metrics),
-            'avg_handling_time': statistics.mean(handling_times) if handling_times else 0,
-            'avg_csat': statistics.mean(csat_scores) if csat_scores else 0,
-            'solution_quality_scores': avg_solution_quality
-        }
-    
-                          
-    all_handling_times = []
-    all_csat_scores = []
-    
-    for agent_data in team_stats.values():
-        if agent_data['avg_handling_time'] > 0:
-            all_handling_times.append(agent_data['avg_handling_time'])
-        if agent_data['avg_csat'] > 0:
-            all_csat_scores.append(agent_data['avg_csat'])
-    
-                                                                    
-    top_performer = None
-    if team_stats:
-        def performance_score(agent_data):
-            csat = agent_data['avg_csat']
-            solution_avg = statistics.mean(agent_data['solution_quality_scores'].values()) if agent_data['solution_quality_scores'] else 0
-            return (csat * 0.4) + (solution_avg * 0.6)
-        
-        top_performer = max(team_stats.keys(), key=lambda x: performance_score(team_stats[x]))
-    
-    team_overview = {
-        'total_agents': len(team_stats),
-        'total_tickets': len(company_tickets),
-        'avg_team_handling_time': statistics.mean(all_handling_times) if all_handling_times else 0,
-        'avg_team_csat': statistics.mean(all_csat_scores) if all_csat_scores else 0,
-        'top_performer': top_performer
+    team_stats = {
+        agent_id: team_member_performance(agent_id, summarize_stats(stats), agents_dict.get(agent_id, {}))
+        for agent_id, stats in performance["stats"].items()
     }
+    overview, trends = team_overview(team_stats, team_summary)
     
     return {
-        'team_overview': team_overview,
+        'team_overview': overview,
         'individual_performance': team_stats,
-        'performance_trends': {
-            'high_performers': [aid for aid, data in team_stats.items() if data['avg_csat'] >= 4.5],
-            'needs_attention': [aid for aid, data in team_stats.items() if data['avg_csat'] < 3.5]
-        }
+        'performance_trends': trends,
+        'grading': grading,
+        'stats_source': performance['source'],
+        'partial': grading['deadline_exceeded']
     }
 
+@performance_router.post("/team-performance/stream")
+async def stream_team_performance(request: PerformanceRequest):
+    """Stream team performance as NDJSON: one record per agent as it is graded, then the team overview"""
+    
+    deadline = _deadline_at(request.deadline_ms)
+    performance, agents_dict = await _load_streamed_stats(request, None, "No tickets found for this company")
+    
+    async def records():
+        team_stats = {}
+        team_merged: Dict = {}
+        grading: Dict = {}
+        agent_tasks = [grade_agent_stats(request, agent_id, stats, deadline) for agent_id, stats in performance["stats"].items()]
+        async for agent_id, stats, agent_grading in _as_completed(agent_tasks):
+            entry = team_member_performance(agent_id, summarize_stats(stats), agents_dict.get(agent_id, {}))
+            team_stats[agent_id] = {key: entry[key] for key in ('avg_handling_time', 'avg_csat', 'total_tickets', 'solution_quality_scores')}
+            merge_stats(team_merged, stats)
+            _merge_grading(grading, agent_grading)
+            yield _ndjson({'type': 'agent', 'agent_id': agent_id, 'performance': entry, 'grading': agent_grading})
+        
+        overview, trends = team_overview(team_stats, summarize_stats(team_merged))
+        yield _ndjson({
+            'type': 'team_overview',
+            'team_overview': overview,
+            'performance_trends': trends,
+            'grading': grading,
+            'stats_source': performance['source'],
+            'partial': grading.get('deadline_exceeded', False)
+        })
+    
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
 @performance_router.post("/coaching-insights")
 async def get_coaching_insights(request: PerformanceRequest):
     """Get AI-powered coaching insights for agents based on solution quality"""
     
+    deadline = _deadline_at(request.deadline_ms)
     if not database:
         raise HTTPException(status_code=500, detail="Database not initialized")
     
                           
-    company_tickets = await get_company_tickets(request.company_id, request.start_date, request.end_date)
+    performance = await load_agent_stats(request.company_id, request.agent_id, request.start_date, request.end_date)
     
-    if request.agent_id:
-        company_tickets = [t for t in company_tickets if str(t['agentId']) == request.agent_id]
-    
-    if not company_tickets:
+    if not performance["stats"]:
         raise HTTPException(status_code=404, detail="No tickets found")
     
-                   
-    ticket_ids = [str(ticket['_id']) for ticket in company_tickets]
-    util_tickets_dict = await get_util_tickets_by_ticket_ids(ticket_ids)
+                                                     
+    grading = await grade_missing_solutions(request.company_id, merge_agent_stats(performance["stats"]), deadline, request.agent_id, request.start_date, request.end_date)
+    if grading["graded_now"]:
+        performance = await load_agent_stats(request.company_id, request.agent_id, request.start_date, request.end_date)
     
                         
     company_agents = await get_company_agents(request.company_id)
     agents_dict = {str(agent['_id']): agent for agent in company_agents}
     
     coaching_insights = {}
+    performance_by_agent = {}
     
-                    
-    agent_groups = defaultdict(list)
-    for ticket in company_tickets:
-        agent_groups[str(ticket['agentId'])].append(ticket)
+    for agent_id, stats in performance["stats"].items():
+        performance_by_agent[agent_id], coaching_insights[agent_id] = coaching_insight(agent_id, summarize_stats(stats), agents_dict.get(agent_id, {}))
+    grading['graded'] = sum(summarize_stats(stats)['graded_tickets'] for stats in performance['stats'].values())
     
-    for agent_id, tickets in agent_groups.items():
-                                       
-        handling_times = []
-        csat_scores = []
-        solution_analyses = []
-        
-        for ticket in tickets:
-            ticket_id_str = str(ticket['_id'])
-            util_data = util_tickets_dict.get(ticket_id_str, {})
-            handling_time = calculate_handling_time(ticket, util_data)
-            if handling_time > 0:
-                handling_times.append(handling_time)
-            if util_data.get('customer_review_rating'):
-                csat_scores.append(util_data['customer_review_rating'])
-            
-                                      
-            solution_analysis = analyze_solution_quality(ticket)
-            solution_analyses.append(solution_analysis)
-        
-                                           
-        avg_solution_scores = {}
-        if solution_analyses:
-            solution_keys = ['completeness', 'clarity', 'empathy', 'proactiveness', 'technical_accuracy', 'customer_focus']
-            for key in solution_keys:
-                scores = [a[key] for a in solution_analyses if key in a]
-                avg_solution_scores[key] = statistics.mean(scores) if scores else 0
-        
-        performance_data = {
-            'avg_handling_time': statistics.mean(handling_times) if handling_times else 0,
-            'avg_csat': statistics.mean(csat_scores) if csat_scores else 0,
-            'total_tickets': len(tickets),
-            'solution_scores': avg_solution_scores,
-            'common_issues': list(set([ticket['title'].split()[0] for ticket in tickets]))[:5]
-        }
-        
-                                           
-        coaching = generate_coaching_recommendations(performance_data)
-        
-        agent_info = agents_dict.get(agent_id, {})
-        agent_name = agent_info.get('name', f"Agent {agent_id}")
-        
-                                                               
-        avg_solution_score = statistics.mean(avg_solution_scores.values()) if avg_solution_scores else 0
-        priority = 'high' if (performance_data['avg_csat'] < 3.5 or avg_solution_score < 6) else 'medium' if (performance_data['avg_csat'] < 4 or avg_solution_score < 7) else 'low'
-        
-        coaching_insights[agent_id] = {
-            'agent_name': agent_name,
-            'agent_email': agent_info.get('email', ''),
-            'performance_summary': performance_data,
-            'coaching_plan': coaching,
-            'priority_level': priority,
-            'focus_areas': ['Solution Quality', 'Customer Empathy', 'Technical Accuracy'] if priority == 'high' else ['Advanced Skills', 'Leadership']
-        }
+                                                          
+    coaching = await generate_coaching_plans(request.company_id, performance_by_agent, deadline)
+    for agent_id, insight in coaching_insights.items():
+        attach_coaching_plan(agent_id, insight, coaching)
     
     return {
         'coaching_insights': coaching_insights,
@@ -614,6 +1270,93 @@ async def get_coaching_insights(request: PerformanceRequest):
             'total_agents_analyzed': len(coaching_insights),
             'high_priority_coaching': len([c for c in coaching_insights.values() if c['priority_level'] == 'high']),
             'focus_on_solution_quality': True,
-            'performance_overview': 'Solution-based performance analysis complete'
+            'performance_overview': 'Solution-based performance analysis complete',
+            'grading': grading,
+            'stats_source': performance['source'],
+            'coaching_pending': coaching['pending'],
+            'coaching_failed': list(coaching['failed']),
+            'coaching_cached': coaching['cached'],
+            'partial': grading['deadline_exceeded'] or coaching['deadline_exceeded']
         }
-    }
\ No newline at end of file
+    }
+
+@performance_router.post("/coaching-insights/stream")
+async def stream_coaching_insights(request: PerformanceRequest):
+    """Stream coaching insights as NDJSON: one record per agent once its plan is generated, then the summary"""
+    
+    deadline = _deadline_at(request.deadline_ms)
+    performance, agents_dict = await _load_streamed_stats(request, request.agent_id, "No tickets found")
+    
+    async def agent_insight(agent_id: str, stats: Dict) -> Tuple[str, Dict, Dict, Dict]:
+        agent_id, stats, grading = await grade_agent_stats(request, agent_id, stats, deadline)
+        performance_data, insight = coaching_insight(agent_id, summarize_stats(stats), agents_dict.get(agent_id, {}))
+        coaching = await generate_coaching_plans(request.company_id, {agent_id: performance_data}, deadline)
+        attach_coaching_plan(agent_id, insight, coaching)
+        return agent_id, insight, grading, coaching
+    
+    async def records():
+        grading: Dict = {}
+        summary = {'total_agents_analyzed': 0, 'high_priority_coaching': 0, 'coaching_pending': [], 'coaching_failed': [], 'coaching_cached': []}
+        coaching_deadline_exceeded = False
+        agent_tasks = [agent_insight(agent_id, stats) for agent_id, stats in performance["stats"].items()]
+        async for agent_id, insight, agent_grading, coaching in _as_completed(agent_tasks):
+            _merge_grading(grading, agent_grading)
+            summary['total_agents_analyzed'] += 1
+            summary['high_priority_coaching'] += insight['priority_level'] == 'high'
+            summary['coaching_pending'].extend(coaching['pending'])
+            summary['coaching_failed'].extend(coaching['failed'])
+            summary['coaching_cached'].extend(coaching['cached'])
+            coaching_deadline_exceeded = coaching_deadline_exceeded or coaching['deadline_exceeded']
+            yield _ndjson({'type': 'agent', 'agent_id': agent_id, 'coaching_insight': insight, 'grading': agent_grading})
+        
+        yield _ndjson({
+            'type': 'summary',
+            'summary': {
+                **summary,
+                'focus_on_solution_quality': True,
+                'performance_overview': 'Solution-based performance analysis complete',
+                'grading': grading,
+                'stats_source': performance['source'],
+                'partial': grading.get('deadline_exceeded', False) or coaching_deadline_exceeded
+            }
+        })
+    
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+@performance_router.post("/rollups/rebuild")
+async def rebuild_performance_rollups(request: RollupRebuildRequest, background_tasks: BackgroundTasks):
+    """Reconcile a company's closed tickets into its performance rollups in the background"""
+    company_oid = safe_object_id(request.company_id)
+    if not company_oid:
+        raise HTTPException(status_code=400, detail="Invalid company ID")
+    background_tasks.add_task(rebuild_company_rollups, company_oid)
+    return {"company_id": request.company_id, "status": "building"}
+
+@performance_router.get("/rollups/status/{company_id}")
+async def get_performance_rollup_status(company_id: str):
+    """Get whether a company's performance rollups are ready to serve requests"""
+    state = await get_rollup_state(company_id)
+    if not state:
+        return {"company_id": company_id, "status": "missing"}
+    state.pop("_id", None)
+    return {"company_id": company_id, **state}
+
+@performance_router.post("/events/ticket/{ticket_id}")
+async def apply_performance_ticket_event(ticket_id: str):
+    """Apply a ticket change (closed, reviewed, regraded) to the performance rollups"""
+    ticket_oid = safe_object_id(ticket_id)
+    if not ticket_oid:
+        raise HTTPException(status_code=400, detail="Invalid ticket ID")
+    if not await apply_ticket_event(ticket_oid):
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    return {"ticket_id": ticket_id, "applied": True}
+
+@performance_router.get("/llm-executor/stats")
+async def get_llm_executor_stats():
+    """Get concurrency, retry and timeout counters for performance LLM calls"""
+    return llm_executor.get_stats()
+
+@performance_router.get("/coaching-cache/stats")
+async def get_coaching_plan_cache_stats():
+    """Get coaching plan cache hit rate and LLM calls saved"""
+    return get_coaching_cache_stats()
@@ -0,0 +1,270 @@
+"""
+Incrementally maintained daily performance rollups
+
+Each closed ticket contributes to two daily rows in `performancerollups`, one
+for its agent and one for its company (agentId null), bucketed by the day the
+ticket was created. A row holds counts, sums, sums of squares and quantile
+sketches for handling time and CSAT, solution-score totals and issue counts,
+so any date range is answered by merging rows.
+
+Updates are idempotent deltas: `performanceledger` keeps the contribution last
+applied for every ticket, and an event swaps in the new contribution and adds
+(new - old) to the rows. Replaying an event, or rebuilding a company while
+events arrive, never double counts. Events come from solution grades being
+saved, from a sweep over `utiltickets` changes (ticket closed, review
+submitted) and from the explicit event endpoint.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+
+from config import AI_CONFIG
+from quantile_sketch import sketch_of
+
+database = None
+
+SOLUTION_SCORE_KEYS = ['completeness', 'clarity', 'empathy', 'proactiveness', 'technical_accuracy', 'customer_focus']
+
+TICKET_PROJECTION = {"title": 1, "status": 1, "agentId": 1, "companyId": 1, "createdAt": 1}
+SWEEP_STATE_ID = "utilticket_sweep"
+
+def initialize_performance_rollups(db):
+    """Initialize MongoDB connection for performance rollups"""
+    global database
+    database = db
+
+async def ensure_rollup_indexes():
+    """Create indexes for rollup rows, the ledger and the utilticket sweep"""
+    await database.performancerollups.create_index(
+        [("companyId", ASCENDING), ("agentId", ASCENDING), ("day", ASCENDING)], name="rollup_row", unique=True
+    )
+    await database.performanceledger.create_index([("companyId", ASCENDING)], name="ledger_company")
+    await database.utiltickets.create_index([("updatedAt", ASCENDING), ("_id", ASCENDING)], name="rollup_sweep")
+
+def calculate_handling_time(ticket_data: Dict, util_data: Dict) -> float:
+    """Calculate handling time in minutes"""
+    if not util_data or not util_data.get('seen_time') or not util_data.get('resolved_time'):
+        return 0.0
+
+    handling_time = (util_data['resolved_time'] - util_data['seen_time']).total_seconds() / 60
+    return max(handling_time, 0.0)
+
+def day_bucket(value: datetime) -> datetime:
+    """Truncate a timestamp to the start of its day"""
+    return datetime(value.year, value.month, value.day)
+
+def issue_key(title: Optional[str]) -> Optional[str]:
+    """First word of a ticket title, usable as a MongoDB field name"""
+    words = (title or "").split()
+    if not words:
+        return None
+    key = words[0].replace(".", "").lstrip("$")
+    return key or None
+
+def ticket_contribution(ticket: Dict, util_data: Optional[Dict], analysis: Optional[Dict]) -> Dict:
+    """Stats one ticket adds to its daily rows; empty unless the ticket is closed"""
+    if ticket.get('status') != 'closed':
+        return {}
+    stats: Dict = {"tickets": 1}
+    handling_time = calculate_handling_time(ticket, util_data or {})
+    if handling_time > 0:
+        stats["handlingTime"] = {"count": 1, "sum": handling_time, "sumSq": handling_time * handling_time, "sketch": sketch_of(handling_time)}
+    rating = (util_data or {}).get('customer_review_rating')
+    if rating:
+        stats["csat"] = {"count": 1, "sum": rating, "sumSq": rating * rating, "sketch": sketch_of(rating)}
+    if analysis:
+        stats["scores"] = {"count": 1, **{key: analysis[key] for key in SOLUTION_SCORE_KEYS if key in analysis}}
+    issue = issue_key(ticket.get('title'))
+    if issue:
+        stats["issues"] = {issue: 1}
+    return stats
+
+def merge_stats(target: Dict, source: Dict, sign: int = 1) -> Dict:
+    """Add (or with sign=-1 subtract) nested numeric stats into target"""
+    for key, value in source.items():
+        if isinstance(value, dict):
+            merge_stats(target.setdefault(key, {}), value, sign)
+        elif isinstance(value, (int, float)):
+            target[key] = target.get(key, 0) + sign * value
+    return target
+
+def _flatten_inc(stats: Dict, prefix: str = "") -> Dict:
+    inc = {}
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            inc.update(_flatten_inc(value, f"{prefix}{key}."))
+        elif value:
+            inc[f"{prefix}{key}"] = value
+    return inc
+
+def _row_keys(entry: Dict) -> List[tuple]:
+    return [(entry["companyId"], entry["agentId"], entry["day"]), (entry["companyId"], None, entry["day"])]
+
+def rollup_deltas(previous: Optional[Dict], current: Dict, deltas: Optional[Dict[tuple, Dict]] = None) -> Dict[tuple, Dict]:
+    """Per-row changes that replace a ticket's previous ledger contribution with the current one"""
+    deltas = {} if deltas is None else deltas
+    if previous and previous.get("stats"):
+        for key in _row_keys(previous):
+            merge_stats(deltas.setdefault(key, {}), previous["stats"], -1)
+    if current.get("stats"):
+        for key in _row_keys(current):
+            merge_stats(deltas.setdefault(key, {}), current["stats"])
+    return deltas
+
+def rollup_updates(deltas: Dict[tuple, Dict]) -> List[UpdateOne]:
+    """$inc upserts applying per-row changes to the rollup rows"""
+    updates = []
+    for (company_id, agent_id, day), delta in deltas.items():
+        inc = _flatten_inc(delta)
+        if inc:
+            updates.append(UpdateOne({"companyId": company_id, "agentId": agent_id, "day": day}, {"$inc": inc}, upsert=True))
+    return updates
+
+async def swap_ledger_entry(ticket: Dict, util_data: Optional[Dict], analysis: Optional[Dict]) -> tuple:
+    """Store the ticket's current contribution in the ledger, returning (previous, current) entries"""
+    current = {
+        "companyId": ticket.get('companyId'),
+        "agentId": ticket.get('agentId'),
+        "day": day_bucket(ticket['createdAt']) if ticket.get('createdAt') else None,
+        "stats": ticket_contribution(ticket, util_data, analysis) if ticket.get('createdAt') else {},
+    }
+    previous = await database.performanceledger.find_one_and_update(
+        {"_id": ticket['_id']},
+        {"$set": current},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    return previous, current
+
+async def apply_ticket_event(ticket_id: ObjectId, ticket: Optional[Dict] = None) -> bool:
+    """Recompute one ticket's contribution from MongoDB and apply the change to its rollup rows"""
+    if ticket is None:
+        ticket = await database.tickets.find_one({"_id": ticket_id}, TICKET_PROJECTION)
+        if not ticket:
+            return False
+    util_data, grade_doc = await asyncio.gather(
+        database.utiltickets.find_one({"ticketId": ticket_id}),
+        database.solutiongrades.find_one({"ticketId": ticket_id}, {"analysis": 1})
+    )
+    previous, current = await swap_ledger_entry(ticket, util_data, (grade_doc or {}).get('analysis'))
+    updates = rollup_updates(rollup_deltas(previous, current))
+    if updates:
+        await database.performancerollups.bulk_write(updates, ordered=False)
+    return True
+
+async def _apply_ticket_batch(tickets: List[Dict]) -> int:
+    ticket_ids = [ticket['_id'] for ticket in tickets]
+    util_docs, grade_docs = await asyncio.gather(
+        database.utiltickets.find({"ticketId": {"$in": ticket_ids}}).to_list(length=None),
+        database.solutiongrades.find({"ticketId": {"$in": ticket_ids}}, {"ticketId": 1, "analysis": 1}).to_list(length=None)
+    )
+    utils = {doc['ticketId']: doc for doc in util_docs}
+    grades = {doc['ticketId']: doc.get('analysis') for doc in grade_docs}
+    deltas: Dict[tuple, Dict] = {}
+    for previous, current in await asyncio.gather(*[
+        swap_ledger_entry(ticket, utils.get(ticket['_id']), grades.get(ticket['_id'])) for ticket in tickets
+    ]):
+        rollup_deltas(previous, current, deltas)
+    updates = rollup_updates(deltas)
+    if updates:
+        await database.performancerollups.bulk_write(updates, ordered=False)
+    return len(tickets)
+
+async def rebuild_company_rollups(company_id: ObjectId) -> Dict:
+    """Reconcile every closed ticket of a company into its rollups, then mark the company ready
+
+    Safe to run while events are applied, because each ticket goes through the
+    same ledger swap.
+    """
+    batch_size = AI_CONFIG["PERFORMANCE_ROLLUPS"]["BATCH_SIZE"]
+    started = datetime.utcnow()
+    await database.performancerollupstate.update_one(
+        {"_id": str(company_id)}, {"$set": {"status": "building", "startedAt": started}}, upsert=True
+    )
+    processed = 0
+    try:
+        cursor = database.tickets.find({"companyId": company_id, "status": "closed"}, TICKET_PROJECTION).batch_size(batch_size)
+        batch = []
+        async for ticket in cursor:
+            batch.append(ticket)
+            if len(batch) >= batch_size:
+                processed += await _apply_ticket_batch(batch)
+                batch = []
+        if batch:
+            processed += await _apply_ticket_batch(batch)
+    except Exception as e:
+        print(f"Error rebuilding performance rollups for company {company_id}: {e}")
+        await database.performancerollupstate.update_one(
+            {"_id": str(company_id)}, {"$set": {"status": "failed", "error": str(e)}}
+        )
+        raise
+    state = {"status": "ready", "startedAt": started, "rebuiltAt": datetime.utcnow(), "tickets": processed}
+    await database.performancerollupstate.update_one({"_id": str(company_id)}, {"$set": state})
+    return state
+
+async def get_rollup_state(company_id: str) -> Optional[Dict]:
+    """Get the rebuild status of a company's rollups"""
+    return await database.performancerollupstate.find_one({"_id": company_id})
+
+async def load_rollup_stats(company_id: str, agent_id: Optional[str] = None, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> Optional[Dict[str, Dict]]:
+    """Merge daily rollup rows into per-agent stats, or None when the company's rollups are not ready
+
+    Date bounds are applied at day granularity.
+    """
+    state = await get_rollup_state(company_id)
+    if not state or state.get("status") != "ready":
+        return None
+
+    query: Dict = {"companyId": ObjectId(company_id), "agentId": ObjectId(agent_id) if agent_id else {"$ne": None}}
+    if start_date or end_date:
+        query["day"] = {}
+        if start_date:
+            query["day"]["$gte"] = day_bucket(start_date)
+        if end_date:
+            query["day"]["$lte"] = day_bucket(end_date)
+
+    stats_by_agent: Dict[str, Dict] = {}
+    async for row in database.performancerollups.find(query, {"_id": 0, "companyId": 0, "day": 0}):
+        agent_stats = stats_by_agent.setdefault(str(row.pop("agentId")), {})
+        merge_stats(agent_stats, row)
+    return {agent: stats for agent, stats in stats_by_agent.items() if stats.get("tickets", 0) > 0}
+
+async def sweep_utilticket_changes() -> int:
+    """Apply ticket events for utiltickets changed since the last sweep (ticket closed, review submitted)"""
+    state = await database.performancerollupstate.find_one({"_id": SWEEP_STATE_ID})
+    if not state:
+        await database.performancerollupstate.insert_one({"_id": SWEEP_STATE_ID, "updatedAt": datetime.utcnow(), "lastId": None})
+        return 0
+
+    checkpoint = {"$or": [{"updatedAt": {"$gt": state["updatedAt"]}}]}
+    if state.get("lastId"):
+        checkpoint["$or"].append({"updatedAt": state["updatedAt"], "_id": {"$gt": state["lastId"]}})
+    cursor = database.utiltickets.find(checkpoint, {"ticketId": 1, "updatedAt": 1}).sort(
+        [("updatedAt", ASCENDING), ("_id", ASCENDING)]
+    ).limit(AI_CONFIG["PERFORMANCE_ROLLUPS"]["BATCH_SIZE"])
+
+    applied = 0
+    async for util in cursor:
+        try:
+            await apply_ticket_event(util['ticketId'])
+        except Exception as e:
+            print(f"Error applying rollup event for ticket {util.get('ticketId')}: {e}")
+        await database.performancerollupstate.update_one(
+            {"_id": SWEEP_STATE_ID}, {"$set": {"updatedAt": util['updatedAt'], "lastId": util['_id']}}
+        )
+        applied += 1
+    return applied
+
+async def run_rollup_sweeper() -> None:
+    """Sweep utilticket changes into the rollups until cancelled"""
+    interval = AI_CONFIG["PERFORMANCE_ROLLUPS"]["SWEEP_INTERVAL_SECONDS"]
+    while True:
+        try:
+            if await sweep_utilticket_changes() >= AI_CONFIG["PERFORMANCE_ROLLUPS"]["BATCH_SIZE"]:
+                continue
+        except Exception as e:
+            print(f"Error sweeping performance rollup events: {e}")
+        await asyncio.sleep(interval)
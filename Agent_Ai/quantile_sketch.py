@@ -0,0 +1,50 @@
+"""
+DDSketch-style quantile sketches stored as plain bucket counts
+
+A positive value v falls in bucket ceil(log(v) / log(gamma)) with
+gamma = (1 + a) / (1 - a), and every bucket is reported by a value within
+relative accuracy a of anything it holds. A sketch is just {bucket: count}, so
+sketches merge (and, for the rollup ledger, un-merge) by adding counts, which
+MongoDB can do with $inc. Bucket keys are strings so they can be field names.
+
+Changing RELATIVE_ACCURACY changes the bucket boundaries; rebuild the rollups
+afterwards.
+"""
+import math
+from typing import Dict, Iterable
+
+from config import AI_CONFIG
+
+RELATIVE_ACCURACY = AI_CONFIG["QUANTILE_SKETCH"]["RELATIVE_ACCURACY"]
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+def bucket_index(value: float) -> int:
+    """Bucket holding a positive value"""
+    return math.ceil(math.log(value) / LOG_GAMMA)
+
+def bucket_value(index: int) -> float:
+    """Representative value of a bucket, within the relative accuracy of its contents"""
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+def sketch_of(value: float) -> Dict[str, int]:
+    """Sketch holding a single positive value"""
+    return {str(bucket_index(value)): 1}
+
+def sketch_quantiles(sketch: Dict[str, float], quantiles: Iterable[float] = DEFAULT_QUANTILES) -> Dict[str, float]:
+    """Estimate quantiles from a sketch, keyed p50/p90/p99"""
+    buckets = sorted((int(index), count) for index, count in sketch.items() if count > 0)
+    total = sum(count for _, count in buckets)
+    if not total:
+        return {}
+    estimates = {}
+    for quantile in quantiles:
+        rank = quantile * (total - 1)
+        cumulative = 0
+        for index, count in buckets:
+            cumulative += count
+            if cumulative > rank:
+                estimates[f"p{quantile * 100:g}"] = bucket_value(index)
+                break
+    return estimates
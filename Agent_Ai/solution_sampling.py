@@ -0,0 +1,108 @@
+"""
+Stratified sampling for estimating solution quality from a subset of tickets
+
+The sample size is the one a simple random sample would need to reach the
+target confidence-interval half-width, given a prior standard deviation and
+with the finite population correction. It is allocated proportionally across
+strata (at least min_per_stratum each, so every stratum's variance can be
+estimated). Tickets are streamed into a bounded reservoir per stratum that
+keeps the ones with the smallest seeded hash of their id, so the same seed and
+population always select the same tickets whatever order they arrive in.
+"""
+import hashlib
+import heapq
+import math
+import statistics
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional
+
+def z_score(confidence: float) -> float:
+    """Two-sided normal critical value for a confidence level"""
+    return statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+def required_sample_size(population: int, stddev: float, margin: float, confidence: float) -> int:
+    """Sample size needed for a mean's interval half-width to reach `margin`"""
+    if population <= 0:
+        return 0
+    n0 = (z_score(confidence) * stddev / margin) ** 2
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+def time_bucket(value: datetime, start: datetime, end: datetime, buckets: int) -> int:
+    """Equal-width time bucket of a timestamp within [start, end]"""
+    span = (end - start).total_seconds()
+    if span <= 0 or buckets <= 1:
+        return 0
+    return min(int((value - start).total_seconds() / span * buckets), buckets - 1)
+
+def allocate_sample(strata_sizes: Dict[Hashable, int], sample_size: int, min_per_stratum: int = 2) -> Dict[Hashable, int]:
+    """Split a sample across strata in proportion to their size (largest remainder)"""
+    population = sum(strata_sizes.values())
+    if not population or sample_size <= 0:
+        return {stratum: 0 for stratum in strata_sizes}
+    quotas = {stratum: sample_size * size / population for stratum, size in strata_sizes.items()}
+    allocation = {stratum: min(size, max(int(quotas[stratum]), min_per_stratum)) for stratum, size in strata_sizes.items()}
+    remaining = sample_size - sum(allocation.values())
+    for stratum in sorted(quotas, key=lambda key: quotas[key] - int(quotas[key]), reverse=True):
+        if remaining <= 0:
+            break
+        if allocation[stratum] < strata_sizes[stratum]:
+            allocation[stratum] += 1
+            remaining -= 1
+    return allocation
+
+class StratumReservoir:
+    """Uniform sample of at most `capacity` members of a stream, with the stream's size"""
+
+    def __init__(self, capacity: int, seed: int):
+        self.capacity = capacity
+        self.seed = seed
+        self.size = 0
+        self._heap: List = []
+
+    def add(self, member: Hashable) -> None:
+        self.size += 1
+        key = int.from_bytes(hashlib.blake2b(f"{self.seed}:{member}".encode(), digest_size=8).digest(), "big")
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, (-key, str(member), member))
+        elif key < -self._heap[0][0]:
+            heapq.heapreplace(self._heap, (-key, str(member), member))
+
+    def draw(self, count: int) -> List:
+        """The `count` kept members with the smallest keys, a uniform sample without replacement"""
+        return [member for _, _, member in sorted(self._heap, reverse=True)[:count]]
+
+def draw_stratified_sample(reservoirs: Dict[Hashable, StratumReservoir], allocation: Dict[Hashable, int]) -> Dict[Hashable, List]:
+    """Draw each stratum's allocation from its reservoir"""
+    return {stratum: reservoir.draw(allocation.get(stratum, 0)) for stratum, reservoir in reservoirs.items()}
+
+def stratified_estimate(strata_sizes: Dict[Hashable, int], samples: Dict[Hashable, List[float]], confidence: float) -> Optional[Dict]:
+    """Stratified mean with its confidence interval
+
+    Strata with no observations are left out and the weights renormalised.
+    Strata with a single observation borrow the pooled within-stratum variance.
+    """
+    observed = {stratum: values for stratum, values in samples.items() if values}
+    if not observed:
+        return None
+    population = sum(strata_sizes[stratum] for stratum in observed)
+    multi = [values for values in observed.values() if len(values) > 1]
+    pooled_variance = statistics.mean(statistics.variance(values) for values in multi) if multi else 0.0
+
+    mean = 0.0
+    variance = 0.0
+    for stratum, values in observed.items():
+        weight = strata_sizes[stratum] / population
+        stratum_variance = statistics.variance(values) if len(values) > 1 else pooled_variance
+        fpc = 1 - len(values) / strata_sizes[stratum]
+        mean += weight * statistics.mean(values)
+        variance += weight ** 2 * fpc * stratum_variance / len(values)
+
+    margin = z_score(confidence) * math.sqrt(variance)
+    return {
+        "mean": mean,
+        "ci_low": mean - margin,
+        "ci_high": mean + margin,
+        "margin": margin,
+        "sample_size": sum(len(values) for values in observed.values()),
+        "population_covered": population,
+    }
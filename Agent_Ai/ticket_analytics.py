@@ -0,0 +1,247 @@
+"""
+Company analytics over AI ticket analyses
+
+`companyanalytics` keeps one materialized document per company with the
+number of analyses and their category and priority counts. It is updated with
+$inc whenever this service saves an analysis, so the dashboard read is a single
+point lookup. A company without a seeded document is seeded on first read from
+the live $facet aggregation, and the rebuild endpoint recomputes it from
+aitickets if it is ever in doubt. Analyses the Node server writes to aitickets
+itself (createAITicket upserts and can change priority_rate) are only picked
+up by a rebuild.
+
+Saves and rebuilds are fenced on the company document. A save pushes a
+timestamped reservation onto `reservations` before inserting into aitickets
+and pulls it together with the counts afterwards, and every write increments
+`version`. A rebuild waits until no reservation is live, aggregates, and
+writes only if `version` is unchanged, retrying otherwise. So every analysis
+is counted exactly once, whether it lands before, during or after the
+rebuild's aggregation. A reservation older than RESERVATION_LEASE_SECONDS is
+treated as left behind by a crashed save: rebuilds ignore it and drop it when
+they write. If saves keep the company busy for all REBUILD_ATTEMPTS, the last
+attempt writes unconditionally and drops every reservation. A save whose
+reservation cannot be written still inserts its analysis; only the fence is
+lost, and the next rebuild corrects any double count.
+
+Trends come from `analyticsbuckets`, one small row per company and day with
+the same counts, appended to with an $inc upsert on every save. Weekly and
+monthly trends merge the daily rows, so a year is at most 366 rows read.
+Rows are rebuilt together with the company document.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+from config import AI_CONFIG
+from performance_rollups import day_bucket
+
+database = None
+
+TREND_GRANULARITIES = ("day", "week", "month")
+
+def initialize_ticket_analytics(db):
+    """Initialize MongoDB connection for ticket analytics"""
+    global database
+    database = db
+
+async def ensure_ticket_analytics_indexes():
+    """Create the trend row index; the aggregations use the Node model's {companyId, priority_rate} index"""
+    await database.analyticsbuckets.create_index([("companyId", ASCENDING), ("day", ASCENDING)], name="analytics_bucket_day", unique=True)
+
+def field_key(value: Any) -> str:
+    """Turn a category or priority into a string usable as a MongoDB field name"""
+    if value is None:
+        return "unknown"
+    return str(value).replace(".", "_").lstrip("$") or "unknown"
+
+def company_analytics_pipeline(company_oid: ObjectId) -> List[Dict]:
+    """Single-pass aggregation of a company's analysis count and category and priority distributions"""
+    return [
+        {"$match": {"companyId": company_oid}},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+            "priorities": [{"$group": {"_id": "$priority_rate", "count": {"$sum": 1}}}]
+        }}
+    ]
+
+async def compute_company_analytics(company_id: str) -> Dict:
+    """Compute a company's analytics from aitickets"""
+    result = await database.aitickets.aggregate(company_analytics_pipeline(ObjectId(company_id))).to_list(length=1)
+    facets = result[0] if result else {}
+    total = facets.get("total", [])
+    return {
+        "totalAnalyzed": total[0]["count"] if total else 0,
+        "categories": {field_key(stat["_id"]): stat["count"] for stat in facets.get("categories", [])},
+        "priorities": {field_key(stat["_id"]): stat["count"] for stat in facets.get("priorities", [])}
+    }
+
+def daily_buckets_pipeline(company_oid: ObjectId) -> List[Dict]:
+    """Aggregation counting a company's analyses per day, category and priority"""
+    return [
+        {"$match": {"companyId": company_oid}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$createdAt"}},
+                "category": "$category",
+                "priority": "$priority_rate"
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+
+async def rebuild_trend_buckets(company_id: str) -> int:
+    """Recompute a company's daily trend rows from aitickets, returning the number of rows"""
+    company_oid = ObjectId(company_id)
+    groups = await database.aitickets.aggregate(daily_buckets_pipeline(company_oid)).to_list(length=None)
+    rows: Dict[str, Dict] = {}
+    for group in groups:
+        if not group["_id"].get("day"):
+            continue
+        row = rows.setdefault(group["_id"]["day"], {"total": 0, "categories": {}, "priorities": {}})
+        row["total"] += group["count"]
+        for field, value in (("categories", group["_id"].get("category")), ("priorities", group["_id"].get("priority"))):
+            row[field][field_key(value)] = row[field].get(field_key(value), 0) + group["count"]
+
+    days = {day: datetime.strptime(day, "%Y-%m-%d") for day in rows}
+    if rows:
+        await database.analyticsbuckets.bulk_write([
+            ReplaceOne(
+                {"companyId": company_oid, "day": days[day]},
+                {"companyId": company_oid, "day": days[day], **row},
+                upsert=True
+            )
+            for day, row in rows.items()
+        ], ordered=False)
+    await database.analyticsbuckets.delete_many({"companyId": company_oid, "day": {"$nin": list(days.values())}})
+    return len(rows)
+
+async def rebuild_company_analytics(company_id: str) -> Dict:
+    """Recompute a company's materialized analytics document and trend rows from aitickets"""
+    company_oid = ObjectId(company_id)
+    config = AI_CONFIG["COMPANY_ANALYTICS"]
+    for attempt in range(config["REBUILD_ATTEMPTS"]):
+        forced = attempt == config["REBUILD_ATTEMPTS"] - 1
+        lease_cutoff = datetime.utcnow() - timedelta(seconds=config["RESERVATION_LEASE_SECONDS"])
+        state = await database.companyanalytics.find_one({"_id": company_oid}, {"version": 1, "reservations": 1}) or {}
+        live = [reservation for reservation in state.get("reservations", []) if reservation["at"] > lease_cutoff]
+        if live and not forced:
+            await asyncio.sleep(config["REBUILD_RETRY_SECONDS"])
+            continue
+        if forced:
+            print(f"Rebuilding company analytics for {company_id} without a quiet window")
+
+        analytics = await compute_company_analytics(company_id)
+        await rebuild_trend_buckets(company_id)
+        fields = {**analytics, "trendsSeeded": True, "updatedAt": datetime.utcnow()}
+        update = {"$set": fields, "$inc": {"version": 1}, "$unset": {"inflight": ""}}
+        if forced:
+            fields["reservations"] = []
+        else:
+            update["$pull"] = {"reservations": {"at": {"$lte": lease_cutoff}}}
+        guard = {"_id": company_oid} if forced else {"_id": company_oid, "version": state.get("version")}
+        try:
+            result = await database.companyanalytics.update_one(guard, update, upsert=True)
+        except DuplicateKeyError:
+            continue
+        if result.matched_count or result.upserted_id is not None:
+            return analytics
+        await asyncio.sleep(config["REBUILD_RETRY_SECONDS"])
+    return analytics
+
+async def load_company_analytics(company_id: str) -> Dict:
+    """Read a company's materialized analytics, seeding it (and its trend rows) from aitickets on first use"""
+    doc = await database.companyanalytics.find_one({"_id": ObjectId(company_id)})
+    if doc and doc.get("trendsSeeded"):
+        return doc
+    return await rebuild_company_analytics(company_id)
+
+async def reserve_ticket_analysis(company_oid: ObjectId) -> Optional[ObjectId]:
+    """Mark an analysis save as in flight before it is inserted, so a concurrent rebuild waits for it
+
+    Returns the reservation id to pass to record_ticket_analysis, or None if
+    it could not be written; the save should go ahead either way.
+    """
+    reservation = ObjectId()
+    try:
+        await database.companyanalytics.update_one(
+            {"_id": company_oid},
+            {"$push": {"reservations": {"id": reservation, "at": datetime.utcnow()}}, "$inc": {"version": 1}},
+            upsert=True
+        )
+        return reservation
+    except Exception as e:
+        print(f"Error reserving company analytics update: {e}")
+        return None
+
+async def record_ticket_analysis(analysis_data: Dict, reservation: Optional[ObjectId] = None, saved: bool = True) -> None:
+    """Count a saved analysis into its company's materialized analytics and daily trend row, ending its reservation"""
+    counts = {
+        f"categories.{field_key(analysis_data.get('category'))}": 1,
+        f"priorities.{field_key(analysis_data.get('priority_rate'))}": 1
+    }
+    try:
+        update = {
+            "$inc": {"version": 1, **({"totalAnalyzed": 1, **counts} if saved else {})},
+            "$set": {"updatedAt": datetime.utcnow()}
+        }
+        if reservation:
+            update["$pull"] = {"reservations": {"id": reservation}}
+        await database.companyanalytics.update_one({"_id": analysis_data["companyId"]}, update, upsert=True)
+        if saved:
+            await database.analyticsbuckets.update_one(
+                {"companyId": analysis_data["companyId"], "day": day_bucket(analysis_data.get("createdAt") or datetime.utcnow())},
+                {"$inc": {"total": 1, **counts}},
+                upsert=True
+            )
+    except Exception as e:
+        print(f"Error updating company analytics: {e}")
+
+def period_start(day: datetime, granularity: str) -> datetime:
+    """Start of the day, week (Monday) or month a day falls in"""
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+def _add_counts(target: Dict, source: Dict) -> None:
+    for key, count in source.items():
+        target[key] = target.get(key, 0) + count
+
+async def load_company_trends(company_id: str, granularity: str = "day", start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> List[Dict]:
+    """Get category and priority counts per day, week or month from the daily trend rows"""
+    await load_company_analytics(company_id)
+    query: Dict = {"companyId": ObjectId(company_id)}
+    if start_date or end_date:
+        query["day"] = {}
+        if start_date:
+            query["day"]["$gte"] = day_bucket(start_date)
+        if end_date:
+            query["day"]["$lte"] = end_date
+    rows = await database.analyticsbuckets.find(query, {"_id": 0, "companyId": 0}).sort("day", ASCENDING).to_list(length=None)
+
+    buckets: Dict[datetime, Dict] = {}
+    for row in rows:
+        start = period_start(row["day"], granularity)
+        bucket = buckets.setdefault(start, {"period_start": start, "total": 0, "categories": {}, "priorities": {}})
+        bucket["total"] += row.get("total", 0)
+        _add_counts(bucket["categories"], row.get("categories", {}))
+        _add_counts(bucket["priorities"], row.get("priorities", {}))
+    return list(buckets.values())
+
+def analytics_response(company_id: str, analytics: Dict, source: Optional[str] = None) -> Dict:
+    """Shape analytics counts like the /company-analytics response"""
+    response = {
+        "company_id": company_id,
+        "total_tickets_analyzed": analytics.get("totalAnalyzed", 0),
+        "category_distribution": analytics.get("categories", {}),
+        "priority_distribution": analytics.get("priorities", {})
+    }
+    if source:
+        response["source"] = source
+    return response
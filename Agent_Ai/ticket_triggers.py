@@ -0,0 +1,181 @@
+"""
+Compiled ticket trigger matching for the customer chatbot
+
+Phrases are matched at word starts. The query is lowercased and encoded once,
+every character other than a letter or digit becomes a space, and one trie
+regex anchored on a literal space finds every phrase that starts a word,
+overlapping ones included. When several phrases fire, the one the old per-phrase scan would
+have reported wins: the first rule in RULE_PRIORITY, then the first phrase in
+that rule's list.
+"""
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from config import AI_CONFIG
+
+TRIGGER_SET_KEYS = ["help_indicators", "distress_signals", "complaint_words"]
+RULE_PRIORITY = ["help_indicator", "distress_signal", "complaint"]
+
+_WORD_BYTES = bytes(
+    byte if chr(byte).isascii() and chr(byte).isalnum() or byte >= 0x80 else ord(" ")
+    for byte in range(256)
+)
+_NON_WORD = re.compile(r"[\W_]")
+
+_lock = threading.Lock()
+_default_matcher = None
+_company_trigger_sets: Dict[str, Dict] = {}
+_company_matchers: Dict[str, "TriggerMatcher"] = {}
+_version = 0
+
+def _normalize(text: str) -> bytes:
+    """Lowercase and encode text with every non-alphanumeric character turned into a space"""
+    if not text.isascii():
+        text = _NON_WORD.sub(" ", text)
+    return text.lower().encode("utf-8").translate(_WORD_BYTES)
+
+def _trie_pattern(phrases: List[str]) -> str:
+    """Build a regex from a character trie so shared prefixes are only tested once"""
+    trie: Dict = {}
+    for phrase in phrases:
+        node = trie
+        for char in phrase:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def build(node: Dict) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return "(?:" + pattern + ")?" if "" in node else pattern
+
+    return build(trie)
+
+def _compile_phrases(phrases: List[bytes]) -> Optional[re.Pattern]:
+    """Compile normalized phrases into one pattern capturing the longest phrase at every word start"""
+    if not phrases:
+        return None
+    trie = _trie_pattern([phrase.decode("latin-1") for phrase in sorted(set(phrases))])
+    return re.compile((" (?=(" + trie + "))").encode("latin-1"))
+
+class TriggerMatcher:
+    """Precompiled matcher for one ticket trigger set"""
+
+    def __init__(self, help_indicators: List[str], distress_signals: List[str], complaint_words: List[str], version: int = 0):
+        self.help_indicators = list(help_indicators)
+        self.distress_signals = list(distress_signals)
+        self.complaint_words = list(complaint_words)
+        self.version = version
+
+        ranked: Dict[bytes, Tuple[int, int, str]] = {}
+        for priority, phrases in enumerate((self.help_indicators, self.distress_signals, self.complaint_words)):
+            for position, phrase in enumerate(phrases):
+                key = _normalize(phrase).strip()
+                if key:
+                    ranked[key] = min(ranked.get(key, (priority, position, phrase.lower())), (priority, position, phrase.lower()))
+        # A hit is the longest phrase at its word start; every phrase that is a prefix of it fired there too
+        self._hit_ranks = {
+            hit: min(rank for key, rank in ranked.items() if hit.startswith(key))
+            for hit in ranked
+        }
+        self._keyword_pattern = _compile_phrases(list(ranked))
+
+        complex_words = {_normalize(word).strip(): word.lower() for word in AI_CONFIG["TICKET"]["COMPLEX_ISSUE_WORDS"]}
+        complex_words.pop(b"", None)
+        self._complex_words = complex_words
+        self._complex_pattern = _compile_phrases(list(complex_words))
+        self._complex_min_length = AI_CONFIG["TICKET"]["COMPLEX_ISSUE_MIN_LENGTH"]
+
+    def match_keywords(self, query: str) -> Optional[Dict]:
+        """Return the highest-priority rule that fires without needing knowledge base context"""
+        hits = self._keyword_pattern.findall(b" " + _normalize(query)) if self._keyword_pattern else None
+        if hits:
+            priority, _, phrase = min(map(self._hit_ranks.__getitem__, hits))
+            return {"rule": RULE_PRIORITY[priority], "trigger": phrase}
+        if "!!!" in query:
+            return {"rule": "emotional_intensity", "trigger": "!!!"}
+        if query.isupper() and len(query) > 10:
+            return {"rule": "emotional_intensity", "trigger": "all_caps"}
+        return None
+
+    def match_complex_issue(self, query: str, context_chunks: List[str]) -> Optional[Dict]:
+        """Fire when a long problem report has no knowledge base context to answer it"""
+        if context_chunks or len(query) <= self._complex_min_length or not self._complex_pattern:
+            return None
+        hit = self._complex_pattern.search(b" " + _normalize(query))
+        if hit:
+            return {"rule": "complex_issue", "trigger": self._complex_words[hit.group(1)]}
+        return None
+
+    def match(self, query: str, context_chunks: List[str]) -> Optional[Dict]:
+        """Return the rule that fired for the query, or None"""
+        return self.match_keywords(query) or self.match_complex_issue(query, context_chunks)
+
+    def describe(self) -> Dict:
+        """Describe the trigger set this matcher was built from"""
+        return {
+            "version": self.version,
+            "help_indicators": self.help_indicators,
+            "distress_signals": self.distress_signals,
+            "complaint_words": self.complaint_words,
+        }
+
+def _default_trigger_set() -> Dict[str, List[str]]:
+    ticket_config = AI_CONFIG["TICKET"]
+    return {
+        "help_indicators": ticket_config["HELP_INDICATORS"],
+        "distress_signals": ticket_config["DISTRESS_SIGNALS"],
+        "complaint_words": ticket_config["COMPLAINT_WORDS"],
+    }
+
+def _build_matcher(trigger_set: Optional[Dict] = None) -> TriggerMatcher:
+    """Build a matcher, merging a company trigger set with the defaults"""
+    phrases = _default_trigger_set()
+    if trigger_set:
+        replace = trigger_set.get("mode") == "replace"
+        for key in TRIGGER_SET_KEYS:
+            if key in trigger_set and trigger_set[key] is not None:
+                phrases[key] = list(trigger_set[key]) if replace else phrases[key] + list(trigger_set[key])
+    return TriggerMatcher(phrases["help_indicators"], phrases["distress_signals"], phrases["complaint_words"], version=_version)
+
+def get_trigger_matcher(company_id: Optional[str] = None) -> TriggerMatcher:
+    """Get the compiled matcher for a company, falling back to the default set"""
+    global _default_matcher
+    if company_id:
+        matcher = _company_matchers.get(company_id)
+        if matcher is not None:
+            return matcher
+    if _default_matcher is None:
+        with _lock:
+            if _default_matcher is None:
+                _default_matcher = _build_matcher()
+    return _default_matcher
+
+def set_company_triggers(company_id: str, trigger_set: Optional[Dict]) -> TriggerMatcher:
+    """Install or remove the trigger set for one company"""
+    global _version
+    with _lock:
+        _version += 1
+        if trigger_set:
+            _company_trigger_sets[company_id] = trigger_set
+            _company_matchers[company_id] = _build_matcher(trigger_set)
+        else:
+            _company_trigger_sets.pop(company_id, None)
+            _company_matchers.pop(company_id, None)
+    return get_trigger_matcher(company_id)
+
+def reload_triggers(company_trigger_sets: Optional[Dict[str, Dict]] = None) -> int:
+    """Rebuild every matcher, optionally replacing all company trigger sets"""
+    global _default_matcher, _company_matchers, _company_trigger_sets, _version
+    with _lock:
+        _version += 1
+        if company_trigger_sets is not None:
+            _company_trigger_sets = dict(company_trigger_sets)
+        _default_matcher = _build_matcher()
+        _company_matchers = {
+            company_id: _build_matcher(trigger_set)
+            for company_id, trigger_set in _company_trigger_sets.items()
+        }
+    return _version
@@ -0,0 +1,255 @@
+"""
+W3C trace-context propagation and span export
+
+`TracingMiddleware` reads the `traceparent` header sent by the Node gateway and
+opens a server span that continues the caller's trace. Requests without the
+header start a new trace, sampled at SAMPLE_RATIO. The active span is kept in a
+context variable, so it follows work into asyncio.to_thread, tasks and
+background tasks. Every `metrics.stage` (Mongo wrappers, embeddings, Pinecone,
+Gemini, prompt building) opens a child span of it. Outside a sampled trace no
+span is created.
+
+Finished spans are buffered in memory and appended by `run_span_exporter` to
+EXPORT_PATH as JSON lines in the OTLP/JSON trace format. The file can be read
+directly or tailed by a local OpenTelemetry collector (otlpjsonfile receiver).
+It is rotated once it would grow past MAX_EXPORT_BYTES, keeping EXPORT_BACKUPS
+old files. Spans that arrive while the buffer is full are dropped and counted
+on /metrics.
+
+Tracing is off unless TRACING_ENABLED is set, and new traces are sampled at a
+low SAMPLE_RATIO; a caller's traceparent decides sampling for its own traces.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from config import AI_CONFIG
+
+TRACEPARENT_PATTERN = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_ERROR = 2
+
+class Span:
+    """One timed operation of a trace"""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace_id: str, parent_span_id: Optional[str], name: str, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict] = None):
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        span_exporter.export(self)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        if self.error:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+def new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """Parse a W3C traceparent header into (trace id, parent span id, sampled), or None if invalid"""
+    if not header:
+        return None
+    match = TRACEPARENT_PATTERN.match(header.strip().lower())
+    if not match:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+@contextmanager
+def start_span(name: str, attributes: Optional[Dict] = None):
+    """Open a child span of the current span for the enclosed block; a no-op outside a sampled trace"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    span = Span(parent.trace_id, parent.span_id, name, attributes=attributes)
+    token = current_span.set(span)
+    error = None
+    try:
+        yield span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        span.finish(error)
+
+class SpanExporter:
+    """In-memory buffer of finished spans flushed as OTLP/JSON lines to a file"""
+
+    def __init__(self):
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            if len(self._spans) >= AI_CONFIG["TRACING"]["MAX_BUFFERED_SPANS"]:
+                self.dropped += 1
+                return
+            self._spans.append(span)
+
+    def drain(self) -> List[Span]:
+        with self._lock:
+            spans, self._spans = self._spans, []
+        return spans
+
+    def flush(self) -> int:
+        """Append buffered spans to the export file as one OTLP/JSON request line, returning the count"""
+        spans = self.drain()
+        if not spans:
+            return 0
+        config = AI_CONFIG["TRACING"]
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": config["SERVICE_NAME"]}}]},
+            "scopeSpans": [{"scope": {"name": "agent_ai.tracing"}, "spans": [span.to_otlp() for span in spans]}]
+        }]})
+        directory = os.path.dirname(config["EXPORT_PATH"])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._rotate_if_full(config["EXPORT_PATH"], len(line) + 1)
+        with open(config["EXPORT_PATH"], "a", encoding="utf-8") as export_file:
+            export_file.write(line + "\n")
+        self.exported += len(spans)
+        return len(spans)
+
+    def _rotate_if_full(self, path: str, incoming: int) -> None:
+        config = AI_CONFIG["TRACING"]
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        if size + incoming <= config["MAX_EXPORT_BYTES"]:
+            return
+        backups = config["EXPORT_BACKUPS"]
+        if backups <= 0:
+            os.remove(path)
+            return
+        for index in range(backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        os.replace(path, f"{path}.1")
+
+    def render_prometheus(self) -> str:
+        """Render the exported and dropped span counters in the Prometheus text exposition format"""
+        return "\n".join([
+            "# HELP trace_spans_exported_total Finished spans written to the trace export file",
+            "# TYPE trace_spans_exported_total counter",
+            f"trace_spans_exported_total {self.exported}",
+            "# HELP trace_spans_dropped_total Finished spans dropped because the export buffer was full",
+            "# TYPE trace_spans_dropped_total counter",
+            f"trace_spans_dropped_total {self.dropped}",
+        ]) + "\n"
+
+span_exporter = SpanExporter()
+
+async def run_span_exporter():
+    """Periodically flush finished spans to the export file"""
+    try:
+        while True:
+            await asyncio.sleep(AI_CONFIG["TRACING"]["FLUSH_INTERVAL_SECONDS"])
+            try:
+                await asyncio.to_thread(span_exporter.flush)
+            except Exception as e:
+                print(f"Error exporting trace spans: {e}")
+    finally:
+        span_exporter.flush()
+
+class TracingMiddleware:
+    """ASGI middleware continuing the caller's W3C trace with a server span per HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        config = AI_CONFIG["TRACING"]
+        if scope["type"] != "http" or not config["ENABLED"]:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        if parent:
+            trace_id, parent_span_id, sampled = parent
+        else:
+            trace_id, parent_span_id, sampled = new_trace_id(), None, random.random() < config["SAMPLE_RATIO"]
+        if not sampled:
+            return await self.app(scope, receive, send)
+
+        span = Span(trace_id, parent_span_id, scope["method"], kind=SPAN_KIND_SERVER, attributes={"http.method": scope["method"], "http.target": scope["path"]})
+        token = current_span.set(span)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.attributes["http.status_code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"traceresponse", span.traceparent().encode("latin-1"))]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                span.name = f"{scope['method']} {route}"
+                span.attributes["http.route"] = route
+            if error is None and span.attributes.get("http.status_code", 500) >= 500:
+                span.error = f"HTTP {span.attributes.get('http.status_code', 500)}"
+            span.finish(error)
@@ -3,6 +3,7 @@ import { AppModule } from './app.module';
 import { TrpcRouter } from './trpc/trpc.router';
 import * as Mongoose from 'mongoose';
 import { OAuthCallbackLogger } from './middleware/oauth-callback-logger';
+import { TraceContextMiddleware } from './middleware/trace-context';
 import { Request, Response, NextFunction } from 'express';
 
 async function bootstrap() {
@@ -35,6 +36,8 @@ async function bootstrap() {
   await Mongoose.connect(process.env.MONGO_DB!);
   console.log("Connected to MongoDB successfully.");
   const app = await NestFactory.create(AppModule);
+  const traceContext = new TraceContextMiddleware();
+  app.use((req: Request, res: Response, next: NextFunction) => traceContext.use(req, res, next));
   app.use((req: Request, res: Response, next: NextFunction) => {
     try {
       const oauthLogger = new OAuthCallbackLogger();
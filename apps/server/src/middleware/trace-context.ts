@@ -0,0 +1,25 @@
+import { Injectable, NestMiddleware } from '@nestjs/common';
+import { Request, Response, NextFunction } from 'express';
+import { AsyncLocalStorage } from 'async_hooks';
+
+export interface TraceContext {
+  traceparent: string;
+  tracestate?: string;
+}
+
+// W3C trace context of the incoming request, visible to everything the request awaits
+export const traceContextStorage = new AsyncLocalStorage<TraceContext>();
+
+const TRACEPARENT_PATTERN = /^[0-9a-f]{2}-[0-9a-f]{32}-[0-9a-f]{16}-[0-9a-f]{2}$/;
+
+// This server does not record spans, so it forwards the caller's context unchanged
+@Injectable()
+export class TraceContextMiddleware implements NestMiddleware {
+  use(req: Request, res: Response, next: NextFunction) {
+    const traceparent = req.header('traceparent')?.trim().toLowerCase();
+    if (!traceparent || !TRACEPARENT_PATTERN.test(traceparent)) {
+      return next();
+    }
+    traceContextStorage.run({ traceparent, tracestate: req.header('tracestate') }, next);
+  }
+}
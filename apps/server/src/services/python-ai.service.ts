@@ -2,6 +2,7 @@ import { HttpService } from '@nestjs/axios';
 import { Injectable, Logger } from '@nestjs/common';
 import { ConfigService } from '@nestjs/config';
 import { firstValueFrom } from 'rxjs';
+import { traceContextStorage } from '../middleware/trace-context';
 import { AIResponse, PythonAIChatRequest, PythonAIChatResponse, AgentAIRequest, AgentAIResponse, AgentTicketAIRequest } from '../types/ai-types';
 
 export interface HealthCheckResponse {
@@ -25,7 +26,25 @@ export class PythonAIService {
   ) {
     this.pythonServiceUrl = this.configService.get<string>('PYTHON_AI_SERVICE_URL') || 'http://localhost:8000';
     this.logger.log(`Python AI Service URL: ${this.pythonServiceUrl}`);
+    this.httpService.axiosRef.interceptors.request.use((config) => {
+      const traceContext = traceContextStorage.getStore();
+      if (traceContext && config.url?.startsWith(this.pythonServiceUrl) && !config.headers.has('traceparent')) {
+        config.headers.set('traceparent', traceContext.traceparent);
+        if (traceContext.tracestate) {
+          config.headers.set('tracestate', traceContext.tracestate);
+        }
+      }
+      return config;
+    });
+    this.httpService.axiosRef.interceptors.response.use((response) => {
+      const traceresponse = response.headers['traceresponse'];
+      if (traceresponse && response.config.url?.startsWith(this.pythonServiceUrl)) {
+        this.logger.debug(`Python AI trace ${String(traceresponse).split('-')[1]}`);
+      }
+      return response;
+    });
   }
+
   async checkHealth(): Promise<HealthCheckResponse> {
     try {
       this.logger.log(`Checking health of Python AI service at: ${this.pythonServiceUrl}/health`);